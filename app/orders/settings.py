@@ -111,6 +111,10 @@ DATABASES = {
     }
 }
 
+if 'postgresql' in (DATABASES['default']['ENGINE'] or ''):
+    # trigram lookups of the product search
+    INSTALLED_APPS.append('django.contrib.postgres')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -149,6 +153,9 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = path.join(BASE_DIR, 'static')
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = path.join(BASE_DIR, 'media')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -156,7 +163,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        # users.renderers.FastJSONRenderer encodes by orjson, floats are written differently, see the renderer
+        getenv('JSON_RENDERER', 'rest_framework.renderers.JSONRenderer'),
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
@@ -222,3 +230,56 @@ EMAIL_USE_TLS = False
 EMAIL_USE_SSL = True
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+
+# Catalogue import
+# uploads are stored and imported by `python manage.py run_catalogue_imports`
+CATALOGUE_IMPORT_IN_BACKGROUND = getenv('CATALOGUE_IMPORT_IN_BACKGROUND', 'False') == 'True'
+# number of processes validating goods of an import, 0 or 1 - validation in the importing process
+CATALOGUE_IMPORT_WORKERS = int(getenv('CATALOGUE_IMPORT_WORKERS', 0))
+# seconds after which a running import is considered interrupted (its worker died) and marked as failed,
+# must be longer than the longest import
+CATALOGUE_IMPORT_TIMEOUT = int(getenv('CATALOGUE_IMPORT_TIMEOUT', 2 * 60 * 60))
+
+# pulling of shop catalogues from Shop.url by `python manage.py sync_shop_catalogues`
+CATALOGUE_SYNC_INTERVAL = int(getenv('CATALOGUE_SYNC_INTERVAL', 24 * 60 * 60))
+CATALOGUE_SYNC_WORKERS = int(getenv('CATALOGUE_SYNC_WORKERS', 8))
+
+# process-local name -> id cache of categories, products, parameters and their values
+NAME_CACHE_SIZE = int(getenv('NAME_CACHE_SIZE', 50000))
+NAME_CACHE_CHECK_INTERVAL = float(getenv('NAME_CACHE_CHECK_INTERVAL', 5))
+
+# text search configuration of the product search on postgres
+SEARCH_CONFIG = getenv('SEARCH_CONFIG', 'russian')
+
+# the largest page size a client can ask for by ?page_size=
+MAX_PAGE_SIZE = int(getenv('MAX_PAGE_SIZE', 100))
+
+# cache of the public catalogue responses (/products/, /categories/, /shops/), local memory by default,
+# the responses are cached by the catalogue version, which is stored in the database and shared by all processes
+CACHES = {
+    'default': {
+        'BACKEND': getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': getenv('CACHE_LOCATION', ''),
+    }
+}
+RESPONSE_CACHE_TIMEOUT = int(getenv('RESPONSE_CACHE_TIMEOUT', 10 * 60))
+
+# answer the product list from the denormalized product cards, run `python manage.py rebuild_product_cards` first
+PRODUCT_CARDS = getenv('PRODUCT_CARDS', 'False') == 'True'
+
+# build product, basket and order responses from values() instead of the nested DRF serializers
+FAST_SERIALIZERS = getenv('FAST_SERIALIZERS', 'False') == 'True'
+
+# bounds of the price ranges and the number of values of every parameter in /products/facets/
+FACET_PRICE_BUCKETS = [int(bound) for bound in getenv('FACET_PRICE_BUCKETS', '1000,5000,10000,50000,100000').split(',')
+                       if bound.strip()]
+FACET_VALUES_LIMIT = int(getenv('FACET_VALUES_LIMIT', 20))
+
+# rows read and serialized at once by streamed lists (?stream=true)
+STREAM_CHUNK_SIZE = int(getenv('STREAM_CHUNK_SIZE', 1000))
+
+# hold the stock of basket items for STOCK_HOLD_TTL seconds when they are added, so the checkout does not fail
+# on stock taken by other baskets, expired holds have to be released on a schedule by
+# `python manage.py release_stock_holds`, /products/ responses are not cached with holds
+STOCK_HOLDS = getenv('STOCK_HOLDS', 'False') == 'True'
+STOCK_HOLD_TTL = int(getenv('STOCK_HOLD_TTL', 15 * 60))
@@ -20,7 +20,8 @@ from django_rest_passwordreset.views import reset_password_request_token
 from rest_framework.routers import DefaultRouter
 from users.views import UserViewSet, ConfirmEmailView, PartnerProductView, \
     PartnerStateView, ShopView, CategoryView, ProductView, ContactView, \
-    BasketView, OrderViewSet, BuyerSellerOrderView, PartnerOrderView, AuthenticateView, CustomResetPasswordConfirm
+    BasketView, OrderViewSet, BuyerSellerOrderView, PartnerOrderView, AuthenticateView, CustomResetPasswordConfirm, \
+    PartnerCatalogueImportView
 
 router = DefaultRouter()
 router.register('partner/products', PartnerProductView, basename='partner')
@@ -31,6 +32,7 @@ router.register('user/contact', ContactView, basename='contacts')
 router.register('order', OrderViewSet, basename='order')
 router.register('order/seller_order', BuyerSellerOrderView, basename='buyer_seller_order')
 router.register('partner/orders', PartnerOrderView, basename='partner_orders')
+router.register('partner/imports', PartnerCatalogueImportView, basename='partner_imports')
 
 urlpatterns = [
     path('', include('social_django.urls', namespace='social')),
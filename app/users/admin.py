@@ -2,7 +2,7 @@ from django.contrib.admin import register as admin_register, ModelAdmin, Tabular
 from django.contrib.auth.admin import UserAdmin
 from .models import User, ConfirmRegistrationToken, Shop, Category, Product, Contact, \
     ProductParameter, ProductInfo, SellerOrderItem, SellerOrder, \
-    Parameter, ShopCategory, BuyerOrder, ValueOfParameter, Token
+    Parameter, ShopCategory, BuyerOrder, ValueOfParameter, Token, CatalogueImportJob
 
 
 class SellerOrderItemInline(TabularInline):
@@ -162,6 +162,10 @@ class BuyerOrderAdmin(ModelAdmin):
     list_filter = ('state', )
     inlines = (SellerOrderInline,)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        BuyerOrder.objects.filter(id=form.instance.id).update_totals()
+
 
 @admin_register(SellerOrder)
 class SellerOrderAdmin(ModelAdmin):
@@ -178,10 +182,34 @@ class SellerOrderAdmin(ModelAdmin):
     list_filter = ('state', 'shop__name', 'contact__city')
     inlines = (SellerOrderItemInline,)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        SellerOrder.objects.filter(id=form.instance.id).update_totals()
+
 
 @admin_register(SellerOrderItem)
 class SellerOrderItemAdmin(ModelAdmin):
     list_display = ('id', 'order', 'product_info', 'quantity', 'purchase_price', 'purchase_price_rrc')
     search_fields = ('id', 'order__id', 'product_info__product__name', )
     list_filter = ('order__state', 'order__shop__name',)
-    
\ No newline at end of file
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        SellerOrder.objects.filter(id=obj.order_id).update_totals()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        SellerOrder.objects.filter(id=obj.order_id).update_totals()
+
+    def delete_queryset(self, request, queryset):
+        order_ids = set(queryset.values_list('order_id', flat=True))
+        super().delete_queryset(request, queryset)
+        SellerOrder.objects.filter(id__in=order_ids).update_totals()
+
+
+@admin_register(CatalogueImportJob)
+class CatalogueImportJobAdmin(ModelAdmin):
+    list_display = ('id', 'user', 'catalogue_format', 'state', 'processed', 'total',
+                    'created_at', 'started_at', 'finished_at')
+    search_fields = ('id', 'user__email')
+    list_filter = ('state', )
@@ -36,3 +36,10 @@ class BuyerOrderState(models.TextChoices):
 class PartnerState(models.TextChoices):
     open = 'open', _('Open')
     closed = 'closed', _('Closed')
+
+
+class ImportJobState(models.TextChoices):
+    queued = 'queued', _('Queued')
+    running = 'running', _('Running')
+    done = 'done', _('Done')
+    failed = 'failed', _('Failed')
@@ -0,0 +1,165 @@
+from hashlib import md5
+from time import time
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+from .models import CatalogueVersion
+
+CATALOGUE_VERSION_KEY = 'catalogue'
+
+
+def get_shop_version_key(shop_id: int) -> str:
+    return f'shop:{shop_id}'
+
+
+def get_catalogue_state(shop_id: int = None) -> tuple[int, float]:
+    """
+    Returns the version of the catalogue (or of a shop), which changes with every change of what the catalogue shows,
+    and the timestamp of its last change.
+    """
+    key = CATALOGUE_VERSION_KEY if shop_id is None else get_shop_version_key(shop_id)
+    versions = CatalogueVersion.objects.filter(key=key).values_list('version', 'modified')
+    state = versions.first()
+    if state is None:
+        # a new counter starts from the current time, not from a version which cached responses may have
+        modified = time()
+        CatalogueVersion.objects.bulk_create([CatalogueVersion(key=key, version=int(modified * 1000),
+                                                               modified=modified)],
+                                             ignore_conflicts=True)
+        state = versions.first()
+    return state
+
+
+def get_catalogue_version(shop_id: int = None) -> int:
+    return get_catalogue_state(shop_id)[0]
+
+
+def _bump_catalogue_version(shop_ids):
+    modified = time()
+    keys = list(dict.fromkeys((CATALOGUE_VERSION_KEY, *map(get_shop_version_key, shop_ids))))
+    # one statement, so concurrent bumps of the web processes and the import worker are not lost
+    if CatalogueVersion.objects.filter(key__in=keys).update(version=F('version') + 1, modified=modified) < len(keys):
+        CatalogueVersion.objects.bulk_create([CatalogueVersion(key=key, version=int(modified * 1000),
+                                                               modified=modified)
+                                              for key in keys],
+                                             ignore_conflicts=True)
+
+
+def bump_catalogue_version(*shop_ids: int):
+    """
+    Makes responses cached for the current catalogue version (and versions of the shops) stale,
+    when the running transaction is committed.
+    """
+    transaction.on_commit(lambda: _bump_catalogue_version(shop_ids))
+
+
+class CatalogueVersionMixin:
+    """
+    Responses of a single shop depend on the version of this shop only
+    (`shop_lookup_kwarg` names the url kwarg with the shop id), other ones on the version of the whole catalogue.
+    """
+    shop_lookup_kwarg = None
+
+    def get_catalogue_shop_id(self) -> int | None:
+        shop_id = self.kwargs.get(self.shop_lookup_kwarg) if self.shop_lookup_kwarg else None
+        if shop_id is not None and str(shop_id).isdigit():
+            return int(shop_id)
+        return None
+
+    def get_catalogue_state(self) -> tuple[int, float]:
+        # read once per request, by the cache key and by the fingerprint
+        if getattr(self, '_catalogue_state', None) is None:
+            self._catalogue_state = get_catalogue_state(self.get_catalogue_shop_id())
+        return self._catalogue_state
+
+    def get_cache_version(self) -> int:
+        return self.get_catalogue_state()[0]
+
+
+class CatalogueCacheMixin(CatalogueVersionMixin):
+    """
+    Caches list and retrieve responses by the path, the sorted query parameters and the catalogue version,
+    so they expire on the next change of the catalogue.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_key(self, request) -> str:
+        query = urlencode(sorted((key, value) for key, values in request.query_params.lists() for value in values))
+        # pagination links in responses are absolute
+        source = f'{request.build_absolute_uri(request.path)}?{query}'
+        return f'response:{self.get_cache_version()}:{md5(source.encode()).hexdigest()}'
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        if (data := cache.get(key)) is not None:
+            return Response(data)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified to list and retrieve responses and answers 304 Not Modified
+    to matching If-None-Match (or If-Modified-Since) before the queryset is evaluated.
+    The ETag is made from get_fingerprint(), a cheap description of the state the response is made of.
+    """
+
+    def get_fingerprint(self) -> tuple | None:
+        """
+        Returns (state, last modified timestamp or None), None (by default) disables conditional responses.
+        """
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        fingerprint = self.get_fingerprint()
+        if fingerprint is None:
+            return handler(request, *args, **kwargs)
+
+        state, modified = fingerprint
+        source = f'{request.get_full_path()}:{state}'
+        headers = {'ETag': f'"{md5(source.encode()).hexdigest()}"'}
+        if modified is not None:
+            headers['Last-Modified'] = http_date(modified)
+
+        if if_none_match := request.headers.get('If-None-Match'):
+            etags = parse_etags(if_none_match)
+            not_modified = '*' in etags or headers['ETag'] in etags
+        else:
+            if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since'))
+            not_modified = None not in (if_modified_since, modified) and int(modified) <= if_modified_since
+        if not_modified:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            for header, value in headers.items():
+                response[header] = value
+        return response
+
+
+class CatalogueConditionalGetMixin(ConditionalGetMixin, CatalogueVersionMixin):
+    """
+    Conditional responses of the catalogue by its version.
+    """
+
+    def get_fingerprint(self) -> tuple:
+        return self.get_catalogue_state()
@@ -0,0 +1,640 @@
+import json
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from functools import partial
+from hashlib import blake2b
+from itertools import islice
+import django
+from django.conf import settings
+from django.db import transaction, connection, DatabaseError, IntegrityError
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from .app_choices import ImportJobState
+from .caching import bump_catalogue_version
+from .product_cards import refresh_product_cards
+from .catalogue_formats import get_catalogue_reader, CatalogueFormatError, CATALOGUE_PARSE_ERRORS
+from .models import Category, Product, Parameter, ValueOfParameter, ProductInfo, ProductParameter, ShopCategory, \
+    Shop, CatalogueImportJob
+from .name_cache import resolve_names, clear_name_caches, get_name_cache_stats
+from .serializers import PartnerProductInfoSerializer
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class CatalogueImportError(Exception):
+    def __init__(self, detail: dict, status_code: int = status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def get_categories(categories_source: list) -> dict:
+    return {category['id']: {'name': category['name'], 'external_id': category['id']}
+            for category in categories_source}
+
+
+def validate_good(product_source: dict, categories_source: list, categories: dict, get_serializer):
+    """
+    Returns validated data of the good, raises CatalogueImportError if it can not be parsed or validated.
+    """
+    __source_info = {'categories': categories_source, 'product': product_source}
+
+    try:
+        category_external_id = product_source['category']
+        category = categories[category_external_id]
+    except KeyError as error:
+        raise CatalogueImportError({'category_error': 'parse or matching error', 'key': str(error)}
+                                   | __source_info)
+
+    try:
+        product_parameters = [dict(zip(('parameter', 'value'), i))
+                              for i in product_source['parameters'].items()]
+
+        product_data = {'external_id': product_source['id'],
+                        'category': category,
+                        'product': {'name': product_source['name']},
+                        'product_parameters': product_parameters,
+                        'price': product_source['price'],
+                        'price_rrc': product_source['price_rrc'],
+                        'quantity': product_source['quantity']}
+
+    except KeyError as error:
+        raise CatalogueImportError({'product_error': 'parse', 'invalid_field': str(error)} | __source_info)
+
+    product_info_serializer = get_serializer(data=product_data)
+
+    try:
+        product_info_serializer.is_valid(raise_exception=True)
+    except ValidationError as error:
+        raise CatalogueImportError({'product': product_source} | error.detail)
+
+    return product_info_serializer.validated_data
+
+
+def get_compact_errors(row: int, product_source, detail: dict) -> list:
+    """
+    Converts an error of a good to [{'row', 'external_id', 'field', 'error'}].
+    """
+    external_id = product_source.get('id') if isinstance(product_source, dict) else None
+    error = {'row': row, 'external_id': external_id}
+
+    if 'category_error' in detail:
+        return [error | {'field': 'category', 'error': detail['category_error']}]
+    if 'product_error' in detail:
+        return [error | {'field': detail['invalid_field'].strip("'"), 'error': 'this field is required'}]
+
+    def flatten(field, messages):
+        if isinstance(messages, dict):
+            for key, value in messages.items():
+                yield from flatten(f'{field}.{key}', value)
+        elif isinstance(messages, list) and messages and not isinstance(messages[0], str):
+            for index, value in enumerate(messages):
+                yield from flatten(f'{field}.{index}', value)
+        elif isinstance(messages, list):
+            yield field, ' '.join(messages)
+        else:
+            yield field, str(messages)
+
+    # 'product' holds the source of the good, unless the serializer replaced it by errors of the product name
+    return [error | {'field': field.lstrip('.'), 'error': message}
+            for key, value in detail.items() if key != 'product' or value != product_source
+            for field, message in flatten(key, value) if message]
+
+
+class ErrorReport:
+    """
+    Collects compact errors of goods, keeps at most `max_errors` of them.
+    """
+
+    def __init__(self, max_errors: int = 1000):
+        self.max_errors = max_errors
+        self.errors = []
+        self.count = 0
+        self.external_ids = set()
+
+    def add(self, row: int, product_source, detail: dict):
+        self.count += 1
+        if isinstance(product_source, dict) and 'id' in product_source:
+            self.external_ids.add(product_source['id'])
+        if len(self.errors) < self.max_errors:
+            self.errors.extend(get_compact_errors(row, product_source, detail))
+
+    @property
+    def data(self) -> dict:
+        return {'error_count': self.count, 'errors': self.errors[:self.max_errors]}
+
+
+def validate_goods(goods, categories_source: list, categories: dict, get_serializer, report: ErrorReport = None):
+    """
+    Yields validated data of goods one by one.
+    Raises CatalogueImportError on the first good which can not be parsed or validated,
+    if `report` is given, bad goods are skipped and added to it instead.
+    """
+    try:
+        for row, product_source in enumerate(goods):
+            try:
+                yield validate_good(product_source, categories_source, categories, get_serializer)
+            except CatalogueImportError as error:
+                if report is None:
+                    raise
+                report.add(row, product_source, error.detail)
+    except CatalogueFormatError as error:
+        raise CatalogueImportError({'error': str(error)})
+    except CATALOGUE_PARSE_ERRORS:
+        raise CatalogueImportError({'error': 'unable to load data from the file'})
+
+
+def _validate_chunk(goods: list, categories_source: list, collect_errors: bool):
+    """
+    Validates a chunk of goods in a worker process of validate_goods_in_pool.
+    Returns validated data of the goods and [(index of a bad good in the chunk, error)],
+    without `collect_errors` the validation stops on the first bad good.
+    """
+    categories = get_categories(categories_source)
+    get_serializer = partial(PartnerProductInfoSerializer, context={'catalogue_import': True})
+    validated = []
+    errors = []
+    for index, product_source in enumerate(goods):
+        try:
+            validated.append(validate_good(product_source, categories_source, categories, get_serializer))
+        except CatalogueImportError as error:
+            errors.append((index, error))
+            if not collect_errors:
+                break
+    return validated, errors
+
+
+def start_validation_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Starts `workers` processes for validate_goods_in_pool and waits until they are ready.
+    The processes are spawned, not forked: the importing process may hold a database connection,
+    an open transaction and threads, which a forked child would inherit. They set Django up on their own
+    and validate goods without the ORM. Start the pool before the import transaction.
+    """
+    executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+    # every submitted task without an idle process starts a new one
+    for future in [executor.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+    return executor
+
+
+def validate_goods_in_pool(goods, categories_source: list, executor: ProcessPoolExecutor, workers: int,
+                           report: ErrorReport = None, chunk_size: int = 500):
+    """
+    Same as validate_goods, but chunks of goods are validated by the processes of start_validation_pool().
+    The results are yielded in the order of goods, at most two chunks per process are in flight.
+    """
+    def chunk_results(future, chunk, start):
+        validated, errors = future.result()
+        yield from validated
+        if errors and report is None:
+            raise errors[0][1]
+        for index, error in errors:
+            report.add(start + index, chunk[index], error.detail)
+
+    pending = deque()
+    try:
+        for number, chunk in enumerate(chunked(goods, chunk_size)):
+            pending.append((executor.submit(_validate_chunk, chunk, categories_source, report is not None),
+                            chunk, number * chunk_size))
+            if len(pending) >= workers * 2:
+                yield from chunk_results(*pending.popleft())
+        while pending:
+            yield from chunk_results(*pending.popleft())
+    except CatalogueFormatError as error:
+        raise CatalogueImportError({'error': str(error)})
+    except CATALOGUE_PARSE_ERRORS:
+        raise CatalogueImportError({'error': 'unable to load data from the file'})
+    finally:
+        for future, chunk, start in pending:
+            future.cancel()
+
+
+def track_progress(goods, progress, every: int = 1000):
+    processed = 0
+    for processed, good in enumerate(goods, 1):
+        yield good
+        if not processed % every:
+            progress(processed)
+    progress(processed)
+
+
+def import_catalogue(user, file, progress=None, workers: int = None, dry_run: bool = False,
+                     options: dict = None, parameters_file=None, catalogue_format: str = None) -> dict:
+    """
+    Imports a catalogue (yaml, csv or json lines) of the user's shop (creates the shop if the user has not got it).
+    `options` (shop, email, shipping_price) and `parameters_file` are used by the csv format.
+    `catalogue_format` is detected by the content type or extension of the file if it is not given.
+    Goods are validated by `workers` processes if there are more than one (CATALOGUE_IMPORT_WORKERS by default).
+    Returns statistics of the writer, raises CatalogueImportError if the catalogue can not be imported.
+
+    With `dry_run` nothing is written: all goods are validated and the report with all errors
+    and the statistics of what would be written is returned.
+    """
+    try:
+        catalogue = get_catalogue_reader(file, options, parameters_file, catalogue_format)
+        json_data = catalogue.header
+        shop_name = json_data['shop']
+        categories_source = json_data['categories']
+        categories = get_categories(categories_source)
+    except:
+        raise CatalogueImportError({'error': 'unable to load data from the file'})
+
+    report = ErrorReport() if dry_run else None
+
+    if workers is None:
+        workers = settings.CATALOGUE_IMPORT_WORKERS
+    executor = start_validation_pool(workers) if workers > 1 else None
+    try:
+        if dry_run:
+            shop = Shop.objects.filter(owner=user).first()
+            if shop is None and Shop.objects.filter(name=shop_name).exists():
+                report.add(None, None, {'shop': [f'{shop_name}: this shop_name is already occupied']})
+        else:
+            shop_email = json_data.get('email', user.email)
+            shop_base_shipping_price = int(json_data.get('shipping_price', 300))
+            try:
+                shop, shop_created = \
+                    Shop.objects.get_or_create(owner=user, defaults={'name': shop_name,
+                                                                     'email': shop_email,
+                                                                     'base_shipping_price': shop_base_shipping_price})
+            except IntegrityError:
+                raise CatalogueImportError({'error': f'{shop_name}: this shop_name is already occupied'},
+                                           status.HTTP_403_FORBIDDEN)
+
+        if workers > 1:
+            goods = validate_goods_in_pool(catalogue.goods, categories_source, executor, workers, report)
+        else:
+            get_serializer = partial(PartnerProductInfoSerializer, context={'shop': shop, 'catalogue_import': True})
+            goods = validate_goods(catalogue.goods, categories_source, categories, get_serializer, report)
+        if progress is not None:
+            goods = track_progress(goods, progress)
+
+        writer = CatalogueWriter(shop, dry_run=dry_run, report=report)
+        if not dry_run:
+            stats = writer.run(goods)
+            bump_catalogue_version(shop.id)
+            return stats
+
+        writer.write(goods)
+        # bad goods are reported, not zeroed
+        writer.seen_external_ids.update(report.external_ids)
+        writer.finish()
+        return report.data | {'summary': writer.stats}
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+class ImportJobProgress:
+    """
+    Saves the progress of an import job from its own thread (and database connection),
+    so it is visible while the import transaction is not committed.
+    SQLite does not allow a concurrent writer, there the progress is saved with the result only.
+    The thread starts with the first saved progress, after import_catalogue has started its validation pool.
+    """
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.processed = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._concurrent_writes = connection.vendor != 'sqlite'
+
+    def __call__(self, processed: int):
+        self.processed = processed
+        if self._concurrent_writes:
+            self._executor.submit(self._save, processed)
+
+    def close(self):
+        self._executor.submit(connection.close)
+        self._executor.shutdown()
+
+    def _save(self, processed: int):
+        try:
+            CatalogueImportJob.objects.filter(id=self.job_id).update(processed=processed)
+        except DatabaseError:
+            logger.warning('unable to save progress of the catalogue import %s', self.job_id)
+
+
+def run_import_job(job):
+    """
+    Imports the stored file of a claimed job and saves the outcome of the job.
+    """
+    try:
+        with job.file.open('rb') as file:
+            job.total = get_catalogue_reader(file, job.options, catalogue_format=job.catalogue_format).count_goods()
+    except Exception:
+        job.total = None
+    job.save(update_fields=['total'])
+
+    progress = ImportJobProgress(job)
+    try:
+        with job.file.open('rb') as file, ExitStack() as stack:
+            parameters_file = stack.enter_context(job.parameters_file.open('rb')) if job.parameters_file else None
+            job.result = import_catalogue(job.user, file, progress, dry_run=job.dry_run,
+                                          options=job.options, parameters_file=parameters_file,
+                                          catalogue_format=job.catalogue_format)
+        if job.dry_run:
+            job.errors = job.result.pop('errors')
+        job.result['name_cache'] = get_name_cache_stats()
+        job.state = ImportJobState.done
+    except CatalogueImportError as error:
+        job.errors = [error.detail]
+    except ValidationError as error:
+        job.errors = [error.detail]
+    except Exception:
+        logger.exception('catalogue import %s failed', job.id)
+        job.errors = [{'error': 'unexpected error'}]
+    finally:
+        progress.close()
+
+    if job.state != ImportJobState.done:
+        job.state = ImportJobState.failed
+    job.processed = progress.processed
+    job.finished_at = timezone.now()
+    job.file.delete(save=False)
+    job.parameters_file.delete(save=False)
+    job.save()
+
+
+def fail_stale_import_jobs(timeout: int) -> int:
+    """
+    Marks jobs running for more than `timeout` seconds as failed and deletes their files, returns their number.
+    The worker of such a job was killed or restarted, the job would stay running forever.
+    """
+    failed = 0
+    for job in CatalogueImportJob.objects.filter(state=ImportJobState.running,
+                                                 started_at__lt=timezone.now() - timedelta(seconds=timeout)):
+        # a job finished after the read is not failed
+        if CatalogueImportJob.objects.filter(id=job.id, state=ImportJobState.running) \
+                .update(state=ImportJobState.failed, errors=[{'error': 'the import was interrupted'}],
+                        finished_at=timezone.now(), file='', parameters_file=''):
+            job.file.delete(save=False)
+            job.parameters_file.delete(save=False)
+            failed += 1
+    return failed
+
+
+def get_source_hash(product_info: dict) -> str:
+    """
+    Fingerprint of the imported fields of a product info, which can be changed by a re-import.
+    """
+    source = [product_info['price'], product_info['price_rrc'],
+              sorted([parameter['parameter'], parameter['value']] for parameter in product_info['product_parameters'])]
+    return blake2b(json.dumps(source, ensure_ascii=False).encode(), digest_size=16).hexdigest()
+
+
+class CatalogueWriter:
+    """
+    Writes validated product infos of a shop catalogue with a few batched queries per chunk.
+    Existing products (matched by external_id) are compared with the catalogue by source_hash and quantity,
+    only changed ones are updated, missing ones are created, products absent from the catalogue
+    are zeroed by finish(). With `dry_run` only the statistics are calculated, the shop may be None,
+    and conflicts of category external ids, which fail the import, are added to `report`.
+    """
+
+    def __init__(self, shop, batch_size: int = 1000, dry_run: bool = False, report: ErrorReport = None):
+        self.shop = shop
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.report = report
+        self.seen_external_ids = set()
+        # ids of written product infos
+        self.written_ids = set()
+        self.stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'zeroed': 0}
+        self._shop_categories = None
+        self._existing = None
+
+    def run(self, product_infos):
+        try:
+            with transaction.atomic():
+                self.write(product_infos)
+                self.finish()
+                refresh_product_cards(self.written_ids, self.batch_size)
+        except BaseException:
+            # the name caches may have loaded rows created by the rolled back transaction
+            clear_name_caches()
+            raise
+        return self.stats
+
+    def write(self, product_infos):
+        for chunk in chunked(product_infos, self.batch_size):
+            self._write_chunk({product_info['external_id']: product_info for product_info in chunk})
+
+    def finish(self):
+        vanished_ids = [product_info_id for external_id, (product_info_id, quantity, source_hash)
+                        in self.existing.items()
+                        if quantity and external_id not in self.seen_external_ids]
+
+        if not self.dry_run:
+            for chunk in chunked(vanished_ids, self.batch_size):
+                ProductInfo.objects.filter(id__in=chunk).update(quantity=0)
+            self.written_ids.update(vanished_ids)
+
+        self.stats['zeroed'] += len(vanished_ids)
+
+    @property
+    def existing(self) -> dict:
+        """
+        {external_id: (id, quantity, source_hash)} of the shop's product infos.
+        """
+        if self._existing is None and self.shop is None:
+            self._existing = {}
+        elif self._existing is None:
+            self._existing = {external_id: (product_info_id, quantity, source_hash)
+                              for external_id, product_info_id, quantity, source_hash
+                              in self.shop.product_infos.order_by()
+                              .values_list('external_id', 'id', 'quantity', 'source_hash').iterator()}
+        return self._existing
+
+    def _write_chunk(self, rows: dict):
+        self.seen_external_ids.update(rows)
+
+        new_rows = []
+        changed = {}
+        updated = []
+
+        for external_id, row in rows.items():
+            row_hash = get_source_hash(row)
+            if external_id not in self.existing:
+                new_rows.append((row, row_hash))
+                continue
+
+            product_info_id, quantity, source_hash = self.existing[external_id]
+            if source_hash != row_hash:
+                changed[product_info_id] = row
+                updated.append(ProductInfo(id=product_info_id, quantity=row['quantity'],
+                                           price=row['price'], price_rrc=row['price_rrc'],
+                                           source_hash=row_hash))
+            elif quantity != row['quantity']:
+                updated.append(ProductInfo(id=product_info_id, quantity=row['quantity']))
+            else:
+                self.stats['unchanged'] += 1
+                continue
+            self.existing[external_id] = (product_info_id, row['quantity'], row_hash)
+
+        if self.dry_run:
+            self._check_shop_categories({row['category']['name']: row['category']['external_id']
+                                         for row, row_hash in new_rows})
+            for row, row_hash in new_rows:
+                self.existing[row['external_id']] = (None, row['quantity'], row_hash)
+            self.stats['created'] += len(new_rows)
+            self.stats['updated'] += len(updated)
+            return
+
+        created = self._create_product_infos(new_rows)
+
+        price_changed = [product_info for product_info in updated if product_info.id in changed]
+        if price_changed:
+            ProductInfo.objects.bulk_update(price_changed, ('quantity', 'price', 'price_rrc', 'source_hash'),
+                                            batch_size=self.batch_size)
+            ProductParameter.objects.filter(product_info_id__in=changed.keys()).delete()
+        if len(price_changed) != len(updated):
+            ProductInfo.objects.bulk_update([product_info for product_info in updated
+                                             if product_info.id not in changed],
+                                            ('quantity', ),
+                                            batch_size=self.batch_size)
+
+        self._add_parameters(created | changed)
+        self.written_ids.update(created.keys())
+        self.written_ids.update(product_info.id for product_info in updated)
+        if changed:
+            ProductInfo.objects.filter(id__in=changed.keys()).refresh_search_documents(self.batch_size)
+
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+
+    def _create_product_infos(self, rows: list) -> dict:
+        """
+        Creates product infos from [(row, source_hash)] with their categories and products, returns {id: row}.
+        """
+        if not rows:
+            return {}
+
+        categories = resolve_names(Category, {row['category']['name'] for row, row_hash in rows},
+                                   self.batch_size)
+        products = resolve_names(Product, {row['product']['name'] for row, row_hash in rows},
+                                 self.batch_size)
+
+        shop_categories = self._get_shop_categories({categories[row['category']['name']]: row['category']['external_id']
+                                                     for row, row_hash in rows})
+
+        ProductInfo.objects.bulk_create([ProductInfo(external_id=row['external_id'],
+                                                     category_id=shop_categories[categories[row['category']['name']]],
+                                                     product_id=products[row['product']['name']],
+                                                     shop=self.shop,
+                                                     quantity=row['quantity'],
+                                                     price=row['price'],
+                                                     price_rrc=row['price_rrc'],
+                                                     source_hash=row_hash,
+                                                     search_document=ProductInfo.build_search_document(
+                                                         row['product']['name'], row['category']['name'],
+                                                         (parameter['value']
+                                                          for parameter in row['product_parameters'])))
+                                         for row, row_hash in rows],
+                                        batch_size=self.batch_size)
+
+        rows = {row['external_id']: (row, row_hash) for row, row_hash in rows}
+        created = {}
+        for external_id, product_info_id in \
+                self.shop.product_infos.filter(external_id__in=rows.keys()).values_list('external_id', 'id'):
+            row, row_hash = rows[external_id]
+            created[product_info_id] = row
+            self.existing[external_id] = (product_info_id, row['quantity'], row_hash)
+        return created
+
+    def _get_shop_categories(self, category_external_ids: dict) -> dict:
+        """
+        Returns {category_id: shop_category_id}, creating shop categories which are not in the shop yet.
+        """
+        if self._shop_categories is None:
+            self._shop_categories = {category_id: (shop_category_id, external_id)
+                                     for shop_category_id, category_id, external_id
+                                     in self.shop.categories.values_list('id', 'category_id', 'external_id')}
+
+        missing = {category_id: external_id for category_id, external_id in category_external_ids.items()
+                   if category_id not in self._shop_categories}
+
+        if missing:
+            occupied_external_ids = {external_id for shop_category_id, external_id in self._shop_categories.values()}
+            for external_id in missing.values():
+                self._occupy_category_external_id(occupied_external_ids, external_id)
+
+            ShopCategory.objects.bulk_create([ShopCategory(shop=self.shop, category_id=category_id,
+                                                           external_id=external_id)
+                                              for category_id, external_id in missing.items()])
+
+            self._shop_categories.update({category_id: (shop_category_id, external_id)
+                                          for shop_category_id, category_id, external_id
+                                          in self.shop.categories.filter(category_id__in=missing.keys())
+                                         .values_list('id', 'category_id', 'external_id')})
+
+        return {category_id: self._shop_categories[category_id][0] for category_id in category_external_ids}
+
+    def _check_shop_categories(self, category_external_ids: dict):
+        """
+        The check of _get_shop_categories for {category name: external_id} without writing (dry run),
+        conflicts are added to the report.
+        """
+        if self._shop_categories is None:
+            self._shop_categories = dict(self.shop.categories.values_list('category__name', 'external_id')) \
+                if self.shop is not None else {}
+
+        occupied_external_ids = set(self._shop_categories.values())
+        for name, external_id in category_external_ids.items():
+            if name in self._shop_categories:
+                continue
+            try:
+                self._occupy_category_external_id(occupied_external_ids, external_id)
+            except ValidationError as error:
+                if self.report is None:
+                    raise
+                self.report.add(None, None, error.detail)
+            self._shop_categories[name] = external_id
+
+    @staticmethod
+    def _occupy_category_external_id(occupied_external_ids: set, external_id):
+        if external_id in occupied_external_ids:
+            raise ValidationError({'category_external_id': f'category with external_id '
+                                                           f'{external_id} already exists'})
+        occupied_external_ids.add(external_id)
+
+    def _add_parameters(self, rows: dict):
+        """
+        Creates product parameters for {product_info_id: row}.
+        """
+        if not rows:
+            return
+
+        try:
+            parameters = resolve_names(Parameter,
+                                       {parameter['parameter'] for row in rows.values()
+                                        for parameter in row['product_parameters']},
+                                       self.batch_size)
+            values = resolve_names(ValueOfParameter,
+                                   {parameter['value'] for row in rows.values()
+                                    for parameter in row['product_parameters']},
+                                   self.batch_size)
+
+            ProductParameter.objects.bulk_create([ProductParameter(product_info_id=product_info_id,
+                                                                   parameter_id=parameters[parameter['parameter']],
+                                                                   value_id=values[parameter['value']],
+                                                                   numeric_value=ProductParameter.parse_numeric_value(
+                                                                       parameter['value']))
+                                                  for product_info_id, row in rows.items()
+                                                  for parameter in row['product_parameters']],
+                                                 batch_size=self.batch_size)
+        except DatabaseError:
+            raise ValidationError({'error': 'bad parameters fields'})
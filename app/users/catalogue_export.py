@@ -0,0 +1,106 @@
+import csv
+import json
+from io import StringIO
+from itertools import islice
+import yaml
+from .models import Shop, ShopCategory, ProductInfo, ProductParameter
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+CATALOGUE_CONTENT_TYPES = {
+    'yaml': 'application/x-yaml',
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+CSV_COLUMNS = ('id', 'category', 'category_name', 'name', 'price', 'price_rrc', 'quantity', 'parameters')
+
+
+def get_catalogue_header(shop: Shop) -> dict:
+    return {'shop': shop.name,
+            'email': shop.email,
+            'shipping_price': shop.base_shipping_price,
+            'categories': [{'id': external_id, 'name': name}
+                           for external_id, name in ShopCategory.objects.filter(shop=shop).order_by('external_id')
+                           .values_list('external_id', 'category__name')]}
+
+
+def iterate_goods(shop: Shop, chunk_size: int = 2000):
+    """
+    Yields goods of the shop in the schema of the uploaded catalogues (with category_name for csv).
+    Goods and their parameters are read by two server-side cursors ordered by the product info,
+    so the memory and the number of queries do not depend on the size of the catalogue.
+    """
+    goods = ProductInfo.objects.filter(shop=shop).order_by('id') \
+        .values_list('id', 'external_id', 'category__external_id', 'category__category__name', 'product__name',
+                     'price', 'price_rrc', 'quantity') \
+        .iterator(chunk_size=chunk_size)
+    parameters = ProductParameter.objects.filter(product_info__shop=shop).order_by('product_info_id', 'id') \
+        .values_list('product_info_id', 'parameter__name', 'value__value') \
+        .iterator(chunk_size=chunk_size)
+
+    parameter = next(parameters, None)
+    for product_info_id, external_id, category, category_name, name, price, price_rrc, quantity in goods:
+        good_parameters = {}
+        while parameter is not None and parameter[0] <= product_info_id:
+            if parameter[0] == product_info_id:
+                good_parameters[parameter[1]] = parameter[2]
+            parameter = next(parameters, None)
+        yield {'id': external_id, 'category': category, 'category_name': category_name, 'name': name,
+               'price': price, 'price_rrc': price_rrc, 'quantity': quantity, 'parameters': good_parameters}
+
+
+def export_yaml(shop: Shop, goods, chunk_size: int = 500):
+    yield yaml.dump(get_catalogue_header(shop), Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+    empty = True
+    while chunk := list(islice(goods, chunk_size)):
+        if empty:
+            yield 'goods:\n'
+            empty = False
+        for good in chunk:
+            del good['category_name']
+        yield yaml.dump(chunk, Dumper=SafeDumper, allow_unicode=True, sort_keys=False)
+    if empty:
+        yield 'goods: []\n'
+
+
+def export_jsonl(shop: Shop, goods, chunk_size: int = 500):
+    yield json.dumps(get_catalogue_header(shop), ensure_ascii=False) + '\n'
+    while chunk := list(islice(goods, chunk_size)):
+        yield ''.join(json.dumps({key: value for key, value in good.items() if key != 'category_name'},
+                                 ensure_ascii=False) + '\n'
+                      for good in chunk)
+
+
+def export_csv(shop: Shop, goods, chunk_size: int = 500):
+    """
+    The shop, email and shipping price are not in the csv, they are given as upload options.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    while chunk := list(islice(goods, chunk_size)):
+        for good in chunk:
+            good['parameters'] = json.dumps(good['parameters'], ensure_ascii=False)
+        writer.writerows([good[column] for column in CSV_COLUMNS] for good in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+CATALOGUE_EXPORTERS = {
+    'yaml': export_yaml,
+    'jsonl': export_jsonl,
+    'csv': export_csv,
+}
+
+
+def export_catalogue(shop: Shop, catalogue_format: str = 'yaml', chunk_size: int = 2000):
+    """
+    Yields text of the shop's catalogue in the format which the catalogue upload accepts.
+    """
+    return CATALOGUE_EXPORTERS[catalogue_format](shop, iterate_goods(shop, chunk_size))
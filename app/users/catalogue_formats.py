@@ -0,0 +1,238 @@
+import csv
+import json
+from io import TextIOWrapper
+from os.path import splitext
+import yaml
+from yaml.events import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, \
+    MappingStartEvent, MappingEndEvent, DocumentStartEvent, StreamStartEvent
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class CatalogueFormatError(ValueError):
+    pass
+
+
+# errors of reading goods, which mean that the file is broken
+CATALOGUE_PARSE_ERRORS = (yaml.YAMLError, json.JSONDecodeError, UnicodeDecodeError, csv.Error)
+
+
+class YamlCatalogueReader:
+    """
+    Reads a yaml catalogue from a file-like object without loading the whole document.
+    The header (shop, categories, etc.) is loaded on creation, goods are built one by one
+    while iterating over `goods`. If goods go before the shop or categories, they are buffered.
+    Keys going after streamed goods are added to the header once the goods are exhausted,
+    except the fields of the shop which is created before the goods are read.
+    """
+    shop_keys = ('email', 'shipping_price')
+
+    def __init__(self, stream):
+        self._loader = SafeLoader(stream)
+        self._anchors = {}
+        self._buffered_goods = None
+        self._streamed_goods = False
+        self.header = {}
+        self._read_header()
+
+    def count_goods(self) -> int:
+        """
+        Consumes the goods without building them and returns their number.
+        """
+        if self._buffered_goods is not None:
+            return len(self._buffered_goods)
+
+        count = depth = 0
+        self._streamed_goods = False
+        while True:
+            event = self._loader.get_event()
+            if isinstance(event, (SequenceEndEvent, MappingEndEvent)):
+                if not depth:
+                    return count
+                depth -= 1
+            else:
+                count += not depth
+                depth += isinstance(event, (SequenceStartEvent, MappingStartEvent))
+
+    @property
+    def goods(self):
+        if self._buffered_goods is not None:
+            yield from self._buffered_goods
+        elif self._streamed_goods:
+            self._streamed_goods = False
+            yield from self._iter_sequence()
+            header_keys = set(self.header)
+            self._read_mapping_items()
+            if late_keys := [key for key in self.shop_keys if key in self.header.keys() - header_keys]:
+                raise CatalogueFormatError(f'{", ".join(late_keys)} must go before goods')
+
+    def _read_header(self):
+        for event_class in (StreamStartEvent, DocumentStartEvent, MappingStartEvent):
+            if not isinstance(self._loader.get_event(), event_class):
+                raise yaml.YAMLError('the catalogue must be a mapping')
+        self._read_mapping_items()
+        if self._buffered_goods is None and not self._streamed_goods:
+            raise yaml.YAMLError('the catalogue has no goods')
+
+    def _read_mapping_items(self):
+        while not isinstance(event := self._loader.get_event(), MappingEndEvent):
+            key = self._construct(event)
+            event = self._loader.get_event()
+            if key == 'goods' and isinstance(event, SequenceStartEvent):
+                if {'shop', 'categories'} <= self.header.keys():
+                    self._streamed_goods = True
+                    return
+                self._buffered_goods = list(self._iter_sequence())
+            else:
+                self.header[key] = self._construct(event)
+
+    def _iter_sequence(self):
+        while not isinstance(event := self._loader.get_event(), SequenceEndEvent):
+            yield self._construct(event)
+
+    def _construct(self, event):
+        return self._loader.construct_document(self._compose(event))
+
+    def _compose(self, event):
+        loader = self._loader
+
+        if isinstance(event, AliasEvent):
+            return self._anchors[event.anchor]
+
+        if isinstance(event, ScalarEvent):
+            tag = event.tag if event.tag not in {None, '!'} else loader.resolve(ScalarNode, event.value, event.implicit)
+            node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+
+        elif isinstance(event, SequenceStartEvent):
+            tag = event.tag if event.tag not in {None, '!'} else loader.resolve(SequenceNode, None, event.implicit)
+            node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not isinstance(item_event := loader.get_event(), SequenceEndEvent):
+                node.value.append(self._compose(item_event))
+            node.end_mark = item_event.end_mark
+
+        elif isinstance(event, MappingStartEvent):
+            tag = event.tag if event.tag not in {None, '!'} else loader.resolve(MappingNode, None, event.implicit)
+            node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+            while not isinstance(key_event := loader.get_event(), MappingEndEvent):
+                node.value.append((self._compose(key_event), self._compose(loader.get_event())))
+            node.end_mark = key_event.end_mark
+
+        else:
+            raise yaml.YAMLError(f'unexpected event {event}')
+
+        if getattr(event, 'anchor', None) is not None:
+            self._anchors[event.anchor] = node
+        return node
+
+
+class JsonLinesCatalogueReader:
+    """
+    Reads a catalogue in the JSON Lines format: the first line is the header
+    ({"shop": ..., "categories": [...], ...}), every next line is a good in the same schema as in yaml.
+    """
+
+    def __init__(self, stream):
+        self._lines = (line for line in TextIOWrapper(stream, encoding='utf-8') if line.strip())
+        self.header = json.loads(next(self._lines, 'null'))
+        if not isinstance(self.header, dict):
+            raise CatalogueFormatError('the first line must be the header of the catalogue')
+
+    def count_goods(self) -> int:
+        return sum(1 for line in self._lines)
+
+    @property
+    def goods(self):
+        for line in self._lines:
+            yield json.loads(line)
+
+
+class CsvCatalogueReader:
+    """
+    Reads a catalogue from csv with the columns: id, category, category_name, name, price, price_rrc, quantity
+    and parameters (a json object). Instead of the column parameters a companion csv with the columns
+    id, parameter, value can be given. The shop and its other fields come from `options`,
+    the categories are collected by the first pass over the file.
+    """
+    integer_columns = ('id', 'category', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, stream, options: dict = None, parameters_stream=None):
+        self._stream = stream
+        self.header = {key: value for key, value in (options or {}).items() if value not in {None, ''}}
+
+        categories = {}
+        for row in self._rows():
+            categories.setdefault(row.get('category'), row.get('category_name'))
+        self.header['categories'] = [{'id': category_id, 'name': name} for category_id, name in categories.items()]
+
+        self._parameters = None
+        if parameters_stream is not None:
+            self._parameters = {}
+            for row in csv.DictReader(TextIOWrapper(parameters_stream, encoding='utf-8', newline='')):
+                self._parameters.setdefault(self._to_int(row['id']), {})[row['parameter']] = row['value']
+
+    def count_goods(self) -> int:
+        return sum(1 for row in self._rows())
+
+    @property
+    def goods(self):
+        for row in self._rows():
+            if self._parameters is not None:
+                row['parameters'] = self._parameters.get(row.get('id'), {})
+            elif 'parameters' in row:
+                row['parameters'] = json.loads(row['parameters'] or '{}')
+            yield row
+
+    def _rows(self):
+        self._stream.seek(0)
+        text = TextIOWrapper(self._stream, encoding='utf-8-sig', newline='')
+        try:
+            for row in csv.DictReader(text):
+                for column in self.integer_columns:
+                    if column in row:
+                        row[column] = self._to_int(row[column])
+                yield row
+        finally:
+            text.detach()
+
+    @staticmethod
+    def _to_int(value):
+        return int(value) if isinstance(value, str) and value.strip().isdigit() else value
+
+
+CATALOGUE_READERS = {
+    'yaml': YamlCatalogueReader,
+    'jsonl': JsonLinesCatalogueReader,
+    'csv': CsvCatalogueReader,
+}
+
+CATALOGUE_FORMATS = {
+    '.yaml': 'yaml', '.yml': 'yaml',
+    'application/x-yaml': 'yaml', 'application/yaml': 'yaml', 'text/yaml': 'yaml', 'text/x-yaml': 'yaml',
+    '.jsonl': 'jsonl', '.ndjson': 'jsonl',
+    'application/jsonl': 'jsonl', 'application/x-ndjson': 'jsonl', 'application/x-jsonlines': 'jsonl',
+    '.csv': 'csv',
+    'text/csv': 'csv', 'application/csv': 'csv',
+}
+
+
+def get_catalogue_format(file) -> str:
+    """
+    The format of an uploaded or stored file by its content type or extension, yaml by default.
+    """
+    content_type = getattr(file, 'content_type', None)
+    extension = splitext(getattr(file, 'name', None) or '')[1].lower()
+    return CATALOGUE_FORMATS.get(content_type) or CATALOGUE_FORMATS.get(extension, 'yaml')
+
+
+def get_catalogue_reader(file, options: dict = None, parameters_file=None, catalogue_format: str = None):
+    """
+    The reader of the file in `catalogue_format`, detected by get_catalogue_format if it is not given.
+    """
+    catalogue_format = catalogue_format or get_catalogue_format(file)
+    if catalogue_format == 'csv':
+        return CsvCatalogueReader(file, options, parameters_file)
+    return CATALOGUE_READERS[catalogue_format](file)
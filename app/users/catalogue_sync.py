@@ -0,0 +1,124 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from hashlib import sha256
+from os.path import splitext
+from tempfile import NamedTemporaryFile
+from typing import NamedTuple
+from urllib.parse import urlparse
+import requests
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .catalogue import import_catalogue, CatalogueImportError
+from .catalogue_formats import CATALOGUE_FORMATS
+
+logger = logging.getLogger(__name__)
+
+
+class FetchedCatalogue(NamedTuple):
+    file: NamedTemporaryFile
+    hash: str
+    etag: str
+    last_modified: str
+
+
+def fetch_catalogue(url: str, etag: str = '', last_modified: str = '', timeout: float = 60,
+                    session: requests.Session = None) -> FetchedCatalogue | None:
+    """
+    Downloads a catalogue to a temporary file, returns None if the server answers 304 Not Modified.
+    The caller closes the file, which deletes it.
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with (session or requests).get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == requests.codes.not_modified:
+            return None
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        catalogue_format = CATALOGUE_FORMATS.get(content_type) \
+            or CATALOGUE_FORMATS.get(splitext(urlparse(url).path)[1].lower(), 'yaml')
+
+        file = NamedTemporaryFile(suffix=f'.{catalogue_format}')
+        digest = sha256()
+        try:
+            for chunk in response.iter_content(chunk_size=2 ** 16):
+                digest.update(chunk)
+                file.write(chunk)
+            file.seek(0)
+        except BaseException:
+            file.close()
+            raise
+
+        return FetchedCatalogue(file, digest.hexdigest(),
+                                response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''))
+
+
+def sync_shop(shop, fetched: FetchedCatalogue | None) -> str:
+    """
+    Imports the fetched catalogue of the shop unless it is the same as the last imported one.
+    """
+    shop.catalogue_fetched_at = timezone.now()
+    fields_to_update = ['catalogue_fetched_at']
+
+    if fetched is None:
+        shop.save(update_fields=fields_to_update)
+        return 'not modified'
+
+    with fetched.file:
+        if fetched.hash != shop.catalogue_hash:
+            try:
+                import_catalogue(shop.owner, fetched.file, options={'shop': shop.name})
+            except (CatalogueImportError, ValidationError) as error:
+                logger.warning('catalogue of the shop %s from %s is not imported: %s', shop.id, shop.url,
+                               getattr(error, 'detail', error))
+                shop.save(update_fields=fields_to_update)
+                return 'failed'
+            except Exception:
+                # a malformed catalogue or a database error does not stop the sync of the other shops
+                logger.exception('catalogue of the shop %s from %s is not imported', shop.id, shop.url)
+                shop.save(update_fields=fields_to_update)
+                return 'failed'
+
+    status = 'unchanged' if fetched.hash == shop.catalogue_hash else 'imported'
+
+    shop.catalogue_hash = fetched.hash
+    shop.catalogue_etag = fetched.etag
+    shop.catalogue_last_modified = fetched.last_modified
+    shop.save(update_fields=fields_to_update + ['catalogue_hash', 'catalogue_etag', 'catalogue_last_modified'])
+    return status
+
+
+def sync_shop_catalogues(shops, workers: int = 8, timeout: float = 60) -> Counter:
+    """
+    Fetches catalogues of the shops by a pool of `workers` threads and imports them one by one.
+    Returns the number of shops by the result of the sync.
+    """
+    results = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_catalogue, shop.url, shop.catalogue_etag, shop.catalogue_last_modified,
+                                   timeout): shop
+                   for shop in shops}
+
+        try:
+            for future in as_completed(futures):
+                shop = futures[future]
+                try:
+                    fetched = future.result()
+                except (requests.RequestException, OSError) as error:
+                    logger.warning('catalogue of the shop %s is not fetched from %s: %s', shop.id, shop.url, error)
+                    shop.catalogue_fetched_at = timezone.now()
+                    shop.save(update_fields=['catalogue_fetched_at'])
+                    results['failed'] += 1
+                    continue
+                results[sync_shop(shop, fetched)] += 1
+        finally:
+            # the files fetched for shops left after an unexpected error
+            for future in futures:
+                if not future.cancel() and future.exception() is None and future.result() is not None:
+                    future.result().file.close()
+    return results
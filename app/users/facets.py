@@ -0,0 +1,54 @@
+from itertools import groupby
+from django.conf import settings
+from django.db.models import Count, Q, F, Window
+from django.db.models.functions import RowNumber
+from .models import ProductParameter
+
+
+def get_price_ranges() -> list:
+    """
+    [(min, max)] by FACET_PRICE_BUCKETS, the last range has no max.
+    """
+    bounds = [0, *settings.FACET_PRICE_BUCKETS]
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def get_facets(queryset, values_limit: int = None) -> dict:
+    """
+    Returns the number of the product infos of the queryset by category, shop, price range and parameter value
+    (the most frequent `values_limit` values of every parameter, limited by a window function), four aggregate queries.
+    """
+    if values_limit is None:
+        values_limit = settings.FACET_VALUES_LIMIT
+    # the ordering (by search rank too) would get into GROUP BY
+    queryset = queryset.order_by()
+    price_ranges = get_price_ranges()
+
+    price_counts = queryset.aggregate(
+        count=Count('id'),
+        **{f'price_{index}': Count('id', filter=Q(price__gte=min_price) & (Q(price__lt=max_price)
+                                                                          if max_price is not None else Q()))
+           for index, (min_price, max_price) in enumerate(price_ranges)})
+
+    categories = queryset.values('category__category_id', 'category__category__name') \
+        .annotate(count=Count('id')).order_by('-count', 'category__category__name')
+    shops = queryset.values('shop_id', 'shop__name').annotate(count=Count('id')).order_by('-count', 'shop__name')
+    parameter_values = ProductParameter.objects.filter(product_info__in=queryset.values('id')) \
+        .values_list('parameter__name', 'value__value').annotate(count=Count('product_info')) \
+        .annotate(position=Window(RowNumber(), partition_by=F('parameter__name'),
+                                  order_by=(F('count').desc(), F('value__value').asc()))) \
+        .filter(position__lte=values_limit) \
+        .order_by('parameter__name', '-count', 'value__value')
+
+    return {
+        'count': price_counts['count'],
+        'categories': [{'id': category['category__category_id'], 'name': category['category__category__name'],
+                        'count': category['count']}
+                       for category in categories],
+        'shops': [{'id': shop['shop_id'], 'name': shop['shop__name'], 'count': shop['count']} for shop in shops],
+        'prices': [{'min': min_price, 'max': max_price, 'count': price_counts[f'price_{index}']}
+                   for index, (min_price, max_price) in enumerate(price_ranges)],
+        'parameters': [{'parameter': parameter,
+                        'values': [{'value': value, 'count': count} for _, value, count, _ in rows]}
+                       for parameter, rows in groupby(parameter_values, key=lambda row: row[0])],
+    }
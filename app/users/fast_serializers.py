@@ -0,0 +1,203 @@
+from collections import defaultdict
+from django.conf import settings
+from rest_framework import serializers
+from .models import ProductInfo, ProductParameter, SellerOrder, SellerOrderItem, BuyerOrder, Contact
+from .serializers import ProductInfoSerializer, BasketSerializer, BuyerOrderSerializer
+
+# the same representation of dates as the DRF serializers
+datetime_to_representation = serializers.DateTimeField().to_representation
+phone_to_python = Contact._meta.get_field('phone').to_python
+
+SHOP_FIELDS = ('shop_id', 'shop__name', 'shop__url', 'shop__email')
+PRODUCT_INFO_FIELDS = ('id', 'category__category_id', 'category__category__name', 'product__name',
+                       *SHOP_FIELDS, 'quantity', 'price', 'price_rrc')
+ORDERED_ITEM_FIELDS = ('order_id', 'product_info_id', 'quantity', 'purchase_price', 'purchase_price_rrc',
+                       'product_info__category__category_id', 'product_info__category__category__name',
+                       'product_info__product__name')
+SELLER_ORDER_FIELDS = ('buyer_order_id', 'id', *SHOP_FIELDS, 'shipping_price', 'total', 'updated_at', 'state',
+                       'contact_id')
+CONTACT_FIELDS = ('id', 'city', 'street', 'house', 'structure', 'building', 'apartment', 'phone')
+
+
+class FastReadSerializer:
+    """
+    Read-only replacement of a DRF serializer which builds the same output from values() of the instances' ids
+    instead of nested serializers and model instances. Only `instance`, `many` and `data` are supported.
+    """
+    # the DRF serializer which output is reproduced
+    serializer_class = None
+
+    def __init__(self, instance=None, many: bool = False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @property
+    def data(self):
+        ids = [instance.pk for instance in (self.instance if self.many else [self.instance])]
+        data_by_id = self.build(ids) if ids else {}
+        data = [data_by_id[pk] for pk in ids]
+        return data if self.many else data[0]
+
+    def build(self, ids: list) -> dict:
+        """
+        Returns {id: representation}, made by serializer_class from the instances unless overridden.
+        """
+        instances = self.instance if self.many else [self.instance]
+        return {instance.pk: self.serializer_class(instance).data for instance in instances}
+
+
+def get_shop_representation(shop_id, name, url, email) -> dict | None:
+    if shop_id is None:
+        return None
+    return {'id': shop_id, 'name': name, 'url': url, 'email': email}
+
+
+def get_product_parameters(product_info_ids) -> dict:
+    parameters = defaultdict(list)
+    for product_info_id, parameter, value in ProductParameter.objects.filter(product_info_id__in=product_info_ids) \
+            .order_by('product_info', 'id').values_list('product_info_id', 'parameter__name', 'value__value'):
+        parameters[product_info_id].append({'parameter': parameter, 'value': value})
+    return parameters
+
+
+class FastProductInfoSerializer(FastReadSerializer):
+    """
+    ProductInfoSerializer.
+    """
+    serializer_class = ProductInfoSerializer
+
+    def build(self, ids: list) -> dict:
+        parameters = get_product_parameters(ids)
+        return {product_info_id: {'id': product_info_id,
+                                  'category': {'id': category_id, 'name': category_name},
+                                  'product': {'name': product_name},
+                                  'product_parameters': parameters.get(product_info_id, []),
+                                  'shop': get_shop_representation(shop_id, shop_name, shop_url, shop_email),
+                                  'quantity': quantity,
+                                  'price': price,
+                                  'price_rrc': price_rrc}
+                for (product_info_id, category_id, category_name, product_name,
+                     shop_id, shop_name, shop_url, shop_email, quantity, price, price_rrc)
+                in self.get_product_infos(ids)}
+
+    @staticmethod
+    def get_product_infos(ids: list):
+        product_infos = ProductInfo.objects.filter(id__in=ids).order_by()
+        if not settings.STOCK_HOLDS:
+            return product_infos.values_list(*PRODUCT_INFO_FIELDS)
+        return product_infos.with_available_quantity() \
+            .values_list(*('available_quantity' if field == 'quantity' else field for field in PRODUCT_INFO_FIELDS))
+
+
+class FastBasketSerializer(FastReadSerializer):
+    """
+    BasketSerializer.
+    """
+    serializer_class = BasketSerializer
+    buyer_order_fields = ('id', 'total')
+    seller_order_fields = ('id', 'shop', 'ordered_items', 'shipping_price', 'summary')
+
+    def build(self, ids: list) -> dict:
+        seller_orders = self.get_seller_orders(ids)
+        data = {}
+        for buyer_order in BuyerOrder.objects.filter(id__in=ids).order_by().values(*self.buyer_order_fields):
+            buyer_order_seller_orders = seller_orders.get(buyer_order['id'], [])
+            data[buyer_order['id']] = self.get_buyer_order_representation(buyer_order, buyer_order_seller_orders)
+        return data
+
+    def get_buyer_order_representation(self, buyer_order: dict, seller_orders: list) -> dict:
+        return {'id': buyer_order['id'],
+                'seller_orders': [seller_order for seller_order, state, contact_id in seller_orders],
+                'total_sum': buyer_order['total']}
+
+    def get_seller_orders(self, buyer_order_ids: list) -> dict:
+        """
+        Returns {buyer_order_id: [(representation, state, contact_id)]} ordered by id.
+        """
+        rows = list(SellerOrder.objects.filter(buyer_order_id__in=buyer_order_ids).order_by('id')
+                    .values_list(*SELLER_ORDER_FIELDS))
+        seller_order_ids = [row[1] for row in rows]
+        ordered_items = self.get_ordered_items(seller_order_ids)
+
+        seller_orders = defaultdict(list)
+        for (buyer_order_id, seller_order_id, shop_id, shop_name, shop_url, shop_email,
+             shipping_price, total, updated_at, state, contact_id) in rows:
+            values = {'id': seller_order_id,
+                      'shop': get_shop_representation(shop_id, shop_name, shop_url, shop_email),
+                      'ordered_items': ordered_items.get(seller_order_id, []),
+                      'shipping_price': shipping_price,
+                      'updated_at': datetime_to_representation(updated_at),
+                      'state': state,
+                      'summary': total}
+            seller_orders[buyer_order_id].append(({field: values[field] for field in self.seller_order_fields},
+                                                  state, contact_id))
+        return seller_orders
+
+    @staticmethod
+    def get_ordered_items(seller_order_ids: list) -> dict:
+        rows = list(SellerOrderItem.objects.filter(order_id__in=seller_order_ids).order_by('order', 'product_info')
+                    .values_list(*ORDERED_ITEM_FIELDS))
+        parameters = get_product_parameters({row[1] for row in rows})
+
+        ordered_items = defaultdict(list)
+        for (order_id, product_info_id, quantity, purchase_price, purchase_price_rrc,
+             category_id, category_name, product_name) in rows:
+            ordered_items[order_id].append({'product_info': {'id': product_info_id,
+                                                             'category': {'id': category_id, 'name': category_name},
+                                                             'product': {'name': product_name},
+                                                             'product_parameters': parameters.get(product_info_id, []),
+                                                             'price': purchase_price,
+                                                             'price_rrc': purchase_price_rrc},
+                                            'quantity': quantity})
+        return ordered_items
+
+
+class FastBuyerOrderSerializer(FastBasketSerializer):
+    """
+    BuyerOrderSerializer.
+    """
+    serializer_class = BuyerOrderSerializer
+    buyer_order_fields = ('id', 'total', 'state', 'created_at')
+    seller_order_fields = ('id', 'shop', 'ordered_items', 'shipping_price', 'updated_at', 'state', 'summary')
+
+    def build(self, ids: list) -> dict:
+        self.contacts = None
+        return super().build(ids)
+
+    def get_seller_orders(self, buyer_order_ids: list) -> dict:
+        seller_orders = super().get_seller_orders(buyer_order_ids)
+        # the contact of a buyer order is the contact of its first seller order
+        contact_ids = {orders[0][2] for orders in seller_orders.values()} - {None}
+        self.contacts = {contact['id']: contact
+                         for contact in Contact.objects.filter(id__in=contact_ids).order_by().values(*CONTACT_FIELDS)}
+        for contact in self.contacts.values():
+            contact['phone'] = str(phone_to_python(contact['phone'])) if contact['phone'] else contact['phone']
+        return seller_orders
+
+    def get_buyer_order_representation(self, buyer_order: dict, seller_orders: list) -> dict:
+        data = {'id': buyer_order['id'],
+                'seller_orders': [seller_order for seller_order, state, contact_id in seller_orders]}
+        # BuyerOrder.contact fails without seller orders and the field is skipped
+        if seller_orders:
+            contact_id = seller_orders[0][2]
+            data['contact'] = self.contacts[contact_id] if contact_id is not None else None
+        data['total_sum'] = buyer_order['total']
+        data['state'] = buyer_order['state']
+        data['created_at'] = datetime_to_representation(buyer_order['created_at'])
+        return data
+
+
+class FastReadSerializerMixin:
+    """
+    Uses `fast_serializer_class` for list and retrieve when FAST_SERIALIZERS is on.
+    """
+    fast_serializer_class = None
+
+    @property
+    def use_fast_serializer(self) -> bool:
+        return settings.FAST_SERIALIZERS and self.action in ('list', 'retrieve')
+
+    def get_serializer_class(self):
+        if self.use_fast_serializer:
+            return self.fast_serializer_class
+        return super().get_serializer_class()
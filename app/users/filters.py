@@ -1,6 +1,8 @@
 from django.db.models import Q
 from django_filters import rest_framework as filters, DateFromToRangeFilter
-from .models import ProductInfo, SellerOrder, BuyerOrder
+from rest_framework.exceptions import ValidationError
+from .models import ProductInfo, SellerOrder, BuyerOrder, ProductCard, ProductParameter
+from .search import search_products
 
 
 class ProductFilter(filters.FilterSet):
@@ -11,7 +13,13 @@ class ProductFilter(filters.FilterSet):
     min_price_rrc = filters.NumberFilter(field_name='price_rrc', lookup_expr='gte')
     max_price_rrc = filters.NumberFilter(field_name='price_rrc', lookup_expr='lte')
     category = filters.CharFilter(method='filter_category')
-    quantity = filters.NumberFilter(field_name='quantity', lookup_expr='gte')
+    quantity = filters.NumberFilter(method='filter_quantity')
+    search = filters.CharFilter(method='filter_search')
+    parameter_range = filters.CharFilter(method='filter_parameter_range')
+
+    name_lookup = 'product__name__icontains'
+    shop_lookup = 'shop__name__icontains'
+    category_lookup = 'category__category__name__icontains'
 
     class Meta:
         model = ProductInfo
@@ -22,16 +30,47 @@ class ProductFilter(filters.FilterSet):
                   'min_price_rrc',
                   'max_price_rrc',
                   'category',
-                  'quantity')
+                  'quantity',
+                  'search',
+                  'parameter_range')
 
     def filter_name(self, queryset, name, value):
-        return self.get_multiple_values_queryset(value, queryset, 'product__name__icontains')
+        return self.get_multiple_values_queryset(value, queryset, self.name_lookup)
 
     def filter_shop(self, queryset, name, value):
-        return self.get_multiple_values_queryset(value, queryset, 'shop__name__icontains')
+        return self.get_multiple_values_queryset(value, queryset, self.shop_lookup)
 
     def filter_category(self,  queryset, name, value):
-        return self.get_multiple_values_queryset(value, queryset, 'category__category__name__icontains')
+        return self.get_multiple_values_queryset(value, queryset, self.category_lookup)
+
+    def filter_quantity(self, queryset, name, value):
+        # the available quantity when the queryset accounts for stock holds, see ProductView
+        if 'available_quantity' in queryset.query.annotations:
+            return queryset.filter(available_quantity__gte=value)
+        return queryset.filter(quantity__gte=value)
+
+    def filter_search(self, queryset, name, value):
+        return search_products(queryset, value)
+
+    def filter_parameter_range(self, queryset, name, value):
+        """
+        Comma separated ranges `parameter:min:max` (min or max can be empty) of numeric values of parameters,
+        every range is an index range of (parameter, numeric_value).
+        """
+        for parameter_range in value.split(','):
+            try:
+                parameter, min_value, max_value = parameter_range.rsplit(':', 2)
+                # the bounds are numbers in the sense of the stored numeric values
+                bounds = {f'numeric_value__{lookup}': ProductParameter.parse_numeric_value(bound)
+                          for lookup, bound in (('gte', min_value), ('lte', max_value)) if bound.strip()}
+                if None in bounds.values():
+                    raise ValueError(parameter_range)
+            except ValueError:
+                raise ValidationError({name: f'{parameter_range}: expected parameter:min:max'})
+            product_parameters = ProductParameter.objects.filter(parameter__name=parameter.strip(),
+                                                                 numeric_value__isnull=False, **bounds)
+            queryset = queryset.filter(id__in=product_parameters.values('product_info_id'))
+        return queryset
 
     def get_multiple_values_queryset(self, url_parameter_value, queryset, searched_model_attribute):
         values = url_parameter_value.split(',')
@@ -43,6 +82,15 @@ class ProductFilter(filters.FilterSet):
         return queryset.filter(filtering_object)
 
 
+class ProductCardFilter(ProductFilter):
+    name_lookup = 'product_name__icontains'
+    shop_lookup = 'shop_name__icontains'
+    category_lookup = 'category_name__icontains'
+
+    class Meta(ProductFilter.Meta):
+        model = ProductCard
+
+
 class PartnerProductFilter(ProductFilter):
     product_external_id = filters.NumberFilter(field_name='external_id')
     category_external_id = filters.NumberFilter(field_name='category__external_id')
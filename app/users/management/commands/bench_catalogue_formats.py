@@ -0,0 +1,56 @@
+import csv
+import json
+from io import BytesIO, StringIO
+from pathlib import Path
+from time import perf_counter
+import yaml
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from users.catalogue_formats import YamlCatalogueReader, JsonLinesCatalogueReader, CsvCatalogueReader
+
+
+class Command(BaseCommand):
+    help = 'Compares parse throughput of the same catalogue in yaml, csv and json lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=str(Path(settings.BASE_DIR) / 'data' / 'shop1.yaml'))
+        parser.add_argument('--goods', type=int, default=50000, help='number of goods in the generated catalogue')
+
+    def handle(self, *args, **options):
+        with open(options['source'], 'rb') as file:
+            source = yaml.safe_load(file)
+
+        source_goods = source['goods']
+        goods = [dict(source_goods[index % len(source_goods)], id=index + 1) for index in range(options['goods'])]
+        header = {key: value for key, value in source.items() if key != 'goods'}
+        category_names = {category['id']: category['name'] for category in source['categories']}
+
+        files = {
+            'yaml': yaml.dump(header | {'goods': goods}, allow_unicode=True, sort_keys=False).encode(),
+            'jsonl': '\n'.join(json.dumps(line, ensure_ascii=False) for line in [header, *goods]).encode(),
+            'csv': self.to_csv(goods, category_names).encode(),
+        }
+        readers = {
+            'yaml': YamlCatalogueReader,
+            'jsonl': JsonLinesCatalogueReader,
+            'csv': lambda stream: CsvCatalogueReader(stream, {'shop': header['shop']}),
+        }
+
+        for catalogue_format, content in files.items():
+            started_at = perf_counter()
+            count = sum(1 for good in readers[catalogue_format](BytesIO(content)).goods)
+            duration = perf_counter() - started_at
+            self.stdout.write(f'{catalogue_format:>6}: {count} goods, {len(content) / 2 ** 20:.1f} MB, '
+                              f'{duration:.2f} s, {count / duration:.0f} goods/s')
+
+    @staticmethod
+    def to_csv(goods: list, category_names: dict) -> str:
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(('id', 'category', 'category_name', 'model', 'name',
+                         'price', 'price_rrc', 'quantity', 'parameters'))
+        for good in goods:
+            writer.writerow((good['id'], good['category'], category_names[good['category']], good.get('model'),
+                             good['name'], good['price'], good['price_rrc'], good['quantity'],
+                             json.dumps(good['parameters'], ensure_ascii=False)))
+        return output.getvalue()
@@ -0,0 +1,79 @@
+from random import Random
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from django.db import transaction, connection
+from users.app_choices import UserType, UserConfirmation
+from users.filters import ProductFilter
+from users.models import User, Shop, Category, ShopCategory, Product, ProductInfo
+from users.search import create_search_indexes
+
+WORDS = ('смартфон', 'телефон', 'ноутбук', 'планшет', 'наушники', 'чехол', 'зарядка', 'кабель', 'колонка', 'часы',
+         'apple', 'samsung', 'xiaomi', 'huawei', 'sony', 'lenovo', 'asus', 'honor', 'realme', 'nokia',
+         'черный', 'белый', 'синий', 'золотистый', 'серебристый', 'красный', 'зеленый', 'розовый',
+         'pro', 'max', 'mini', 'lite', 'plus', 'ultra', 'air', 'neo')
+
+
+class Command(BaseCommand):
+    help = 'Compares the icontains filters with the product search on a generated table, the data is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='number of generated products')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--queries', nargs='+', default=['iphone', 'смартфон,ноутбук', 'samsung черный'])
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.generate(options['rows'])
+            create_search_indexes(connection.alias)
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(f'ANALYZE {ProductInfo._meta.db_table}')
+
+            products = ProductInfo.objects.filter(shop__is_open=True, quantity__gt=0).with_details()
+            for query in options['queries']:
+                for filter_name in ('name', 'search'):
+                    queryset = ProductFilter({filter_name: query}, queryset=products).qs
+                    started_at = perf_counter()
+                    for _ in range(options['repeat']):
+                        count = queryset.count()
+                        list(queryset[:5])
+                    duration = (perf_counter() - started_at) / options['repeat']
+                    self.stdout.write(f'{filter_name:>6} {query!r}: {count} found, {duration * 1000:.1f} ms')
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def generate(rows: int, batch_size: int = 10000):
+        random = Random(0)
+        shops = []
+        for index in range(10):
+            owner = User.objects.create_user(f'bench-search-{index}@example.com', None, type=UserType.seller,
+                                             need_confirmation=UserConfirmation.confirmed)
+            shops.append(Shop.objects.create(owner=owner, name=f'bench-search-{index}', email=owner.email))
+
+        categories = Category.objects.bulk_create([Category(name=f'bench {word} {index}')
+                                                   for index, word in enumerate(WORDS)])
+        shop_categories = ShopCategory.objects.bulk_create([ShopCategory(shop=shop, category=category,
+                                                                         external_id=index)
+                                                            for shop in shops
+                                                            for index, category in enumerate(categories)])
+        shop_categories = {(shop_category.shop_id, shop_category.category_id): shop_category
+                           for shop_category in shop_categories}
+
+        products = Product.objects.bulk_create([Product(name=' '.join(random.sample(WORDS, 3)) + f' {index}')
+                                                for index in range(max(rows // 20, 1))],
+                                               batch_size=batch_size)
+
+        for start in range(0, rows, batch_size):
+            product_infos = []
+            for external_id in range(start, min(start + batch_size, rows)):
+                shop = shops[external_id % len(shops)]
+                category = random.choice(categories)
+                product = random.choice(products)
+                product_infos.append(ProductInfo(
+                    external_id=external_id, shop=shop, category=shop_categories[shop.id, category.id],
+                    product=product, quantity=random.randint(0, 20), price=random.randint(100, 100000),
+                    price_rrc=random.randint(100, 100000),
+                    search_document=ProductInfo.build_search_document(product.name, category.name,
+                                                                      random.sample(WORDS, 3))))
+            ProductInfo.objects.bulk_create(product_infos)
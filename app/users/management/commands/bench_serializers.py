@@ -0,0 +1,95 @@
+from random import Random
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from users.app_choices import UserType, UserConfirmation, BuyerOrderState, SellerOrderState
+from users.fast_serializers import FastProductInfoSerializer, FastBasketSerializer, FastBuyerOrderSerializer
+from users.models import User, Shop, Category, ShopCategory, Product, ProductInfo, Parameter, ValueOfParameter, \
+    ProductParameter, Contact, BuyerOrder, SellerOrder, SellerOrderItem
+from users.serializers import ProductInfoSerializer, BasketSerializer, BuyerOrderSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compares the serialization time of 1000 rows by the DRF and the fast serializers, the data is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='number of serialized products and orders')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            buyer = self.generate(rows)
+
+            product_infos = ProductInfo.objects.filter(shop__owner__email__startswith='bench-serializers')
+            orders = buyer.orders.exclude(state=BuyerOrderState.basket)
+            baskets = buyer.orders.filter(state=BuyerOrderState.basket)
+            cases = (('products', ProductInfoSerializer, FastProductInfoSerializer,
+                      product_infos.with_details(), product_infos),
+                     ('baskets', BasketSerializer, FastBasketSerializer, baskets, baskets),
+                     ('orders', BuyerOrderSerializer, FastBuyerOrderSerializer, orders, orders))
+
+            for name, serializer_class, fast_serializer_class, queryset, fast_queryset in cases:
+                durations = []
+                contents = []
+                for current_class, current_queryset in ((serializer_class, queryset),
+                                                        (fast_serializer_class, fast_queryset)):
+                    started_at = perf_counter()
+                    for _ in range(options['repeat']):
+                        instances = list(current_queryset.all())
+                        data = current_class(instances, many=True).data
+                    # milliseconds per 1000 rows
+                    durations.append((perf_counter() - started_at) / options['repeat'] / len(instances) * 1000000)
+                    contents.append(JSONRenderer().render(data))
+
+                if contents[0] != contents[1]:
+                    raise CommandError(f'{name}: the fast serializer output differs')
+                self.stdout.write(f'{name:>8} ({len(instances)} rows): {durations[0]:.1f} ms -> '
+                                  f'{durations[1]:.1f} ms per 1000 rows, output is identical')
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def generate(rows: int, items_per_order: int = 5) -> User:
+        random = Random(0)
+        owner = User.objects.create_user('bench-serializers-shop@example.com', None, type=UserType.seller,
+                                         need_confirmation=UserConfirmation.confirmed)
+        shop = Shop.objects.create(owner=owner, name='bench-serializers', email=owner.email)
+        category = Category.objects.create(name='bench-serializers')
+        shop_category = ShopCategory.objects.create(shop=shop, category=category, external_id=1)
+        parameters = Parameter.objects.bulk_create([Parameter(name=f'bench-parameter-{index}') for index in range(3)])
+        values = ValueOfParameter.objects.bulk_create([ValueOfParameter(value=f'bench-value-{index}')
+                                                       for index in range(10)])
+
+        products = Product.objects.bulk_create([Product(name=f'bench-serializers-{index}') for index in range(rows)])
+        product_infos = ProductInfo.objects.bulk_create([
+            ProductInfo(external_id=index, shop=shop, category=shop_category, product=product,
+                        quantity=random.randint(1, 20), price=random.randint(100, 100000),
+                        price_rrc=random.randint(100, 100000))
+            for index, product in enumerate(products)])
+        ProductParameter.objects.bulk_create([ProductParameter(product_info=product_info, parameter=parameter,
+                                                               value=random.choice(values))
+                                              for product_info in product_infos for parameter in parameters])
+
+        buyer = User.objects.create_user('bench-serializers-buyer@example.com', None, type=UserType.buyer,
+                                         need_confirmation=UserConfirmation.confirmed)
+        contact = Contact.objects.create(user=buyer, city='Москва', street='Тверская', phone='+79001234567')
+        now = timezone.now()
+        buyer_orders = BuyerOrder.objects.bulk_create([
+            BuyerOrder(user=buyer, state=BuyerOrderState.basket if index % 10 == 0 else BuyerOrderState.accepted,
+                       created_at=now)
+            for index in range(rows)])
+        seller_orders = SellerOrder.objects.bulk_create([
+            SellerOrder(buyer_order=buyer_order, shop=shop, contact=contact, shipping_price=300,
+                        state=SellerOrderState.basket if buyer_order.state == BuyerOrderState.basket
+                        else random.choice((SellerOrderState.new, SellerOrderState.canceled)))
+            for buyer_order in buyer_orders for _ in range(2)])
+        SellerOrderItem.objects.bulk_create([
+            SellerOrderItem(order=seller_order, product_info=product_info, quantity=random.randint(1, 5),
+                            purchase_price=product_info.price, purchase_price_rrc=product_info.price_rrc)
+            for seller_order in seller_orders
+            for product_info in random.sample(product_infos, min(items_per_order, len(product_infos)))])
+        BuyerOrder.objects.filter(user=buyer).update_totals()
+        return buyer
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from users.models import ProductInfo, ProductCard
+from users.product_cards import refresh_product_cards
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds product cards of all products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not settings.PRODUCT_CARDS:
+            raise CommandError('product cards are off, set PRODUCT_CARDS=True')
+
+        with transaction.atomic():
+            ProductCard.objects.all().delete()
+            product_info_ids = ProductInfo.objects.order_by('id').values_list('id', flat=True)
+            refresh_product_cards(product_info_ids, options['batch_size'])
+        self.stdout.write(f'{ProductCard.objects.count()} product cards are built')
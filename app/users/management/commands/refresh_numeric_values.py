@@ -0,0 +1,24 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from users.models import ValueOfParameter, ProductParameter
+
+
+class Command(BaseCommand):
+    help = 'Sets numeric values of product parameters (e.g. imported before they were added)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        value_ids = defaultdict(list)
+        for value_id, value in ValueOfParameter.objects.order_by().values_list('id', 'value').iterator():
+            value_ids[ProductParameter.parse_numeric_value(value)].append(value_id)
+
+        count = 0
+        batch_size = options['batch_size']
+        for numeric_value, ids in value_ids.items():
+            for index in range(0, len(ids), batch_size):
+                count += ProductParameter.objects.filter(value_id__in=ids[index:index + batch_size]) \
+                    .exclude(numeric_value=numeric_value) \
+                    .update(numeric_value=numeric_value)
+        self.stdout.write(f'numeric values of {count} product parameters are updated')
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Max
+from users.models import BuyerOrder, SellerOrder
+
+
+class Command(BaseCommand):
+    help = 'Recomputes stored totals of seller and buyer orders which differ from their items ' \
+           '(e.g. orders created before the totals were added or edited in the database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--verify', action='store_true', help='only report the orders with wrong totals')
+
+    def handle(self, *args, **options):
+        # totals of buyer orders are sums of the stored totals of seller orders, seller orders go first
+        mismatched = {'seller orders': self.refresh(SellerOrder, options['batch_size'], options['verify'],
+                                                    buyer_orders=False),
+                      'buyer orders': self.refresh(BuyerOrder, options['batch_size'], options['verify'],
+                                                   seller_orders=False)}
+
+        for name, ids in mismatched.items():
+            self.stdout.write(f'{len(ids)} {name} with wrong totals' + (f': {ids[:20]}' if ids else ''))
+        if options['verify'] and any(mismatched.values()):
+            raise CommandError('stored totals differ from the items')
+
+    @staticmethod
+    def refresh(model, batch_size: int, verify: bool, **update_options) -> list:
+        """
+        Compares the stored totals with the computed ones by ranges of ids and updates the wrong ones,
+        returns their ids.
+        """
+        mismatched = []
+        max_id = model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        for start in range(0, max_id + 1, batch_size):
+            with transaction.atomic():
+                ids = list(model.objects.filter(id__gte=start, id__lt=start + batch_size)
+                           .with_computed_totals()
+                           .exclude(items_total=F('computed_items_total'), total=F('computed_total'))
+                           .order_by('id').values_list('id', flat=True))
+                if ids and not verify:
+                    model.objects.filter(id__in=ids).update_totals(**update_options)
+            mismatched.extend(ids)
+        return mismatched
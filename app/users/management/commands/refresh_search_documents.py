@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from users.models import ProductInfo
+
+
+class Command(BaseCommand):
+    help = 'Builds search documents of products which have not got them (e.g. imported before the search was added)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='rebuild documents of all products')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        product_infos = ProductInfo.objects.all()
+        if not options['all']:
+            product_infos = product_infos.filter(search_document='')
+
+        count = product_infos.count()
+        product_infos.refresh_search_documents(options['batch_size'])
+        self.stdout.write(f'search documents of {count} products are rebuilt')
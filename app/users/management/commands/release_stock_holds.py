@@ -0,0 +1,20 @@
+from time import sleep
+from django.core.management.base import BaseCommand
+from users.stock import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Releases expired stock holds of baskets in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit after one pass')
+        parser.add_argument('--sleep', type=float, default=60, help='seconds between passes')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        while True:
+            if released := release_expired_holds(options['batch_size']):
+                self.stdout.write(f'{released} stock holds released')
+            if options['once']:
+                return
+            sleep(options['sleep'])
@@ -0,0 +1,44 @@
+from time import sleep
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from users.app_choices import ImportJobState
+from users.catalogue import run_import_job, fail_stale_import_jobs
+from users.models import CatalogueImportJob
+
+
+class Command(BaseCommand):
+    help = 'Runs queued catalogue imports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit when there are no queued imports')
+        parser.add_argument('--sleep', type=float, default=5, help='seconds to wait for new imports')
+
+    def handle(self, *args, **options):
+        while True:
+            if failed := fail_stale_import_jobs(settings.CATALOGUE_IMPORT_TIMEOUT):
+                self.stdout.write(f'{failed} interrupted catalogue imports failed')
+            job = self.claim_job()
+            if job is not None:
+                self.stdout.write(f'catalogue import {job.id} started')
+                run_import_job(job)
+                self.stdout.write(f'catalogue import {job.id} {job.state}')
+            elif options['once']:
+                return
+            else:
+                sleep(options['sleep'])
+
+    @staticmethod
+    def claim_job():
+        """
+        Marks the oldest queued job as running, concurrent workers skip the locked row.
+        """
+        with transaction.atomic():
+            job = CatalogueImportJob.objects.select_for_update(skip_locked=True, of=('self',)) \
+                .filter(state=ImportJobState.queued).order_by('id').select_related('user').first()
+            if job is not None:
+                job.state = ImportJobState.running
+                job.started_at = timezone.now()
+                job.save(update_fields=['state', 'started_at'])
+        return job
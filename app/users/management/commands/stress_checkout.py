@@ -0,0 +1,90 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+from users.app_choices import UserType, UserConfirmation, BuyerOrderState, SellerOrderState
+from users.models import User, Shop, Category, ShopCategory, Product, ProductInfo, Contact, BuyerOrder, SellerOrder, \
+    SellerOrderItem
+
+
+class Command(BaseCommand):
+    help = 'Checks out baskets of the same products in parallel and checks that nothing is oversold. ' \
+           'The data is committed (parallel requests use their own connections) and deleted at the end'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=50)
+        parser.add_argument('--stock', type=int, default=20, help='quantity of every product')
+        parser.add_argument('--products', type=int, default=3, help='products in every basket')
+        parser.add_argument('--quantity', type=int, default=1, help='quantity of every product in a basket')
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        owner, buyers = self.generate(options)
+        try:
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                                   ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                with ThreadPoolExecutor(options['workers']) as executor:
+                    statuses = Counter(executor.map(self.checkout, buyers))
+
+            stock = dict(ProductInfo.objects.filter(shop__owner=owner).values_list('id', 'quantity'))
+            sold = Counter()
+            for product_info_id, quantity in SellerOrderItem.objects \
+                    .filter(order__shop__owner=owner, order__state=SellerOrderState.new) \
+                    .values_list('product_info_id', 'quantity'):
+                sold[product_info_id] += quantity
+
+            self.stdout.write(f'responses: {dict(statuses)}')
+            for product_info_id, quantity in stock.items():
+                self.stdout.write(f'product {product_info_id}: {options["stock"]} in stock, '
+                                  f'{sold[product_info_id]} sold, {quantity} left')
+                if quantity < 0 or quantity + sold[product_info_id] != options['stock']:
+                    raise CommandError(f'product {product_info_id} is oversold or lost')
+            self.stdout.write('no oversell')
+        finally:
+            User.objects.filter(id__in=[owner.id, *(buyer.id for buyer in buyers)]).delete()
+
+    @staticmethod
+    def checkout(buyer: User) -> int | str:
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {buyer.auth_token.key}')
+        try:
+            return client.post('/order/', {'contact': buyer.contacts.get().id}, format='json').status_code
+        except DatabaseError as error:
+            # sqlite fails concurrent write transactions instead of waiting for locks
+            return type(error).__name__
+        finally:
+            connection.close()
+
+    @staticmethod
+    def generate(options) -> tuple:
+        owner = User.objects.create_user('stress-checkout-shop@example.com', None, type=UserType.seller,
+                                         need_confirmation=UserConfirmation.confirmed)
+        shop = Shop.objects.create(owner=owner, name='stress-checkout', email=owner.email)
+        category, _ = Category.objects.get_or_create(name='stress-checkout')
+        shop_category = ShopCategory.objects.create(shop=shop, category=category, external_id=1)
+        product_infos = [ProductInfo.objects.create(external_id=index, shop=shop, category=shop_category,
+                                                    product=Product.objects.get_or_create(
+                                                        name=f'stress-checkout-{index}')[0],
+                                                    quantity=options['stock'], price=100, price_rrc=100)
+                         for index in range(options['products'])]
+
+        buyers = []
+        for index in range(options['buyers']):
+            buyer = User.objects.create_user(f'stress-checkout-{index}@example.com', None,
+                                             need_confirmation=UserConfirmation.confirmed)
+            buyer.create_auth_token()
+            Contact.objects.create(user=buyer, city='Москва', street='Тверская', phone='+79001234567')
+            basket = BuyerOrder.objects.create(user=buyer, state=BuyerOrderState.basket)
+            seller_order = SellerOrder.objects.create(buyer_order=basket, shop=shop, state=SellerOrderState.basket,
+                                                      shipping_price=shop.base_shipping_price)
+            SellerOrderItem.objects.bulk_create([SellerOrderItem(order=seller_order, product_info=product_info,
+                                                                 quantity=options['quantity'],
+                                                                 purchase_price=product_info.price,
+                                                                 purchase_price_rrc=product_info.price_rrc)
+                                                 for product_info in product_infos])
+            BuyerOrder.objects.filter(id=basket.id).update_totals()
+            buyers.append(buyer)
+        return owner, buyers
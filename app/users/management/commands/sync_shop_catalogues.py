@@ -0,0 +1,35 @@
+from datetime import timedelta
+from time import sleep
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from users.catalogue_sync import sync_shop_catalogues
+from users.models import Shop
+
+
+class Command(BaseCommand):
+    help = 'Imports catalogues of open shops from their url'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=settings.CATALOGUE_SYNC_INTERVAL,
+                            help='seconds between pulls of a shop catalogue')
+        parser.add_argument('--workers', type=int, default=settings.CATALOGUE_SYNC_WORKERS,
+                            help='number of concurrent downloads')
+        parser.add_argument('--timeout', type=float, default=60, help='timeout of a download in seconds')
+        parser.add_argument('--loop', action='store_true', help='keep running and pull catalogues when they are due')
+        parser.add_argument('--sleep', type=float, default=60, help='seconds between checks in the loop mode')
+
+    def handle(self, *args, **options):
+        while True:
+            due_at = timezone.now() - timedelta(seconds=options['interval'])
+            shops = Shop.objects.filter(Q(catalogue_fetched_at__isnull=True) | Q(catalogue_fetched_at__lte=due_at),
+                                        is_open=True, url__isnull=False).exclude(url='').select_related('owner')
+
+            results = sync_shop_catalogues(shops, options['workers'], options['timeout'])
+            if results:
+                self.stdout.write(', '.join(f'{status}: {count}' for status, count in results.items()))
+
+            if not options['loop']:
+                return
+            sleep(options['sleep'])
@@ -1,17 +1,35 @@
 import uuid
+from math import isfinite
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import PermissionsMixin
 from django.contrib.auth.base_user import BaseUserManager, AbstractBaseUser
 from django.db.models import Sum, F, Prefetch
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from orders.settings import BASE_DOMAIN
-from .app_choices import UserType, SellerOrderState, BuyerOrderState, UserConfirmation
+from .app_choices import UserType, SellerOrderState, BuyerOrderState, UserConfirmation, ImportJobState
 from rest_framework.authtoken.models import Token
 from phonenumber_field.modelfields import PhoneNumberField
 from .email_sender import send_confirmation_email
 
+try:
+    from django.contrib.postgres.search import SearchVectorField as PostgresSearchVectorField
+except ImportError:
+    # no postgres driver, the column is not used by the search on other databases
+    PostgresSearchVectorField = models.TextField
+
+
+class SearchVectorField(PostgresSearchVectorField):
+    """
+    tsvector column on postgres, text column on other databases
+    """
+
+    def db_type(self, connection):
+        return super().db_type(connection) if connection.vendor == 'postgresql' else 'text'
+
 
 class CustomUserManager(BaseUserManager):
     """
@@ -133,6 +151,12 @@ class Shop(models.Model):
     email = models.EmailField(null=False)
     base_shipping_price = models.PositiveIntegerField(default=300)
 
+    # state of the last catalogue pulled from url
+    catalogue_etag = models.CharField(max_length=200, blank=True, default='')
+    catalogue_last_modified = models.CharField(max_length=100, blank=True, default='')
+    catalogue_hash = models.CharField(max_length=64, blank=True, default='')
+    catalogue_fetched_at = models.DateTimeField(null=True, blank=True)
+
     def __str__(self):
         return self.name
 
@@ -201,6 +225,38 @@ class Product(models.Model):
         ordering = ('name',)
 
 
+class ProductInfoQuerySet(models.QuerySet):
+    def with_details(self):
+        """
+        Loads everything the product serializers show in a constant number of queries.
+        """
+        return self.select_related('category__category', 'product', 'shop') \
+            .prefetch_related(models.Prefetch('product_parameters',
+                                              queryset=ProductParameter.objects.select_related('parameter', 'value')
+                                              .order_by('product_info', 'id')))
+
+    def with_available_quantity(self):
+        """
+        Annotates available_quantity: the quantity minus active stock holds of baskets,
+        summed by a correlated subquery over the (product_info, expires_at) index of the holds.
+        """
+        holds = StockHold.objects.filter(product_info=models.OuterRef('pk'), expires_at__gt=timezone.now()) \
+            .order_by().values('product_info').annotate(held=Sum('quantity')).values('held')
+        held = Coalesce(models.Subquery(holds), 0, output_field=models.IntegerField())
+        return self.annotate(available_quantity=F('quantity') - held)
+
+    def refresh_search_documents(self, batch_size: int = 1000):
+        """
+        Rebuilds search documents of the product infos, e.g. after their parameters were replaced.
+        """
+        ids = list(self.order_by('id').values_list('id', flat=True))
+        for start in range(0, len(ids), batch_size):
+            product_infos = list(self.model.objects.filter(id__in=ids[start:start + batch_size]).with_details())
+            for product_info in product_infos:
+                product_info.search_document = product_info.get_search_document()
+            self.model.objects.bulk_update(product_infos, ('search_document',))
+
+
 class ProductInfo(models.Model):
     external_id = models.PositiveIntegerField()
     category = models.ForeignKey(ShopCategory, related_name='product_infos', on_delete=models.CASCADE)
@@ -211,6 +267,14 @@ class ProductInfo(models.Model):
     quantity = models.PositiveIntegerField()
     price = models.PositiveIntegerField()
     price_rrc = models.PositiveIntegerField()
+    # fingerprint of the last imported catalogue row, empty when the product was changed in another way
+    source_hash = models.CharField(max_length=32, blank=True, default='')
+    # product name, category name and parameter values for the product search
+    search_document = models.TextField(blank=True, default='')
+    # kept up to date from search_document by a trigger on postgres, see users.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductInfoQuerySet.as_manager()
 
     class Meta:
         verbose_name = "Store product"
@@ -219,10 +283,26 @@ class ProductInfo(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['shop', 'external_id'], name='unique_product_info'),
         ]
+        indexes = [
+            # cursor pagination of products
+            models.Index(fields=['price', 'id'], name='product_info_price_id'),
+            # facets of products in stock
+            models.Index(fields=['category', 'shop', 'price'], name='product_info_facet',
+                         condition=models.Q(quantity__gt=0)),
+        ]
 
     def __str__(self):
         return f'{self.shop} {self.external_id} {self.product}'
 
+    @staticmethod
+    def build_search_document(product_name: str, category_name: str, parameter_values) -> str:
+        return ' '.join((product_name, category_name, *parameter_values))
+
+    def get_search_document(self) -> str:
+        return self.build_search_document(self.product.name, self.category.name,
+                                          (product_parameter.value.value
+                                           for product_parameter in self.product_parameters.all()))
+
 
 class Parameter(models.Model):
     name = models.CharField(max_length=40)
@@ -260,6 +340,8 @@ class ProductParameter(models.Model):
                               related_name='product_parameters',
                               blank=True,
                               on_delete=models.CASCADE)
+    # the value as a number for range filters, null if it is not a number
+    numeric_value = models.FloatField(null=True, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Product Characteristics'
@@ -268,6 +350,57 @@ class ProductParameter(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['product_info', 'parameter'], name='unique_product_parameter'),
         ]
+        indexes = [
+            # parameter facets are counted from the index only
+            models.Index(fields=['product_info', 'parameter', 'value'], name='product_parameter_facet'),
+            # range filters by parameters
+            models.Index(fields=['parameter', 'numeric_value'], name='product_parameter_numeric'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.numeric_value = self.parse_numeric_value(self.value.value)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def parse_numeric_value(value) -> float | None:
+        """
+        '6.5', '6,5' and '512' are numbers, '2688x1242' and '1_000' (which float() reads) are not.
+        """
+        text = str(value).strip().replace(',', '.')
+        if '_' in text:
+            return None
+        try:
+            number = float(text)
+        except ValueError:
+            return None
+        return number if isfinite(number) else None
+
+
+class ProductCard(models.Model):
+    """
+    Denormalized product for the product list: the ProductInfoSerializer payload and the filtered columns,
+    see users.product_cards. The payload is stored as json text: jsonb on postgres would reorder its keys.
+    """
+    product_info = models.OneToOneField(ProductInfo, primary_key=True, related_name='card',
+                                        on_delete=models.CASCADE)
+    shop = models.ForeignKey(Shop, related_name='product_cards', on_delete=models.CASCADE)
+    is_open = models.BooleanField()
+    product_name = models.CharField(max_length=200)
+    shop_name = models.CharField(max_length=50)
+    category_name = models.CharField(max_length=50)
+    quantity = models.PositiveIntegerField()
+    price = models.PositiveIntegerField()
+    price_rrc = models.PositiveIntegerField()
+    payload = models.TextField()
+
+    class Meta:
+        verbose_name = 'Product card'
+        verbose_name_plural = 'Product cards'
+        ordering = ('shop', 'product_info')
+        indexes = [
+            models.Index(fields=['shop', 'product_info'], name='product_card_shop'),
+            models.Index(fields=['price'], name='product_card_price'),
+        ]
 
 
 class Contact(models.Model):
@@ -296,6 +429,47 @@ class Contact(models.Model):
         return '\n'.join([f'{self._meta.get_field(field).verbose_name}: {getattr(self, field)}' for field in fields])
 
 
+class BuyerOrderQuerySet(models.QuerySet):
+    @staticmethod
+    def get_seller_orders_sum(field: str):
+        """
+        Sum of `field` of the seller orders of the outer buyer order which are not canceled.
+        """
+        seller_orders = SellerOrder.objects.filter(buyer_order=models.OuterRef('pk')) \
+            .exclude(state=SellerOrderState.canceled) \
+            .order_by().values('buyer_order').annotate(sum=Sum(field)).values('sum')
+        return Coalesce(models.Subquery(seller_orders), 0, output_field=models.IntegerField())
+
+    def with_computed_totals(self):
+        return self.annotate(computed_items_total=self.get_seller_orders_sum('items_total'),
+                             computed_total=self.get_seller_orders_sum('total'))
+
+    def with_details(self):
+        """
+        Loads everything the basket and order serializers show in a constant number of queries.
+        """
+        return self.prefetch_related(*self.get_details_lookups())
+
+    @staticmethod
+    def get_details_lookups() -> tuple:
+        """
+        Lookups of with_details() for prefetch_related_objects() of loaded buyer orders.
+        """
+        return ('seller_orders__shop', 'seller_orders__contact',
+                models.Prefetch('seller_orders__ordered_items__product_info',
+                                queryset=ProductInfo.objects.with_details()))
+
+    def update_totals(self, seller_orders: bool = True) -> int:
+        """
+        Recomputes the stored totals of the buyer orders (and before them of their seller orders)
+        by set-based updates in the database.
+        """
+        if seller_orders:
+            SellerOrder.objects.filter(buyer_order_id__in=self.values('id')).update_totals(buyer_orders=False)
+        return self.update(items_total=self.get_seller_orders_sum('items_total'),
+                           total=self.get_seller_orders_sum('total'))
+
+
 class BuyerOrder(models.Model):
     user = models.ForeignKey(User, verbose_name='User',
                              related_name='orders', null=True,
@@ -305,24 +479,60 @@ class BuyerOrder(models.Model):
 
     state = models.CharField(verbose_name='Status', choices=BuyerOrderState.choices, max_length=16)
 
+    # totals of the seller orders which are not canceled, kept up to date by update_totals()
+    items_total = models.PositiveIntegerField(verbose_name='Items total', default=0, editable=False)
+    total = models.PositiveIntegerField(verbose_name='Total', default=0, editable=False)
+
+    objects = BuyerOrderQuerySet.as_manager()
+
     @property
     def contact(self):
-        return self.seller_orders.first().contact
+        # prefetched seller orders are used, AttributeError without seller orders as before
+        return next(iter(self.seller_orders.all()), None).contact
 
     @property
     def total_sum(self):
-        return sum([seller_order.summary for seller_order in self.seller_orders.all()
-                    if seller_order.state != SellerOrderState.canceled])
+        return self.total
 
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = "List of buyer's orders"
         ordering = ('id',)
+        indexes = [
+            # cursor pagination of the user's orders
+            models.Index(fields=['user', 'created_at', 'id'], name='buyer_order_user_created_at'),
+        ]
 
     def __str__(self):
         return f'{self.id} {self.user} {self.state} {self.created_at}'
 
 
+class SellerOrderQuerySet(models.QuerySet):
+    @staticmethod
+    def get_items_total():
+        """
+        Sum of quantity * purchase_price of the items of the outer seller order.
+        """
+        items = SellerOrderItem.objects.filter(order=models.OuterRef('pk')) \
+            .order_by().values('order').annotate(sum=Sum(F('quantity') * F('purchase_price'))).values('sum')
+        return Coalesce(models.Subquery(items), 0, output_field=models.IntegerField())
+
+    def with_computed_totals(self):
+        items_total = self.get_items_total()
+        return self.annotate(computed_items_total=items_total, computed_total=items_total + F('shipping_price'))
+
+    def update_totals(self, buyer_orders: bool = True) -> int:
+        """
+        Recomputes the stored totals of the seller orders (and then of their buyer orders)
+        by set-based updates in the database.
+        """
+        items_total = self.get_items_total()
+        updated = self.update(items_total=items_total, total=items_total + F('shipping_price'))
+        if buyer_orders:
+            BuyerOrder.objects.filter(id__in=self.values('buyer_order_id')).update_totals(seller_orders=False)
+        return updated
+
+
 class SellerOrder(models.Model):
     buyer_order = models.ForeignKey(BuyerOrder, verbose_name="Buyer's order",
                                     related_name='seller_orders', null=True,
@@ -344,16 +554,24 @@ class SellerOrder(models.Model):
 
     shipping_price = models.PositiveIntegerField()
 
+    # sum of the items and with the shipping price, kept up to date by update_totals()
+    items_total = models.PositiveIntegerField(verbose_name='Items total', default=0, editable=False)
+    total = models.PositiveIntegerField(verbose_name='Total', default=0, editable=False)
+
+    objects = SellerOrderQuerySet.as_manager()
+
     @property
     def summary(self):
-        sum_of_products = self.ordered_items.aggregate(total=Sum(F('quantity') * F('purchase_price')))['total']
-        if sum_of_products is None: sum_of_products = 0
-        return sum_of_products + self.shipping_price
+        return self.total
 
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = "List of seller's orders"
         ordering = ('id',)
+        indexes = [
+            # cursor pagination of the shop's orders
+            models.Index(fields=['shop', 'created_at', 'id'], name='seller_order_shop_created_at'),
+        ]
 
     def __str__(self):
         return f'{self.id} {self.buyer_order} {self.shop} {self.created_at}'
@@ -364,6 +582,11 @@ class SellerOrder(models.Model):
             product_info.quantity += ordered_item.quantity
             product_info.save()
 
+        from .caching import bump_catalogue_version
+        from .product_cards import refresh_product_cards
+        bump_catalogue_version(self.shop_id)
+        refresh_product_cards(ordered_item.product_info_id for ordered_item in self.ordered_items.all())
+
         if buyer_order is None:
             buyer_order = self.buyer_order
 
@@ -402,3 +625,92 @@ class SellerOrderItem(models.Model):
 
     def __str__(self):
         return f'{self.id} {self.order} {self.product_info}'
+
+
+class StockHold(models.Model):
+    """
+    Quantity of a product held for a basket till expires_at (when STOCK_HOLDS is on), see users.stock.
+    """
+    buyer_order = models.ForeignKey(BuyerOrder, verbose_name="Buyer's order", related_name='stock_holds',
+                                    on_delete=models.CASCADE)
+    product_info = models.ForeignKey(ProductInfo, verbose_name='Product Information', related_name='stock_holds',
+                                     on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name='Quantity')
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Stock hold'
+        verbose_name_plural = 'Stock holds'
+        ordering = ('expires_at',)
+        constraints = [
+            models.UniqueConstraint(fields=['buyer_order', 'product_info'], name='unique_stock_hold'),
+        ]
+        indexes = [
+            # held quantities of products, index-only on postgres
+            models.Index(fields=['product_info', 'expires_at'], include=['quantity', 'buyer_order'],
+                         name='stock_hold_product_info'),
+            # release of expired holds
+            models.Index(fields=['expires_at'], name='stock_hold_expires_at'),
+        ]
+
+    def __str__(self):
+        return f'{self.buyer_order_id} {self.product_info_id} {self.quantity} {self.expires_at}'
+
+
+class CatalogueImportJob(models.Model):
+    user = models.ForeignKey(User, verbose_name='User',
+                             related_name='catalogue_imports',
+                             on_delete=models.CASCADE)
+    file = models.FileField(upload_to='catalogues/', blank=True)
+    parameters_file = models.FileField(upload_to='catalogues/', blank=True)
+    # detected on upload: the stored file has no content type and may lose the extension
+    catalogue_format = models.CharField(max_length=5, default='yaml')
+    # fields of the upload form used by the csv format: shop, email, shipping_price
+    options = models.JSONField(default=dict, blank=True)
+    dry_run = models.BooleanField(default=False)
+    state = models.CharField(verbose_name='Status', choices=ImportJobState.choices,
+                             default=ImportJobState.queued, max_length=10)
+
+    total = models.PositiveIntegerField(null=True, blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, encoder=DjangoJSONEncoder)
+    result = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @property
+    def duration(self):
+        if self.started_at is None:
+            return None
+        return ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+
+    class Meta:
+        verbose_name = 'Catalogue import'
+        verbose_name_plural = 'Catalogue imports'
+        ordering = ('-id',)
+        indexes = [
+            models.Index(fields=['state', 'id'], name='catalogue_import_queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.user} {self.state}'
+
+
+class CatalogueVersion(models.Model):
+    """
+    The version of the catalogue (key 'catalogue') or of a shop ('shop:<id>') for the cached and conditional
+    responses, it is stored in the database to be shared by the web processes, the import worker and the sync.
+    """
+    key = models.CharField(primary_key=True, max_length=30)
+    version = models.BigIntegerField()
+    # timestamp of the last change
+    modified = models.FloatField()
+
+    class Meta:
+        verbose_name = 'Catalogue version'
+        verbose_name_plural = 'Catalogue versions'
+
+    def __str__(self):
+        return f'{self.key} {self.version}'
@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from .models import Category, Product, Parameter, ValueOfParameter
+
+
+class NameCache:
+    """
+    Process-local LRU cache {name: id} of a lookup table which rows are only added.
+    The whole table (up to max_size rows) is loaded on first use. Every `check_interval` seconds
+    one aggregate query (and one more per check_batch_size ids added since the last check) checks
+    that no cached row was deleted (by another process), otherwise the cache is reloaded.
+    Renamed rows are not noticed by the check, the post_save signal clears the cache of the process
+    where they are renamed.
+    Ids of rows created in a transaction get into the cache only after the commit.
+    """
+    # number of ids added since the last check, which are looked up by one query
+    check_batch_size = 500
+
+    def __init__(self, model, field: str, max_size: int, check_interval: float):
+        self.model = model
+        self.field = field
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._version = None
+        self._checked_at = None
+        # ids added to the cache since the last check
+        self._unchecked_ids = set()
+
+    def resolve(self, names, batch_size: int = 1000) -> dict:
+        """
+        Returns {name: id}, missing rows are created in bulk.
+        """
+        names = set(names)
+        resolved = {}
+        with self._lock:
+            self._check()
+            for name in names:
+                if (row_id := self._entries.get(name)) is not None:
+                    self._entries.move_to_end(name)
+                    resolved[name] = row_id
+            self.hits += len(resolved)
+            self.misses += len(names) - len(resolved)
+
+        if missing := names - resolved.keys():
+            fetched = self._fetch_or_create(missing, batch_size)
+            transaction.on_commit(lambda: self._add(fetched))
+            resolved.update(fetched)
+        return resolved
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._unchecked_ids.clear()
+            self._version = None
+
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def _check(self):
+        now = monotonic()
+        if self._version is not None and now - self._checked_at < self.check_interval:
+            return
+
+        old_count, old_max_id = self._version or (0, 0)
+        # ids are checked in chunks to keep the number of query parameters under the limits of the backends
+        unchecked_ids = sorted(self._unchecked_ids)
+        chunks = [unchecked_ids[index:index + self.check_batch_size]
+                  for index in range(0, len(unchecked_ids), self.check_batch_size)] or [[]]
+        version = self.model.objects.aggregate(count=Count('id'),
+                                               old_count=Count('id', filter=Q(id__lte=old_max_id)),
+                                               unchecked_count=Count('id', filter=Q(id__in=chunks[0])),
+                                               max_id=Max('id'))
+        if self._version is None or version['old_count'] != old_count \
+                or not self._unchecked_exist(version['unchecked_count'], chunks):
+            self._load()
+        self._unchecked_ids.clear()
+        self._version = (version['count'], version['max_id'] or 0)
+        self._checked_at = now
+
+    def _unchecked_exist(self, first_chunk_count: int, chunks: list) -> bool:
+        if first_chunk_count != len(chunks[0]):
+            return False
+        return all(self.model.objects.filter(id__in=chunk).count() == len(chunk) for chunk in chunks[1:])
+
+    def _load(self):
+        self._entries.clear()
+        # the earliest row wins when a table without unique constraint has duplicates
+        rows = self.model.objects.order_by('-id').values_list(self.field, 'id')[:self.max_size]
+        for name, row_id in rows:
+            self._entries[name] = row_id
+
+    def _add(self, fetched: dict):
+        with self._lock:
+            self._entries.update(fetched)
+            self._unchecked_ids.update(fetched.values())
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fetch_or_create(self, names: set, batch_size: int) -> dict:
+        resolved = {}
+        field = self.field
+
+        def fetch(names_to_fetch):
+            names_to_fetch = list(names_to_fetch)
+            for index in range(0, len(names_to_fetch), batch_size):
+                chunk = names_to_fetch[index:index + batch_size]
+                resolved.update(self.model.objects.filter(**{f'{field}__in': chunk})
+                                .order_by('-id').values_list(field, 'id'))
+
+        fetch(names)
+        if missing := names - resolved.keys():
+            self.model.objects.bulk_create([self.model(**{field: name}) for name in missing],
+                                           batch_size=batch_size,
+                                           ignore_conflicts=True)
+            fetch(missing)
+        return resolved
+
+
+name_caches = {model: NameCache(model, field, settings.NAME_CACHE_SIZE, settings.NAME_CACHE_CHECK_INTERVAL)
+               for model, field in ((Category, 'name'), (Product, 'name'),
+                                    (Parameter, 'name'), (ValueOfParameter, 'value'))}
+
+
+def resolve_names(model, names, batch_size: int = 1000) -> dict:
+    """
+    Returns {name: id} for the lookup table `model`, creating missing rows in bulk.
+    """
+    return name_caches[model].resolve(names, batch_size)
+
+
+def clear_name_caches():
+    for cache in name_caches.values():
+        cache.clear()
+
+
+def get_name_cache_stats() -> dict:
+    return {model._meta.model_name: cache.stats for model, cache in name_caches.items()}
@@ -0,0 +1,161 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pagination by the position of the last shown row in `ordering`, which must end with a unique field.
+    Null values of nullable fields go after the other ones. Pages are read by an index range instead of OFFSET
+    and no COUNT is done.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, ordering: tuple, page_size: int):
+        self.ordering = ordering
+        self.page_size = page_size
+        self.request = None
+        self.next_position = None
+        self.previous_position = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        model = queryset.model
+        position, reverse = self.decode_cursor(request, model)
+
+        ordering = [self.invert(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*self.get_order_by(model, ordering))
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(model, ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        has_next, has_previous = (position is not None, has_more) if reverse else (has_more, position is not None)
+        if results and has_next:
+            self.next_position = self.get_position(results[-1])
+        if results and has_previous:
+            self.previous_position = self.get_position(results[0])
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.next_position, reverse=False),
+            'previous': self.get_link(self.previous_position, reverse=True),
+            'results': data,
+        })
+
+    def get_position(self, instance) -> list:
+        return [getattr(instance, field.lstrip('-')) for field in self.ordering]
+
+    def get_link(self, position, reverse: bool):
+        if position is None:
+            return None
+        # datetimes keep microseconds, DjangoJSONEncoder would cut them
+        cursor = json.dumps({'p': position, 'r': reverse}, default=lambda value: value.isoformat())
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param,
+                                   urlsafe_b64encode(cursor.encode()).decode())
+
+    def decode_cursor(self, request, model) -> tuple:
+        """
+        The position of the cursor converted to the types of the fields of `model` and its direction.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = cursor['p'], bool(cursor['r'])
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise NotFound(self.invalid_cursor_message)
+            position = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                        for field, value in zip(self.ordering, position)]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def invert(field: str) -> str:
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def get_order_by(model, ordering) -> list:
+        """
+        Nulls of nullable fields go last in the ascending order and first in the descending one.
+        """
+        order_by = []
+        for field in ordering:
+            name = field.lstrip('-')
+            if not model._meta.get_field(name).null:
+                order_by.append(field)
+            elif field.startswith('-'):
+                order_by.append(F(name).desc(nulls_first=True))
+            else:
+                order_by.append(F(name).asc(nulls_last=True))
+        return order_by
+
+    @staticmethod
+    def get_position_filter(model, ordering, position) -> Q:
+        """
+        Rows after the position: (a, b) > (x, y) is a > x or a = x and b > y, where a null is greater than any value.
+        """
+        position_filter = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            if value is None:
+                # nothing goes after nulls in the ascending order, all values go after them in the descending one
+                after = Q(**{f'{name}__isnull': False}) if descending else None
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                after = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+                if not descending and model._meta.get_field(name).null:
+                    after |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            if after is not None:
+                position_filter |= equal & after
+            equal &= same
+        return position_filter
+
+
+class OptionalCursorPagination(PageNumberPagination):
+    """
+    Page number pagination, `?pagination=cursor` switches to the keyset pagination by `cursor_ordering`
+    (without count). The page size can be chosen by `page_size` up to MAX_PAGE_SIZE in both modes.
+    """
+    cursor_ordering = ('id',)
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    keyset_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get('pagination') != 'cursor':
+            return super().paginate_queryset(queryset, request, view)
+
+        self.keyset_paginator = KeysetPagination(self.cursor_ordering, self.get_page_size(request))
+        return self.keyset_paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_paginator is not None:
+            return self.keyset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class ProductPagination(OptionalCursorPagination):
+    cursor_ordering = ('price', 'id')
+
+
+class OrderPagination(OptionalCursorPagination):
+    cursor_ordering = ('created_at', 'id')
@@ -0,0 +1,79 @@
+import json
+from django.conf import settings
+from django_filters.utils import translate_validation
+from rest_framework.utils.encoders import JSONEncoder
+from .filters import ProductCardFilter
+from .models import ProductInfo, ProductCard
+from .serializers import ProductInfoSerializer
+
+PRODUCT_CARD_FIELDS = ('shop', 'is_open', 'product_name', 'shop_name', 'category_name',
+                       'quantity', 'price', 'price_rrc', 'payload')
+
+# query parameters of the product list which the product cards can answer
+PRODUCT_CARD_QUERY_PARAMS = {'name', 'shop', 'category', 'min_price', 'max_price', 'min_price_rrc', 'max_price_rrc',
+                             'quantity', 'page', 'page_size'}
+
+
+def build_product_card(product_info: ProductInfo) -> ProductCard:
+    return ProductCard(product_info=product_info,
+                       shop=product_info.shop,
+                       is_open=product_info.shop.is_open,
+                       product_name=product_info.product.name,
+                       shop_name=product_info.shop.name,
+                       category_name=product_info.category.name,
+                       quantity=product_info.quantity,
+                       price=product_info.price,
+                       price_rrc=product_info.price_rrc,
+                       payload=json.dumps(ProductInfoSerializer(product_info).data, cls=JSONEncoder,
+                                          ensure_ascii=False))
+
+
+def refresh_product_cards(product_info_ids, batch_size: int = 1000):
+    """
+    Rebuilds product cards of the product infos (when PRODUCT_CARDS is on).
+    """
+    if not settings.PRODUCT_CARDS:
+        return
+
+    product_info_ids = list(product_info_ids)
+    for start in range(0, len(product_info_ids), batch_size):
+        product_infos = ProductInfo.objects.filter(id__in=product_info_ids[start:start + batch_size]).with_details()
+        ProductCard.objects.bulk_create([build_product_card(product_info) for product_info in product_infos],
+                                        update_conflicts=True,
+                                        unique_fields=('product_info',),
+                                        update_fields=PRODUCT_CARD_FIELDS)
+
+
+def refresh_shop_product_cards(shop, only_state: bool = False):
+    """
+    Rebuilds product cards of the shop, `only_state` updates only whether the shop is open.
+    """
+    if not settings.PRODUCT_CARDS:
+        return
+
+    if only_state:
+        ProductCard.objects.filter(shop=shop).update(is_open=shop.is_open)
+    else:
+        refresh_product_cards(shop.product_infos.order_by('id').values_list('id', flat=True))
+
+
+class ProductCardListMixin:
+    """
+    Answers the product list from product cards, a single table with prepared payloads,
+    when PRODUCT_CARDS is on and the request uses only filters the cards have.
+    The cards do not follow stock holds, with STOCK_HOLDS the list is read from the product infos.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not settings.PRODUCT_CARDS or settings.STOCK_HOLDS \
+                or not request.query_params.keys() <= PRODUCT_CARD_QUERY_PARAMS:
+            return super().list(request, *args, **kwargs)
+
+        filterset = ProductCardFilter(request.query_params,
+                                      queryset=ProductCard.objects.filter(is_open=True, quantity__gt=0),
+                                      request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+
+        page = self.paginate_queryset(filterset.qs.values_list('payload', flat=True))
+        return self.get_paginated_response([json.loads(payload) for payload in page])
@@ -0,0 +1,35 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+                  if orjson is not None else None)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer which encodes compact responses by orjson (when it is installed), opt-in by JSON_RENDERER.
+    Values which are not JSON types are converted by the DRF encoder, so dates keep the DRF format.
+    Indented responses, ensure_ascii and values orjson can not encode fall back to the stdlib json.
+    The output differs from JSONRenderer in floats: 1e-05 is written as 0.00001, 1e+16 as 1e16,
+    and NaN and Infinity become null instead of an error.
+    """
+    default = encoders.JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.ensure_ascii or not self.compact \
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            content = orjson.dumps(data, default=self.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # the same escaping as JSONRenderer, the output is a javascript subset
+        return content.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
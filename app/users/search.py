@@ -0,0 +1,70 @@
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q, F
+from django.db.models.functions import Greatest
+from .models import ProductInfo, Product, Category, Shop, ProductCard
+
+
+def create_search_indexes(using: str = 'default'):
+    """
+    Creates the postgres trigger which keeps ProductInfo.search_vector up to date and the search indexes:
+    full text index of product infos and trigram indexes of their documents and of product, category and shop names
+    of products and product cards (the latter ones are used by icontains filters).
+    Other databases are searched by icontains of product names without indexes.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    product_info_table = ProductInfo._meta.db_table
+    config = f'pg_catalog.{settings.SEARCH_CONFIG}'
+    product_card_table = ProductCard._meta.db_table
+    trigram_indexes = ((product_info_table, 'search_document'), (Product._meta.db_table, 'name'),
+                       (Category._meta.db_table, 'name'), (Shop._meta.db_table, 'name'),
+                       (product_card_table, 'product_name'), (product_card_table, 'shop_name'),
+                       (product_card_table, 'category_name'))
+
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, column in trigram_indexes:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS {table}_{column}_trgm ON {table} '
+                           f'USING gin ({column} gin_trgm_ops)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {product_info_table}_search_vector ON {product_info_table} '
+                       f'USING gin (search_vector)')
+
+        cursor.execute(f'DROP TRIGGER IF EXISTS {product_info_table}_search_vector ON {product_info_table}')
+        cursor.execute(f'CREATE TRIGGER {product_info_table}_search_vector '
+                       f'BEFORE INSERT OR UPDATE OF search_document ON {product_info_table} '
+                       f'FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, %s, search_document)',
+                       [config])
+        cursor.execute(f'UPDATE {product_info_table} SET search_vector = to_tsvector(%s, search_document) '
+                       f'WHERE search_vector IS NULL', [config])
+
+
+def search_products(queryset, value: str):
+    """
+    Filters product infos by comma separated search terms.
+    On postgres the terms are matched by the full text search (websearch syntax) or by trigram word similarity
+    (typos) and the result is ordered by relevance. Other databases fall back to icontains of the product name
+    like the name filter.
+    """
+    terms = [term.strip() for term in value.split(',') if term.strip()]
+    if not terms:
+        return queryset
+
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.filter(reduce(or_, (Q(product__name__icontains=term) for term in terms)))
+
+    from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+
+    query = reduce(or_, (SearchQuery(term, config=settings.SEARCH_CONFIG, search_type='websearch')
+                         for term in terms))
+    similarities = [TrigramWordSimilarity(term, 'search_document') for term in terms]
+    similarity = Greatest(*similarities) if len(similarities) > 1 else similarities[0]
+
+    return queryset.filter(Q(search_vector=query) |
+                           reduce(or_, (Q(search_document__trigram_word_similar=term) for term in terms))) \
+        .annotate(search_rank=SearchRank(F('search_vector'), query) + similarity) \
+        .order_by('-search_rank', 'id')
@@ -1,13 +1,15 @@
 from django.contrib.auth.hashers import make_password, check_password
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django_rest_passwordreset.serializers import PasswordTokenSerializer
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.validators import UniqueTogetherValidator
 from .email_sender import send_confirmation_email
 from .models import User, Shop, Category, Product, Contact, \
-    ProductParameter, ProductInfo, SellerOrderItem, SellerOrder, Parameter, ShopCategory, BuyerOrder, ValueOfParameter
+    ProductParameter, ProductInfo, SellerOrderItem, SellerOrder, Parameter, ShopCategory, BuyerOrder, \
+    ValueOfParameter, CatalogueImportJob
 from .app_choices import SellerOrderState, PartnerState
+from .name_cache import resolve_names
 from django.contrib.auth.password_validation import validate_password
 
 
@@ -172,22 +174,22 @@ class BuyerCategorySerializer(PartnerCategorySerializer):
 class ProductInfoSerializer(ProductInfoBaseSerializer):
     category = BuyerCategorySerializer(read_only=True)
     shop = ShopSerializer(read_only=True)
+    quantity = serializers.SerializerMethodField()
 
     class Meta(ProductInfoBaseSerializer.Meta):
         fields = ('id', 'category', 'product', 'product_parameters', 'shop', 'quantity', 'price', 'price_rrc',)
         read_only_fields = ('id',)
 
+    def get_quantity(self, instance):
+        # less the stock holds when the queryset is annotated by with_available_quantity()
+        return getattr(instance, 'available_quantity', instance.quantity)
+
 
 class ProductInfoForOrderSerializer(ProductInfoSerializer):
     class Meta(ProductInfoBaseSerializer.Meta):
         fields = ('id', 'category', 'product', 'product_parameters', 'price', 'price_rrc',)
 
 
-class PartnerProductInfoBriefSerializer(ProductInfoBaseSerializer):
-    class Meta(ProductInfoBaseSerializer.Meta):
-        fields = ('product_parameters', 'quantity', 'price', 'price_rrc',)
-
-
 class PartnerProductInfoSerializer(ProductInfoBaseSerializer):
     product = ProductSerializer()
     product_parameters = ProductParameterSerializer(many=True)
@@ -198,12 +200,13 @@ class PartnerProductInfoSerializer(ProductInfoBaseSerializer):
 
     @property
     def is_http_method_update(self):
-        return self.context['request'].method in {'PATCH', 'PUT'}
+        request = self.context.get('request')
+        return request is not None and request.method in {'PATCH', 'PUT'}
 
     def validate_external_id(self, value):
         if self.is_http_method_update:
             raise ValidationError(f'changing of external_id not allowed')
-        elif self.context['view'].action != 'create_catalogue' \
+        elif not self.context.get('catalogue_import') \
                 and self.shop.product_infos.filter(external_id=value).exists():
 
             raise ValidationError(f'product with external_id {value} is already exists in your shop')
@@ -221,24 +224,28 @@ class PartnerProductInfoSerializer(ProductInfoBaseSerializer):
         category_external_id = category_data['external_id']
         category_name = category_data['name']
 
-        category_object, category_created = Category.objects.get_or_create(name=category_name)
+        category_id = resolve_names(Category, [category_name])[category_name]
 
         try:
             shop_category, shop_category_created = \
-                self.shop.categories.get_or_create(category=category_object,
+                self.shop.categories.get_or_create(category_id=category_id,
                                                    defaults={'external_id': category_external_id})
 
         except IntegrityError:
             raise ValidationError({'category_external_id': f'category with external_id '
                                                            f'{category_external_id} already exists'})
 
-        product_object, product_created = Product.objects.get_or_create(name=product_data['name'])
+        product_id = resolve_names(Product, [product_data['name']])[product_data['name']]
 
         product_parameters = validated_data.pop('product_parameters')
 
-        product_info = ProductInfo.objects.create(product=product_object,
+        search_document = ProductInfo.build_search_document(product_data['name'], category_name,
+                                                            (parameter_dict['value']
+                                                             for parameter_dict in product_parameters))
+        product_info = ProductInfo.objects.create(product_id=product_id,
                                                   shop=self.shop,
                                                   category=shop_category,
+                                                  search_document=search_document,
                                                   **validated_data)
 
         self._add_parameters(product_info, product_parameters)
@@ -256,46 +263,49 @@ class PartnerProductInfoSerializer(ProductInfoBaseSerializer):
 
         if product_parameters is not None:
             self._add_parameters(instance, product_parameters, replace_old=True)
+            validated_data['search_document'] = instance.build_search_document(
+                instance.product.name, instance.category.name,
+                (parameter_dict['value'] for parameter_dict in product_parameters))
 
+        validated_data['source_hash'] = ''
         return super().update(instance, validated_data)
 
-    def update_or_create(self, validated_data: dict):
-        instance = self.shop.product_infos.filter(external_id=validated_data['external_id'])\
-            .prefetch_related('product_parameters',
-                              'product_parameters__parameter',
-                              'product_parameters__value').first()
-        if instance:
-            sort_key = lambda x: x['parameter']
-            instance_data = PartnerProductInfoBriefSerializer(instance).data
-            product_parameters_old = instance_data.pop('product_parameters')
-            product_parameters_old.sort(key=sort_key)
-            product_parameters_new = validated_data['product_parameters']
-            fields_to_update = {key: validated_data[key]
-                                for key, value in instance_data.items() if value != validated_data[key]}
-            if product_parameters_old != sorted(product_parameters_new, key=sort_key):
-                fields_to_update['product_parameters'] = product_parameters_new
-            return self.update(instance, fields_to_update) if fields_to_update else instance
-        else:
-            return self.create(validated_data)
-
     def _add_parameters(self, product_info: ProductInfo, product_parameters: list | tuple, replace_old: bool = False):
         if replace_old: product_info.product_parameters.all().delete()
 
-        for parameter_dict in product_parameters:
-            try:
-                parameter, created = Parameter.objects.get_or_create(name=parameter_dict['parameter'])
-                value, created = ValueOfParameter.objects.get_or_create(value=parameter_dict['value'])
-                ProductParameter.objects.create(product_info=product_info,
-                                                parameter=parameter,
-                                                value=value)
-            except:
-                raise ValidationError({'error': 'bad parameters fields'})
+        try:
+            parameters = resolve_names(Parameter,
+                                       {parameter_dict['parameter'] for parameter_dict in product_parameters})
+            values = resolve_names(ValueOfParameter, {parameter_dict['value'] for parameter_dict in product_parameters})
+            ProductParameter.objects.bulk_create([ProductParameter(product_info=product_info,
+                                                                   parameter_id=parameters[parameter_dict['parameter']],
+                                                                   value_id=values[parameter_dict['value']],
+                                                                   numeric_value=ProductParameter.parse_numeric_value(
+                                                                       parameter_dict['value']))
+                                                  for parameter_dict in product_parameters])
+        except:
+            raise ValidationError({'error': 'bad parameters fields'})
 
     @property
     def shop(self):
+        if 'shop' in self.context:
+            return self.context['shop']
         return self.context['request'].auth.user.shop
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Takes instances from context['preloaded'] ({pk: instance}) which the view loads by one query for all items,
+    other pks are looked up (and rejected) as usual.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {})
+        if isinstance(data, int) and not isinstance(data, bool) and data in preloaded:
+            return preloaded[data]
+        return super().to_internal_value(data)
+
+
 class OrderItemBaseSerializer(serializers.ModelSerializer):
 
     status = serializers.CharField(read_only=True, required=False)
@@ -306,6 +316,7 @@ class OrderItemBaseSerializer(serializers.ModelSerializer):
 
 
 class OrderItemBuyerSerializer(OrderItemBaseSerializer):
+    product_info = PreloadedPrimaryKeyRelatedField(queryset=ProductInfo.objects.all())
 
     class Meta(OrderItemBaseSerializer.Meta):
         fields = ('product_info', 'quantity', 'order', 'status',)
@@ -408,14 +419,20 @@ class PartnerOrderSerializer(serializers.ModelSerializer):
         return value
 
     def update(self, instance, validated_data):
-        if new_state := validated_data.get('state'):
+        new_state = validated_data.get('state')
+        with transaction.atomic():
+            if new_state == SellerOrderState.canceled:
+                instance.rollback_product_quantity(instance.buyer_order)
+            instance = super().update(instance, validated_data)
+            # the shipping price is in the total, a canceled order is not in the total of the buyer order
+            SellerOrder.objects.filter(id=instance.id).update_totals()
+        instance.refresh_from_db(fields=('items_total', 'total'))
+
+        if new_state:
             buyer_order = instance.buyer_order
             buyer_email = buyer_order.user.email
             seller_order_id = instance.id
 
-            if new_state == SellerOrderState.canceled:
-                instance.rollback_product_quantity(buyer_order)
-
             subject = f'Order: {buyer_order.id}'
             message = f'Changes in the order: {buyer_order.id}. ' \
                       f'\nStatus of the attached order: {seller_order_id} ' \
@@ -423,7 +440,7 @@ class PartnerOrderSerializer(serializers.ModelSerializer):
 
             send_confirmation_email(buyer_email, subject=subject, message=message)
 
-        return super().update(instance, validated_data)
+        return instance
 
 
 class PartnerStateSerializer(serializers.Serializer):
@@ -440,3 +457,13 @@ class CustomPasswordTokenSerializer(PasswordTokenSerializer, PasswordMatchValida
 
     password2 = serializers.CharField()
     validate = PasswordMatchValidateMixin.validate
+
+
+class CatalogueImportJobSerializer(serializers.ModelSerializer):
+    duration = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = CatalogueImportJob
+        fields = ('id', 'state', 'catalogue_format', 'dry_run', 'total', 'processed', 'errors', 'result',
+                  'created_at', 'started_at', 'finished_at', 'duration')
+        read_only_fields = fields
@@ -1,8 +1,12 @@
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db.models.signals import post_save, post_delete, post_migrate
 from django.dispatch import receiver
 from django_rest_passwordreset.signals import reset_password_token_created, post_password_reset
 from django_rest_passwordreset.views import ResetPasswordRequestToken
+from .models import Category, Product, Parameter, ValueOfParameter, ProductParameter
+from .name_cache import name_caches
+from .search import create_search_indexes
 from .views import CustomResetPasswordConfirm
 
 
@@ -25,3 +29,30 @@ def password_reset_token_created(sender, instance, reset_password_token, **kwarg
 @receiver(post_password_reset, sender=CustomResetPasswordConfirm)
 def auth_token_reset(sender, user, **kwargs):
     user.update_auth_token()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Parameter)
+@receiver(post_save, sender=ValueOfParameter)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Parameter)
+@receiver(post_delete, sender=ValueOfParameter)
+def clear_name_cache(sender, created=False, **kwargs):
+    # a renamed or deleted row makes cached ids stale, other processes notice deletions by the version check
+    if not created:
+        name_caches[sender].clear()
+
+
+@receiver(post_save, sender=ValueOfParameter)
+def update_numeric_values(sender, instance, created=False, **kwargs):
+    if not created:
+        ProductParameter.objects.filter(value=instance) \
+            .update(numeric_value=ProductParameter.parse_numeric_value(instance.value))
+
+
+@receiver(post_migrate)
+def create_product_search_indexes(sender, using, **kwargs):
+    if sender.name == 'users':
+        create_search_indexes(using)
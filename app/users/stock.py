@@ -0,0 +1,130 @@
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, When
+from django.utils import timezone
+from .models import ProductInfo, StockHold
+
+
+class StockShortage(Exception):
+    """
+    Not enough stock, `short` is {product_info_id: available quantity} (None if it has to be read again).
+    """
+
+    def __init__(self, short: dict = None):
+        super().__init__(short)
+        self.short = short
+
+
+def get_held_quantities(product_info_ids, buyer_order=None) -> dict:
+    """
+    {product_info_id: quantity} held by active stock holds of baskets other than `buyer_order`.
+    """
+    holds = StockHold.objects.filter(product_info_id__in=product_info_ids, expires_at__gt=timezone.now())
+    if buyer_order is not None:
+        holds = holds.exclude(buyer_order=buyer_order)
+    return dict(holds.order_by().values('product_info_id').annotate(held=Sum('quantity'))
+                .values_list('product_info_id', 'held'))
+
+
+def get_available_quantities(product_info_ids, buyer_order=None, lock: bool = False) -> dict:
+    """
+    {product_info_id: available quantity}, less the active holds of other baskets when STOCK_HOLDS is on.
+    `lock` locks the rows of the product infos in the order of ids (concurrent checkouts and holds do not deadlock).
+    """
+    product_infos = ProductInfo.objects.filter(id__in=product_info_ids)
+    if lock:
+        product_infos = product_infos.select_for_update().order_by('id')
+    available = dict(product_infos.values_list('id', 'quantity'))
+    if settings.STOCK_HOLDS:
+        for product_info_id, held in get_held_quantities(product_info_ids, buyer_order).items():
+            available[product_info_id] = max(available.get(product_info_id, 0) - held, 0)
+    return available
+
+
+def get_shortages(demanded: dict, available: dict) -> dict:
+    return {product_info_id: available.get(product_info_id, 0) for product_info_id, quantity in demanded.items()
+            if available.get(product_info_id, 0) < quantity}
+
+
+def reserve_stock(demanded: dict, buyer_order=None):
+    """
+    Decrements quantities of product infos by {product_info_id: quantity} in the running transaction.
+    The rows are locked in the order of ids (concurrent checkouts do not deadlock), then decremented
+    by one conditional update (quantity = quantity - n where quantity >= n). Stock held for other baskets
+    than `buyer_order` is not available.
+    Raises StockShortage if any of them is short, the transaction has to be rolled back then.
+    """
+    if not demanded:
+        return
+
+    if short := get_shortages(demanded, get_available_quantities(demanded, buyer_order, lock=True)):
+        raise StockShortage(short)
+
+    updated = ProductInfo.objects \
+        .filter(reduce(or_, (Q(id=product_info_id, quantity__gte=quantity)
+                             for product_info_id, quantity in demanded.items()))) \
+        .update(quantity=Case(*(When(id=product_info_id, then=F('quantity') - quantity)
+                                for product_info_id, quantity in demanded.items()),
+                              default=F('quantity'),
+                              output_field=ProductInfo._meta.get_field('quantity')))
+    if updated != len(demanded):
+        # the rows were changed after the read, the database has no row locks
+        raise StockShortage()
+
+
+def get_stock_shortages(demanded: dict, buyer_order=None) -> dict:
+    """
+    {product_info_id: available quantity} of the product infos which have less than demanded.
+    """
+    return get_shortages(demanded, get_available_quantities(demanded, buyer_order))
+
+
+def hold_stock(buyer_order, demanded: dict):
+    """
+    Places or renews holds of the basket on {product_info_id: quantity} for STOCK_HOLD_TTL seconds
+    in the running transaction. The product infos are locked as by reserve_stock, so holds and checkouts
+    of the same products are serialized. Raises StockShortage if any of them is short.
+    """
+    if not demanded:
+        return
+
+    if short := get_shortages(demanded, get_available_quantities(demanded, buyer_order, lock=True)):
+        raise StockShortage(short)
+
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    StockHold.objects.bulk_create([StockHold(buyer_order=buyer_order, product_info_id=product_info_id,
+                                             quantity=quantity, expires_at=expires_at)
+                                   for product_info_id, quantity in sorted(demanded.items())],
+                                  update_conflicts=True,
+                                  unique_fields=['buyer_order', 'product_info'],
+                                  update_fields=['quantity', 'expires_at'])
+
+
+def release_stock_holds(buyer_order, product_info_ids=None) -> int:
+    """
+    Deletes holds of the basket (on the given product infos), the released stock is shown when the transaction
+    is committed.
+    """
+    holds = StockHold.objects.filter(buyer_order=buyer_order)
+    if product_info_ids is not None:
+        holds = holds.filter(product_info_id__in=product_info_ids)
+    return holds.delete()[0]
+
+
+def release_expired_holds(batch_size: int = 1000) -> int:
+    """
+    Deletes holds expired by now in batches of batch_size, one transaction per batch.
+    Expired holds are not counted anyway, releasing them keeps the table and its index small,
+    so it has to run on a schedule (`python manage.py release_stock_holds`).
+    """
+    now = timezone.now()
+    released = 0
+    while hold_ids := list(StockHold.objects.filter(expires_at__lte=now).order_by('expires_at')
+                           .values_list('id', flat=True)[:batch_size]):
+        with transaction.atomic():
+            # a hold renewed after the read is not expired any more and stays
+            released += StockHold.objects.filter(id__in=hold_ids, expires_at__lte=now).delete()[0]
+    return released
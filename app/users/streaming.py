@@ -0,0 +1,51 @@
+from itertools import islice
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+STREAM_TRUE_VALUES = {'true', 'True', '1'}
+
+
+def iterate_chunks(queryset, chunk_size: int):
+    """
+    Reads the queryset by a server-side cursor (where the database has one) in lists of chunk_size instances,
+    prefetch_related lookups are done for every chunk.
+    """
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield chunk
+
+
+def stream_json_list(chunks, renderer=None):
+    """
+    Yields the JSON array of the rows of all chunks, every chunk is rendered separately.
+    """
+    renderer = renderer or JSONRenderer()
+    yield b'['
+    separator = b''
+    for chunk in chunks:
+        if chunk:
+            # rows of the rendered array without its brackets
+            yield separator + renderer.render(chunk)[1:-1]
+            separator = b','
+    yield b']'
+
+
+class StreamingListMixin:
+    """
+    `?stream=true` answers the list with an unpaginated JSON array streamed while the rows are read
+    and serialized by chunks of STREAM_CHUNK_SIZE, so the whole list is never in memory.
+    """
+    stream_query_param = 'stream'
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params.get(self.stream_query_param) not in STREAM_TRUE_VALUES:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        chunks = (self.get_serializer(chunk, many=True).data
+                  for chunk in iterate_chunks(queryset, settings.STREAM_CHUNK_SIZE))
+        # the json renderer of the view, the same as for the other responses
+        renderer = next((renderer for renderer in self.get_renderers() if isinstance(renderer, JSONRenderer)),
+                        JSONRenderer())
+        return StreamingHttpResponse(stream_json_list(chunks, renderer), content_type=renderer.media_type)
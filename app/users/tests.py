@@ -1,3 +1,1216 @@
-from django.test import TestCase
+import csv
+import json
+from base64 import urlsafe_b64encode
+from datetime import timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from textwrap import indent
+from threading import Barrier, Thread
+from unittest import skipIf, skipUnless
+from unittest.mock import patch
+import yaml
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction
+from django.db.models import Max, Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from .app_choices import UserType, BuyerOrderState, SellerOrderState, ImportJobState
+from .catalogue import import_catalogue, CatalogueImportError, ErrorReport, get_categories, validate_goods, \
+    validate_goods_in_pool, start_validation_pool
+from .catalogue_formats import YamlCatalogueReader, get_catalogue_format
+from .caching import get_catalogue_version, _bump_catalogue_version
+from .catalogue_sync import fetch_catalogue, sync_shop, sync_shop_catalogues
+from .fast_serializers import FastProductInfoSerializer, FastBasketSerializer, FastBuyerOrderSerializer
+from .management.commands.bench_serializers import Command as BenchSerializersCommand
+from .models import User, Shop, Parameter, ProductInfo, ProductParameter, BuyerOrder, SellerOrder, SellerOrderItem, \
+    Contact, StockHold, CatalogueImportJob, ProductCard
+from .name_cache import NameCache, clear_name_caches
+from .serializers import PartnerProductInfoSerializer, ProductInfoSerializer
+from .renderers import FastJSONRenderer, orjson
+from .stock import StockShortage, reserve_stock, release_expired_holds
 
-# Create your tests here.
+CATALOGUE = (settings.BASE_DIR / 'data' / 'shop1.yaml').read_bytes()
+
+
+def create_user(email: str, user_type: str = UserType.buyer) -> tuple[User, APIClient]:
+    """
+    A confirmed user and the api client authenticated by the user's token
+    """
+    user = User.objects.create_user(email, 'Password-12345', first_name='First', last_name='Last',
+                                    type=user_type, need_confirmation=0)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {user.create_auth_token()}')
+    return user, client
+
+
+def import_goods(owner: User, ids, parameters: int = 3, quantity: int = 10, shop: str = 'Shop', price: int = 100):
+    """
+    Imports a catalogue of goods with `ids` into the shop of the owner, each with `parameters` parameters
+    """
+    goods = [{'id': good_id, 'category': 1 + good_id % 2, 'model': f'model {good_id}', 'name': f'Good {good_id}',
+              'price': price + good_id, 'price_rrc': 200 + good_id, 'quantity': quantity,
+              'parameters': {f'Parameter {index}': f'value {good_id % 3}' for index in range(parameters)}}
+             for good_id in ids]
+    catalogue = {'shop': shop, 'categories': [{'id': 1, 'name': 'Phones'}, {'id': 2, 'name': 'Tablets'}],
+                 'goods': goods}
+    return import_catalogue(owner, BytesIO(yaml.safe_dump(catalogue, allow_unicode=True).encode()), workers=0)
+
+
+def get_catalogue_variants() -> dict:
+    """
+    The goods of CATALOGUE as json lines and csv (with the parameters column and with the companion parameters file)
+    """
+    catalogue = yaml.safe_load(CATALOGUE)
+    goods = catalogue.pop('goods')
+    categories = {category['id']: category['name'] for category in catalogue['categories']}
+
+    def write_csv(rows) -> bytes:
+        text = StringIO()
+        csv.writer(text).writerows(rows)
+        return text.getvalue().encode()
+
+    columns = ('id', 'category', 'category_name', 'name', 'price', 'price_rrc', 'quantity')
+    rows = [[good['id'], good['category'], categories[good['category']], good['name'], good['price'],
+             good['price_rrc'], good['quantity']] for good in goods]
+    return {
+        'jsonl': '\n'.join(json.dumps(line, ensure_ascii=False) for line in [catalogue, *goods]).encode(),
+        'csv': write_csv([(*columns, 'parameters'),
+                          *[row + [json.dumps(good['parameters'], ensure_ascii=False)]
+                            for row, good in zip(rows, goods)]]),
+        'csv rows': write_csv([columns, *rows]),
+        'csv parameters': write_csv([('id', 'parameter', 'value'),
+                                     *[(good['id'], parameter, value)
+                                       for good in goods for parameter, value in good['parameters'].items()]]),
+    }
+
+
+def get_catalogue_rows(shop: Shop) -> list:
+    """
+    Product infos of the shop with their categories and parameters, ordered by external_id
+    """
+    return [(product_info.external_id, product_info.category.external_id, product_info.category.category.name,
+             product_info.product.name, product_info.quantity, product_info.price, product_info.price_rrc,
+             sorted((product_parameter.parameter.name, product_parameter.value.value)
+                    for product_parameter in product_info.product_parameters.all()))
+            for product_info in shop.product_infos.order_by('external_id')
+            .select_related('category__category', 'product')
+            .prefetch_related('product_parameters__parameter', 'product_parameters__value')]
+
+
+class ApiTestCase(TestCase):
+    """
+    Requests are not throttled, cached responses and names of the previous tests are dropped
+    """
+
+    def setUp(self):
+        cache.clear()
+        clear_name_caches()
+        throttles = patch('rest_framework.views.APIView.throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+
+
+class CatalogueServer(BaseHTTPRequestHandler):
+    """
+    Serves the catalogue at /shop1.yaml and a malformed one at /broken.yaml with ETag and Last-Modified,
+    other paths are not found
+    """
+    etag = '"shop1"'
+    last_modified = 'Mon, 02 Oct 2023 10:00:00 GMT'
+    catalogues = {'/shop1.yaml': CATALOGUE,
+                  '/broken.yaml': b'shop: Broken\ncategories: [{id: 1, name: Phones}]\ngoods: [1, 2]\n'}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers)))
+        if self.path not in self.catalogues:
+            self.send_error(404)
+            return
+        if self.etag == self.headers.get('If-None-Match') \
+                or self.last_modified == self.headers.get('If-Modified-Since'):
+            self.send_response(304)
+            self.end_headers()
+            return
+        catalogue = self.catalogues[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-yaml')
+        self.send_header('Content-Length', str(len(catalogue)))
+        self.send_header('ETag', self.etag)
+        self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        self.wfile.write(catalogue)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CATALOGUE_IMPORT_WORKERS=0)
+class CatalogueSyncTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), CatalogueServer)
+        Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        CatalogueServer.requests.clear()
+        owner, _ = create_user('shop@example.com', UserType.seller)
+        self.shop = Shop.objects.create(owner=owner, name='Связной', email='shop@example.com',
+                                        url=f'{self.base_url}/shop1.yaml')
+
+    def test_import_then_not_modified(self):
+        self.assertEqual(sync_shop_catalogues([self.shop], workers=2), {'imported': 1})
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.product_infos.count(), 4)
+        self.assertEqual(self.shop.catalogue_etag, CatalogueServer.etag)
+        self.assertEqual(self.shop.catalogue_last_modified, CatalogueServer.last_modified)
+
+        self.assertEqual(sync_shop_catalogues([self.shop]), {'not modified': 1})
+        headers = CatalogueServer.requests[-1][1]
+        self.assertEqual(headers['If-None-Match'], CatalogueServer.etag)
+        self.assertEqual(headers['If-Modified-Since'], CatalogueServer.last_modified)
+
+    def test_not_modified_since(self):
+        self.shop.catalogue_last_modified = CatalogueServer.last_modified
+        self.assertEqual(sync_shop_catalogues([self.shop]), {'not modified': 1})
+        self.assertNotIn('If-None-Match', CatalogueServer.requests[-1][1])
+        self.assertFalse(self.shop.product_infos.exists())
+
+    def test_same_catalogue_is_not_imported_again(self):
+        fetched = fetch_catalogue(self.shop.url)
+        self.assertEqual(sync_shop(self.shop, fetched), 'imported')
+        self.assertTrue(fetched.file.closed)
+
+        self.shop.catalogue_etag = self.shop.catalogue_last_modified = ''
+        with patch('users.catalogue_sync.import_catalogue') as import_catalogue:
+            self.assertEqual(sync_shop_catalogues([self.shop]), {'unchanged': 1})
+        import_catalogue.assert_not_called()
+
+    def test_fetch_error(self):
+        self.shop.url = f'{self.base_url}/missing.yaml'
+        self.assertEqual(sync_shop_catalogues([self.shop]), {'failed': 1})
+        self.shop.refresh_from_db()
+        self.assertIsNotNone(self.shop.catalogue_fetched_at)
+        self.assertEqual(self.shop.catalogue_hash, '')
+        self.assertFalse(self.shop.product_infos.exists())
+
+    def test_malformed_catalogue(self):
+        owner, _ = create_user('broken@example.com', UserType.seller)
+        broken_shop = Shop.objects.create(owner=owner, name='Broken', email='broken@example.com',
+                                          url=f'{self.base_url}/broken.yaml')
+        with self.assertLogs('users.catalogue_sync', 'ERROR'):
+            self.assertEqual(sync_shop_catalogues([broken_shop, self.shop], workers=1),
+                             {'failed': 1, 'imported': 1})
+        broken_shop.refresh_from_db()
+        self.assertIsNotNone(broken_shop.catalogue_fetched_at)
+        self.assertEqual(broken_shop.catalogue_hash, '')
+        self.assertFalse(broken_shop.product_infos.exists())
+        self.assertEqual(self.shop.product_infos.count(), 4)
+
+
+class CatalogueWriterTests(TestCase):
+
+    def setUp(self):
+        # the name caches may hold rows of the rolled back tests
+        clear_name_caches()
+        # categories, parameters and their values exist, the name caches are cold
+        owner, _ = create_user('other@example.com', UserType.seller)
+        import_goods(owner, [0, 1, 2], shop='Other')
+        self.addCleanup(clear_name_caches)
+
+    def get_query_counts(self, size: int) -> tuple:
+        """
+        Queries of the import of `size` new goods, of its unchanged re-import and of the re-import with new prices
+        """
+        clear_name_caches()
+        owner, _ = create_user(f'shop{size}@example.com', UserType.seller)
+        ids = range(size * 100, size * 101)
+        query_counts = []
+        for price, stats in ((100, {'created': size, 'updated': 0, 'unchanged': 0, 'zeroed': 0}),
+                             (100, {'created': 0, 'updated': 0, 'unchanged': size, 'zeroed': 0}),
+                             (150, {'created': 0, 'updated': size, 'unchanged': 0, 'zeroed': 0})):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(import_goods(owner, ids, shop=f'Shop {size}', price=price), stats)
+            query_counts.append(len(queries))
+        return tuple(query_counts)
+
+    def test_query_count_does_not_depend_on_size(self):
+        self.assertEqual(self.get_query_counts(10), self.get_query_counts(20))
+
+    def test_catalogue_is_written(self):
+        owner, _ = create_user('shop@example.com', UserType.seller)
+        self.assertEqual(import_catalogue(owner, BytesIO(CATALOGUE), workers=0),
+                         {'created': 4, 'updated': 0, 'unchanged': 0, 'zeroed': 0})
+
+        shop = Shop.objects.get(owner=owner)
+        self.assertEqual((shop.name, shop.email, shop.base_shipping_price), ('Связной', 'shop@example.com', 300))
+        self.assertEqual(list(shop.categories.values_list('external_id', 'category__name')), [(224, 'Смартфоны')])
+        parameters = [('Встроенная память (Гб)', '256'), ('Диагональ (дюйм)', '6.1'),
+                      ('Разрешение (пикс)', '1792x828')]
+        self.assertEqual(get_catalogue_rows(shop), [
+            (4216226, 224, 'Смартфоны', 'Смартфон Apple iPhone XR 256GB (черный)', 5, 65000, 69990,
+             parameters + [('Цвет', 'черный')]),
+            (4216292, 224, 'Смартфоны', 'Смартфон Apple iPhone XS Max 512GB (золотистый)', 14, 110000, 116990,
+             [('Встроенная память (Гб)', '512'), ('Диагональ (дюйм)', '6.5'), ('Разрешение (пикс)', '2688x1242'),
+              ('Цвет', 'золотистый')]),
+            (4216313, 224, 'Смартфоны', 'Смартфон Apple iPhone XR 256GB (красный)', 9, 65000, 69990,
+             parameters + [('Цвет', 'красный')]),
+            (4672670, 224, 'Смартфоны', 'Смартфон Apple iPhone XR 128GB (синий)', 7, 60000, 64990,
+             parameters + [('Цвет', 'синий')]),
+        ])
+        self.assertEqual(dict(ProductParameter.objects.filter(product_info__shop=shop, value__value='6.5')
+                              .values_list('parameter__name', 'numeric_value')),
+                         {'Диагональ (дюйм)': 6.5})
+
+    def test_changes_are_detected(self):
+        owner, _ = create_user('shop@example.com', UserType.seller)
+        import_catalogue(owner, BytesIO(CATALOGUE), workers=0)
+        shop = Shop.objects.get(owner=owner)
+        parameter_ids = dict(shop.product_infos.values_list('external_id').annotate(Max('product_parameters__id')))
+
+        catalogue = yaml.safe_load(CATALOGUE)
+        unchanged, price_changed, parameter_changed, vanished = catalogue['goods']
+        price_changed['price'] = 64000
+        parameter_changed['parameters']['Цвет'] = 'белый'
+        new = unchanged | {'id': 1, 'quantity': 3}
+        catalogue['goods'] = [unchanged, price_changed, parameter_changed, new]
+        self.assertEqual(import_catalogue(owner, BytesIO(yaml.safe_dump(catalogue, allow_unicode=True).encode()),
+                                          workers=0),
+                         {'created': 1, 'updated': 2, 'unchanged': 1, 'zeroed': 1})
+
+        rows = {row[0]: row for row in get_catalogue_rows(shop)}
+        self.assertEqual(rows[unchanged['id']][4:7], (14, 110000, 116990))
+        self.assertEqual(rows[price_changed['id']][4:7], (9, 64000, 69990))
+        self.assertIn(('Цвет', 'белый'), rows[parameter_changed['id']][7])
+        self.assertNotIn(('Цвет', 'черный'), rows[parameter_changed['id']][7])
+        self.assertEqual(rows[vanished['id']][4:7], (0, 60000, 64990))
+        self.assertEqual(rows[new['id']][3:7], (unchanged['name'], 3, 110000, 116990))
+        new_parameter_ids = dict(shop.product_infos.values_list('external_id').annotate(Max('product_parameters__id')))
+        # parameters of unchanged goods are not rewritten, parameters of changed ones are
+        self.assertEqual(new_parameter_ids[unchanged['id']], parameter_ids[unchanged['id']])
+        self.assertEqual(new_parameter_ids[vanished['id']], parameter_ids[vanished['id']])
+        self.assertNotEqual(new_parameter_ids[price_changed['id']], parameter_ids[price_changed['id']])
+        self.assertNotEqual(new_parameter_ids[parameter_changed['id']], parameter_ids[parameter_changed['id']])
+
+        # a quantity change does not rewrite the good, the vanished good comes back
+        unchanged['quantity'] = 1
+        catalogue['goods'].append(vanished)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(import_catalogue(owner, BytesIO(yaml.safe_dump(catalogue, allow_unicode=True).encode()),
+                                              workers=0),
+                             {'created': 0, 'updated': 2, 'unchanged': 3, 'zeroed': 0})
+        self.assertFalse([query for query in queries.captured_queries if 'users_productparameter' in query['sql']])
+        rows = {row[0]: row for row in get_catalogue_rows(shop)}
+        self.assertEqual((rows[unchanged['id']][4], rows[vanished['id']][4]), (1, 7))
+
+
+class YamlCatalogueTests(TestCase):
+
+    def setUp(self):
+        clear_name_caches()
+        self.addCleanup(clear_name_caches)
+        self.owner, _ = create_user('shop@example.com', UserType.seller)
+
+    def test_goods_before_header(self):
+        catalogue = yaml.safe_load(CATALOGUE)
+        catalogue = {'goods': catalogue.pop('goods')} | catalogue
+        self.assertEqual(import_catalogue(self.owner, BytesIO(yaml.safe_dump(catalogue, allow_unicode=True,
+                                                                             sort_keys=False).encode()), workers=0),
+                         {'created': 4, 'updated': 0, 'unchanged': 0, 'zeroed': 0})
+        self.assertEqual(Shop.objects.get(owner=self.owner).name, 'Связной')
+        # the same rows as written from the catalogue with the header first
+        self.assertEqual(import_catalogue(self.owner, BytesIO(CATALOGUE), workers=0),
+                         {'created': 0, 'updated': 0, 'unchanged': 4, 'zeroed': 0})
+
+    def test_shop_fields_after_goods(self):
+        with self.assertRaises(CatalogueImportError) as context:
+            import_catalogue(self.owner, BytesIO(CATALOGUE + b'email: shop@example.com\n'), workers=0)
+        self.assertEqual(context.exception.detail, {'error': 'email must go before goods'})
+        self.assertFalse(Shop.objects.filter(owner=self.owner, product_infos__isnull=False).exists())
+
+    def test_goods_are_streamed(self):
+        good = yaml.safe_load(CATALOGUE)['goods'][0]
+        # more goods at the end of the goods of the catalogue
+        goods = yaml.safe_dump([good | {'id': good_id} for good_id in range(5000)], allow_unicode=True)
+        stream = BytesIO(CATALOGUE + indent(goods, '  ').encode())
+        catalogue = YamlCatalogueReader(stream)
+        goods = catalogue.goods
+        self.assertEqual(next(goods)['id'], good['id'])
+        self.assertLess(stream.tell(), len(stream.getvalue()) // 10)
+        self.assertEqual(sum(1 for _ in goods), 5003)
+
+    def test_large_catalogue(self):
+        self.assertEqual(import_goods(self.owner, range(3000), parameters=1),
+                         {'created': 3000, 'updated': 0, 'unchanged': 0, 'zeroed': 0})
+        self.assertEqual(ProductInfo.objects.filter(shop__owner=self.owner, quantity=10).count(), 3000)
+        self.assertEqual(ProductParameter.objects.filter(product_info__shop__owner=self.owner).count(), 3000)
+
+
+class ValidationPoolTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.executor = start_validation_pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        catalogue = yaml.safe_load(CATALOGUE)
+        self.categories_source = catalogue['categories']
+        good = catalogue['goods'][0]
+        self.goods = [good | {'id': good_id} for good_id in range(12)]
+        # bad goods in different chunks and two in one chunk
+        self.goods[1] |= {'price': 'free'}
+        self.goods[4] |= {'category': 100}
+        self.goods[5].pop('name')
+        self.goods[10] |= {'quantity': 'many', 'price_rrc': 'none'}
+
+    def validate(self, report: ErrorReport = None) -> list:
+        get_serializer = partial(PartnerProductInfoSerializer, context={'shop': None, 'catalogue_import': True})
+        return list(validate_goods(self.goods, self.categories_source, get_categories(self.categories_source),
+                                   get_serializer, report))
+
+    def validate_in_pool(self, report: ErrorReport = None) -> list:
+        return list(validate_goods_in_pool(self.goods, self.categories_source, self.executor, 2, report,
+                                           chunk_size=2))
+
+    def test_same_as_serial(self):
+        report, pool_report = ErrorReport(), ErrorReport()
+        validated = self.validate(report)
+        self.assertEqual(self.validate_in_pool(pool_report), validated)
+        self.assertEqual([good['external_id'] for good in validated], [0, 2, 3, 6, 7, 8, 9, 11])
+        self.assertEqual(pool_report.data, report.data)
+        self.assertEqual([(error['row'], error['external_id']) for error in report.errors],
+                         [(1, 1), (4, 4), (5, 5), (10, 10), (10, 10)])
+
+    def test_first_error(self):
+        with self.assertRaises(CatalogueImportError) as context:
+            self.validate()
+        with self.assertRaises(CatalogueImportError) as pool_context:
+            self.validate_in_pool()
+        self.assertEqual(pool_context.exception.detail, context.exception.detail)
+        self.assertEqual(context.exception.detail['product']['id'], 1)
+
+
+class CatalogueImportJobTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        clear_name_caches()
+        self.addCleanup(clear_name_caches)
+        media_root = TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.owner, self.client = create_user('shop@example.com', UserType.seller)
+
+    def enqueue(self) -> dict:
+        file = BytesIO(CATALOGUE)
+        file.name = 'shop1.yaml'
+        response = self.client.post('/partner/products/upload/', {'file': file, 'background': '1'}, format='multipart')
+        self.assertEqual(response.status_code, 202, response.data)
+        return response.data
+
+    def run_jobs(self) -> str:
+        stdout = StringIO()
+        call_command('run_catalogue_imports', '--once', stdout=stdout)
+        return stdout.getvalue()
+
+    def test_enqueue_run_status(self):
+        job = self.enqueue()
+        self.assertEqual((job['state'], job['catalogue_format']), ('queued', 'yaml'))
+        self.assertEqual(self.client.get(f'/partner/imports/{job["id"]}/').data['state'], 'queued')
+        self.assertFalse(ProductInfo.objects.exists())
+
+        self.assertEqual(self.run_jobs(), f'catalogue import {job["id"]} started\n'
+                                          f'catalogue import {job["id"]} done\n')
+        response = self.client.get('/partner/imports/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 1)
+        job = response.data['results'][0]
+        self.assertEqual((job['state'], job['total'], job['processed'], job['errors']), ('done', 4, 4, []))
+        self.assertEqual({key: job['result'][key] for key in ('created', 'updated', 'unchanged', 'zeroed')},
+                         {'created': 4, 'updated': 0, 'unchanged': 0, 'zeroed': 0})
+        self.assertEqual(ProductInfo.objects.filter(shop__owner=self.owner).count(), 4)
+        self.assertFalse(CatalogueImportJob.objects.get(id=job['id']).file)
+
+    def test_interrupted_job_fails(self):
+        stale_job, running_job = self.enqueue(), self.enqueue()
+        CatalogueImportJob.objects.filter(id=stale_job['id']).update(
+            state=ImportJobState.running,
+            started_at=timezone.now() - timedelta(seconds=settings.CATALOGUE_IMPORT_TIMEOUT + 1))
+        CatalogueImportJob.objects.filter(id=running_job['id']).update(state=ImportJobState.running,
+                                                                      started_at=timezone.now())
+        file_name = CatalogueImportJob.objects.get(id=stale_job['id']).file.name
+
+        self.assertEqual(self.run_jobs(), '1 interrupted catalogue imports failed\n')
+        job = self.client.get(f'/partner/imports/{stale_job["id"]}/').data
+        self.assertEqual((job['state'], job['errors']), ('failed', [{'error': 'the import was interrupted'}]))
+        self.assertIsNotNone(job['finished_at'])
+        self.assertFalse(default_storage.exists(file_name))
+        self.assertEqual(self.client.get(f'/partner/imports/{running_job["id"]}/').data['state'], 'running')
+
+
+class CatalogueUploadTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(clear_name_caches)
+        self.owner, self.client = create_user('shop@example.com', UserType.seller)
+
+    def upload(self, content: bytes, name: str = 'shop1.yaml', **data):
+        file = BytesIO(content)
+        file.name = name
+        return self.client.post('/partner/products/upload/', {'file': file, **data}, format='multipart')
+
+    def test_dry_run(self):
+        catalogue = yaml.safe_load(CATALOGUE)
+        catalogue['goods'][1]['price'] = 'free'
+        catalogue['goods'][2].pop('name')
+        catalogue['goods'][3]['name'] = ''
+        content = yaml.safe_dump(catalogue, allow_unicode=True).encode()
+
+        response = self.upload(content, dry_run='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'error_count': 3,
+            'errors': [{'row': 1, 'external_id': 4216313, 'field': 'price', 'error': 'A valid integer is required.'},
+                       {'row': 2, 'external_id': 4216226, 'field': 'name', 'error': 'this field is required'},
+                       {'row': 3, 'external_id': 4672670, 'field': 'product.name',
+                        'error': 'This field may not be blank.'}],
+            'summary': {'created': 1, 'updated': 0, 'unchanged': 0, 'zeroed': 0}})
+        self.assertFalse(Shop.objects.exists())
+        self.assertFalse(ProductInfo.objects.exists())
+
+        self.assertEqual(self.upload(CATALOGUE).status_code, 201)
+        shop = Shop.objects.get(owner=self.owner)
+        rows = get_catalogue_rows(shop)
+        catalogue['goods'][0]['quantity'] = 1
+        del catalogue['goods'][3]
+        response = self.upload(yaml.safe_dump(catalogue, allow_unicode=True).encode(), dry_run='1')
+        self.assertEqual((response.data['error_count'], response.data['summary']),
+                         (2, {'created': 0, 'updated': 1, 'unchanged': 0, 'zeroed': 1}))
+        self.assertEqual(get_catalogue_rows(shop), rows)
+
+    def test_formats(self):
+        variants = get_catalogue_variants()
+        self.assertEqual(self.upload(CATALOGUE).status_code, 201)
+        shop = Shop.objects.get(owner=self.owner)
+        rows = get_catalogue_rows(shop)
+
+        for name, content, data in (('shop1.jsonl', variants['jsonl'], {}),
+                                    ('shop1.csv', variants['csv'], {'shop': 'Связной'}),
+                                    ('shop1.csv', variants['csv rows'], {'shop': 'Связной',
+                                                                         'parameters': BytesIO(
+                                                                             variants['csv parameters'])})):
+            with self.subTest(name=name, data=list(data)):
+                Shop.objects.filter(owner=self.owner).delete()
+                response = self.upload(content, name, **data)
+                self.assertEqual(response.status_code, 201, response.data)
+                shop = Shop.objects.get(owner=self.owner)
+                self.assertEqual(shop.name, 'Связной')
+                self.assertEqual(get_catalogue_rows(shop), rows)
+
+    def test_format_detection(self):
+        for name, content_type, catalogue_format in (('shop1.csv', 'text/csv', 'csv'),
+                                                     ('shop1.yaml', 'text/csv', 'csv'),
+                                                     ('shop1.txt', 'application/x-ndjson', 'jsonl'),
+                                                     ('shop1.JSONL', 'application/octet-stream', 'jsonl'),
+                                                     ('shop1.ndjson', None, 'jsonl'),
+                                                     ('shop1.yml', None, 'yaml'),
+                                                     ('shop1', None, 'yaml')):
+            with self.subTest(name=name, content_type=content_type):
+                self.assertEqual(get_catalogue_format(SimpleUploadedFile(name, b'', content_type)), catalogue_format)
+
+        file = BytesIO(get_catalogue_variants()['jsonl'])
+        file.name, file.content_type = 'shop1.txt', 'application/x-ndjson'
+        self.assertEqual(self.client.post('/partner/products/upload/', {'file': file}, format='multipart').status_code,
+                         201)
+        self.assertEqual(ProductInfo.objects.filter(shop__owner=self.owner).count(), 4)
+
+    def test_malformed_rows(self):
+        columns = b'id,category,category_name,name,price,price_rrc,quantity,parameters\n'
+        response = self.upload(columns + b'1,1,Phones,Good 1,free,2,3,{}\n'
+                                         b'2,1,Phones,Good 2,1,2,3,"{""Color"": ""red""}"\n'
+                                         b'x,1,Phones,Good 3,1,2,3,{}\n',
+                               'shop1.csv', shop='Shop', dry_run='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'error_count': 2,
+            'errors': [{'row': 0, 'external_id': 1, 'field': 'price', 'error': 'A valid integer is required.'},
+                       {'row': 2, 'external_id': 'x', 'field': 'external_id', 'error': 'A valid integer is required.'}],
+            'summary': {'created': 1, 'updated': 0, 'unchanged': 0, 'zeroed': 0}})
+
+        for name, content in (('shop1.csv', columns + b'1,1,Phones,Good 1,1,2,3,{"Color\n'),
+                              # neither the parameters column nor the parameters file
+                              ('shop1.csv', get_catalogue_variants()['csv rows']),
+                              ('shop1.jsonl', get_catalogue_variants()['jsonl'][:-10]),
+                              ('shop1.jsonl', b'[]\n')):
+            with self.subTest(name=name, content=content[-10:]):
+                self.assertEqual(self.upload(content, name, shop='Shop').status_code, 400)
+        self.assertFalse(ProductInfo.objects.exists())
+
+    def test_export_round_trip(self):
+        self.assertEqual(self.upload(CATALOGUE).status_code, 201)
+        Shop.objects.filter(owner=self.owner).update(email='sales@example.com', base_shipping_price=500)
+        rows = get_catalogue_rows(Shop.objects.get(owner=self.owner))
+
+        for catalogue_format in ('yaml', 'jsonl', 'csv'):
+            with self.subTest(catalogue_format=catalogue_format):
+                response = self.client.get('/partner/products/export/', {'catalogue_format': catalogue_format})
+                self.assertEqual(response.status_code, 200)
+                content = b''.join(response.streaming_content)
+                name = f'catalogue.{catalogue_format}'
+                # csv has no header, the shop fields are sent with the file
+                data = {'shop': 'Связной', 'email': 'sales@example.com', 'shipping_price': 500} \
+                    if catalogue_format == 'csv' else {}
+
+                response = self.upload(content, name, dry_run='1', **data)
+                self.assertEqual(response.data['summary'], {'created': 0, 'updated': 0, 'unchanged': 4, 'zeroed': 0})
+
+                Shop.objects.filter(owner=self.owner).delete()
+                self.assertEqual(self.upload(content, name, **data).status_code, 201)
+                shop = Shop.objects.get(owner=self.owner)
+                self.assertEqual((shop.name, shop.email, shop.base_shipping_price),
+                                 ('Связной', 'sales@example.com', 500))
+                self.assertEqual(get_catalogue_rows(shop), rows)
+
+
+class NameCacheTests(TestCase):
+
+    def test_deleted_rows_are_noticed_in_chunks(self):
+        name_cache = NameCache(Parameter, 'name', max_size=100, check_interval=0)
+        name_cache.check_batch_size = 3
+        # ids get into the cache on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            name_cache.resolve(['first'])
+        with self.captureOnCommitCallbacks(execute=True):
+            created = name_cache.resolve([f'name {index}' for index in range(8)])
+
+        # one aggregate query and one query per further chunk of the 8 ids added since the last check
+        with self.assertNumQueries(3):
+            self.assertEqual(name_cache.resolve(['name 7']), {'name 7': created['name 7']})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            created = name_cache.resolve([f'other {index}' for index in range(8)])
+        Parameter.objects.filter(id=created['other 7']).delete()
+        resolved = name_cache.resolve(['other 7'])
+        self.assertNotEqual(resolved['other 7'], created['other 7'])
+        self.assertTrue(Parameter.objects.filter(id=resolved['other 7']).exists())
+
+
+class ProductQueryBudgetTests(ApiTestCase):
+    """
+    The product list and detail are read by a constant number of queries whatever the page size
+    and the number of parameters
+    """
+    # (list, list with the cursor pagination, detail) with the fast and the model serializers,
+    # one query of each reads the catalogue version
+    budgets = {True: (5, 4, 4), False: (4, 3, 3)}
+
+    def setUp(self):
+        super().setUp()
+        self.seller, _ = create_user('seller@example.com', UserType.seller)
+        self.client = APIClient()
+        # the version is created by the first change of the catalogue, not by the first request
+        get_catalogue_version()
+
+    def get_query_counts(self, product_id) -> tuple:
+        counts = []
+        for url in ('/products/?page_size=20', '/products/?pagination=cursor&page_size=20', f'/products/{product_id}/'):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            counts.append(len(queries))
+        return tuple(counts)
+
+    def test_query_budget(self):
+        for fast in (True, False):
+            with self.subTest(fast_serializers=fast), override_settings(FAST_SERIALIZERS=fast):
+                import_goods(self.seller, range(1, 3), parameters=1)
+                product_id = ProductInfo.objects.earliest('id').id
+                self.assertEqual(self.get_query_counts(product_id), self.budgets[fast])
+
+                import_goods(self.seller, range(1, 41), parameters=6)
+                self.assertEqual(self.get_query_counts(product_id), self.budgets[fast])
+                self.assertEqual(len(self.client.get('/products/?page_size=20').data['results']), 20)
+
+
+class ProductSearchTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, range(1, 13))
+
+    def test_search_by_names(self):
+        response = self.client.get('/products/?search=good 11,good 12&page_size=20')
+        # postgres finds similar names as well
+        self.assertLessEqual({'Good 11', 'Good 12'},
+                             {product['product']['name'] for product in response.data['results']})
+
+    @skipIf(connection.vendor == 'postgresql', 'the fallback of other databases')
+    def test_fallback_searches_product_names(self):
+        self.assertEqual(self.client.get('/products/?search=Phones').data['count'], 0)
+        self.assertEqual(self.client.get('/products/?search=good 1').data['count'], 4)
+
+
+class OrderCursorPaginationTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.buyer, self.client = create_user('buyer@example.com')
+        now = timezone.now()
+        created = [now - timedelta(days=1), None, now, None, now - timedelta(days=1), now + timedelta(days=1), None]
+        self.orders = [BuyerOrder.objects.create(user=self.buyer, state=BuyerOrderState.accepted, created_at=created_at)
+                       for created_at in created]
+
+    def read_pages(self, url: str, link: str) -> list:
+        """
+        [(url, ids of the orders)] of the pages from `url` by the `link` (next or previous)
+        """
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append((url, [order['id'] for order in response.data['results']]))
+            url = response.data[link]
+        return pages
+
+    def test_orders_without_created_at_are_paginated(self):
+        expected = [order.id for order in sorted(self.orders, key=lambda order: (order.created_at is None,
+                                                                                 order.created_at, order.id))]
+        pages = self.read_pages('/order/?pagination=cursor&page_size=2', 'next')
+        self.assertEqual([order_id for url, ids in pages for order_id in ids], expected)
+
+        backwards = self.read_pages(pages[-1][0], 'previous')
+        self.assertEqual([ids for url, ids in reversed(backwards)], [ids for url, ids in pages])
+
+    def test_invalid_cursor(self):
+        for position in (['yesterday', 1], [None, 'one'], [None], 'position'):
+            cursor = urlsafe_b64encode(json.dumps({'p': position, 'r': False}).encode()).decode()
+            response = self.client.get('/order/', {'pagination': 'cursor', 'cursor': cursor})
+            self.assertEqual(response.status_code, 404, position)
+
+
+class OrderConditionalGetTests(ApiTestCase):
+
+    def test_etag_is_not_shared_by_users(self):
+        _, client = create_user('buyer@example.com')
+        _, other_client = create_user('other@example.com')
+
+        etag = client.get('/order/')['ETag']
+        self.assertEqual(client.get('/order/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = other_client.get('/order/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class CatalogueVersionTests(ApiTestCase):
+
+    def test_version_is_shared_by_processes(self):
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, [1])
+        client = APIClient()
+        response = client.get('/products/')
+        self.assertEqual(response.data['results'][0]['price'], 101)
+        etag = response['ETag']
+        shops_etag = client.get('/shops/')['ETag']
+
+        # the import worker has its own local memory cache
+        with patch('users.caching.cache', LocMemCache('worker', {})), \
+                self.captureOnCommitCallbacks(execute=True):
+            import_goods(seller, [1], price=200)
+
+        response = client.get('/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['price'], 201)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotEqual(client.get('/shops/')['ETag'], shops_etag)
+
+    def test_bump(self):
+        version = get_catalogue_version()
+        # the version of a shop is created by its first change
+        _bump_catalogue_version([1, 1])
+        shop_version = get_catalogue_version(1)
+        _bump_catalogue_version([1])
+        self.assertEqual((get_catalogue_version(), get_catalogue_version(1)), (version + 2, shop_version + 1))
+
+
+class FastSerializerTests(ApiTestCase):
+
+    def test_output_is_identical(self):
+        buyer = BenchSerializersCommand.generate(30)
+        product_infos = ProductInfo.objects.all()
+        cases = ((FastProductInfoSerializer, product_infos.with_details(), product_infos),
+                 (FastBasketSerializer, buyer.orders.filter(state=BuyerOrderState.basket), None),
+                 (FastBuyerOrderSerializer, buyer.orders.exclude(state=BuyerOrderState.basket), None))
+        for fast_serializer_class, queryset, fast_queryset in cases:
+            with self.subTest(fast_serializer_class.__name__):
+                instances = list(queryset)
+                fast_instances = list(fast_queryset if fast_queryset is not None else queryset)
+                self.assertTrue(instances)
+                expected = JSONRenderer().render(fast_serializer_class.serializer_class(instances, many=True).data)
+                self.assertEqual(JSONRenderer().render(fast_serializer_class(fast_instances, many=True).data), expected)
+                self.assertEqual(JSONRenderer().render(fast_serializer_class(fast_instances[0]).data),
+                                 JSONRenderer().render(fast_serializer_class.serializer_class(instances[0]).data))
+
+    def test_responses_are_identical(self):
+        buyer = BenchSerializersCommand.generate(12)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {buyer.create_auth_token()}')
+        order_id = buyer.orders.exclude(state=BuyerOrderState.basket).earliest('id').id
+        for url in ('/products/?page_size=20', f'/products/{ProductInfo.objects.earliest("id").id}/',
+                    '/basket/', '/order/?page_size=20', f'/order/{order_id}/'):
+            contents = []
+            for fast in (False, True):
+                cache.clear()
+                with override_settings(FAST_SERIALIZERS=fast):
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200, url)
+                contents.append(response.content)
+            self.assertEqual(contents[0], contents[1], url)
+
+    def test_order_list_query_count(self):
+        buyer = BenchSerializersCommand.generate(40)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {buyer.create_auth_token()}')
+        get_catalogue_version()
+        for fast in (False, True):
+            query_counts = []
+            for page_size in (2, 20):
+                cache.clear()
+                with override_settings(FAST_SERIALIZERS=fast), CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(len(client.get('/order/', {'page_size': page_size}).data['results']), page_size)
+                query_counts.append(len(queries))
+            self.assertEqual(query_counts[0], query_counts[1], f'fast serializers: {fast}')
+
+
+@override_settings(PRODUCT_CARDS=True)
+class ProductCardTests(ApiTestCase):
+
+    def assert_cards(self):
+        """
+        The payloads of the cards and the product list are the same as the output of the live serializer,
+        with the same order of keys
+        """
+        live = {product_info.id: json.dumps(ProductInfoSerializer(product_info).data)
+                for product_info in ProductInfo.objects.with_details()}
+        self.assertEqual({product_info_id: json.dumps(json.loads(payload))
+                          for product_info_id, payload in ProductCard.objects.values_list('product_info', 'payload')},
+                         live)
+        results = APIClient().get('/products/', {'page_size': 20}).data['results']
+        self.assertEqual({result['id']: json.dumps(result) for result in results},
+                         {product_info_id: payload for product_info_id, payload in live.items()
+                          if json.loads(payload)['quantity']})
+
+    def test_cards_follow_changes(self):
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        with self.captureOnCommitCallbacks(execute=True):
+            import_goods(seller, range(1, 4), quantity=2)
+        self.assert_cards()
+
+        buyer, client = create_user('buyer@example.com')
+        ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        contact_id = prepare_checkout(buyer, client, {ids[0]: 1, ids[1]: 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(client.post('/order/', {'contact': contact_id}, format='json').status_code, 201)
+        self.assertEqual(list(ProductCard.objects.order_by('product_info').values_list('quantity', flat=True)),
+                         [1, 0, 2])
+        self.assert_cards()
+
+
+class JsonRendererTests(ApiTestCase):
+
+    def get_contents(self, renderer_class, client: APIClient, urls) -> list:
+        with patch('rest_framework.views.APIView.renderer_classes', [renderer_class]):
+            return [b''.join(response.streaming_content) if response.streaming else response.content
+                    for response in map(client.get, urls)]
+
+    def test_fast_renderer_output_is_identical(self):
+        seller, seller_client = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, range(1, 13), parameters=2)
+        for client, urls in ((APIClient(), ('/products/?page_size=20', '/shops/', '/categories/')),
+                             (seller_client, ('/partner/products/?page_size=20', '/partner/products/?stream=true'))):
+            contents = self.get_contents(JSONRenderer, client, urls)
+            self.assertEqual(self.get_contents(FastJSONRenderer, client, urls), contents)
+        self.assertEqual(len(json.loads(contents[-1])), 12)
+
+    @skipIf(orjson is None, 'orjson is not installed')
+    def test_floats(self):
+        # the documented differences of orjson
+        data = {'small': 1e-05, 'large': 1e16, 'nan': float('nan')}
+        self.assertEqual(FastJSONRenderer().render(data), b'{"small":0.00001,"large":1e16,"nan":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+
+
+class ProductFacetsTests(ApiTestCase):
+
+    @override_settings(FACET_VALUES_LIMIT=2, FACET_PRICE_BUCKETS=[105, 110])
+    def test_facets(self):
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        # values: 'value 1' and 'value 2' of 4 goods, 'value 0' of 3 goods
+        import_goods(seller, range(1, 12), parameters=2)
+
+        facets = self.client.get('/products/facets/').data
+        self.assertEqual(facets['count'], 11)
+        self.assertEqual(facets['prices'], [{'min': 0, 'max': 105, 'count': 4}, {'min': 105, 'max': 110, 'count': 5},
+                                            {'min': 110, 'max': None, 'count': 2}])
+        self.assertEqual(facets['parameters'],
+                         [{'parameter': f'Parameter {index}',
+                           'values': [{'value': 'value 1', 'count': 4}, {'value': 'value 2', 'count': 4}]}
+                          for index in range(2)])
+
+
+class ParameterRangeTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        goods = [{'id': good_id, 'category': 1, 'name': f'Good {good_id}', 'price': 100, 'price_rrc': 200,
+                  'quantity': 1, 'parameters': {'Memory': memory, 'Color': 'red'}}
+                 for good_id, memory in ((1, 64), (2, '128'), (3, '6,5'), (4, '1_000'), (5, 'nan'))]
+        import_catalogue(seller, BytesIO(yaml.safe_dump({'shop': 'Shop', 'categories': [{'id': 1, 'name': 'Phones'}],
+                                                         'goods': goods}).encode()), workers=0)
+
+    def get_ids(self, parameter_range: str) -> list:
+        response = self.client.get('/products/', {'parameter_range': parameter_range, 'page_size': 20})
+        self.assertEqual(response.status_code, 200, response.data)
+        return sorted(ProductInfo.objects.get(id=product['id']).external_id for product in response.data['results'])
+
+    def test_numeric_values(self):
+        self.assertEqual(dict(ProductParameter.objects.filter(parameter__name='Memory')
+                              .values_list('product_info__external_id', 'numeric_value')),
+                         {1: 64, 2: 128, 3: 6.5, 4: None, 5: None})
+
+    def test_ranges(self):
+        for parameter_range, ids in (('Memory:100:', [2]),
+                                     ('Memory::100', [1, 3]),
+                                     ('Memory:10:100', [1]),
+                                     ('Memory:6.5:64', [1, 3]),
+                                     ('Memory::', [1, 2, 3]),
+                                     ('Memory:1:,Memory::100', [1, 3]),
+                                     ('Color::', []),
+                                     ('Size:1:', [])):
+            with self.subTest(parameter_range=parameter_range):
+                self.assertEqual(self.get_ids(parameter_range), ids)
+
+    def test_invalid_ranges(self):
+        for parameter_range in ('Memory:1_000:', 'Memory::many', 'Memory:nan:', 'Memory:1'):
+            with self.subTest(parameter_range=parameter_range):
+                response = self.client.get('/products/', {'parameter_range': parameter_range})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('parameter_range', response.data)
+
+
+class BasketTests(ApiTestCase):
+    """
+    Adding and removing items takes a fixed number of queries, the response is the basket as GET shows it
+    """
+
+    def setUp(self):
+        super().setUp()
+        for index, shop in enumerate(('Shop', 'Other')):
+            seller, _ = create_user(f'seller{index}@example.com', UserType.seller)
+            import_goods(seller, range(1, 31), shop=shop)
+        self.ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        self.buyer, self.client = create_user('buyer@example.com')
+
+    def add(self, ids, quantity: int = 2):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/basket/', [{'product_info': product_info_id, 'quantity': quantity}
+                                                     for product_info_id in ids], format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data, self.client.get('/basket/').data[0])
+        return len(queries)
+
+    def test_add(self):
+        for fast in (False, True):
+            with self.subTest(fast_serializers=fast), override_settings(FAST_SERIALIZERS=fast):
+                BuyerOrder.objects.filter(user=self.buyer).delete()
+                self.add(self.ids[:1])
+                # items of both shops, new and changed ones
+                query_count = self.add([self.ids[0], self.ids[-1]])
+                self.assertEqual(self.add(self.ids[:20] + self.ids[-20:], quantity=3), query_count)
+                self.assertEqual(self.add(self.ids[5:8], quantity=1), query_count)
+
+                basket = self.client.get('/basket/').data[0]
+                self.assertEqual(sorted((item['product_info']['id'], item['quantity'])
+                                        for seller_order in basket['seller_orders']
+                                        for item in seller_order['ordered_items']),
+                                 sorted([(product_info_id, 3) for product_info_id in self.ids[:20] + self.ids[-20:]
+                                         if product_info_id not in self.ids[5:8]]
+                                        + [(product_info_id, 1) for product_info_id in self.ids[5:8]]))
+
+    def remove(self, ids) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.delete('/basket/', ids, format='json')
+        self.assertEqual(response.status_code, 204, response.data)
+        baskets = self.client.get('/basket/').data
+        self.assertEqual(response.data, baskets[0] if baskets else [])
+        return len(queries)
+
+    def test_remove(self):
+        for fast in (False, True):
+            with self.subTest(fast_serializers=fast), override_settings(FAST_SERIALIZERS=fast):
+                BuyerOrder.objects.filter(user=self.buyer).delete()
+                self.add(self.ids[:20] + self.ids[-20:])
+
+                query_count = self.remove(self.ids[:1])
+                # the seller order of the first shop becomes empty
+                self.assertEqual(self.remove(self.ids[1:20] + self.ids[-5:]), query_count)
+                self.assertEqual(SellerOrder.objects.filter(buyer_order__user=self.buyer).count(), 1)
+                self.assertEqual(self.client.delete('/basket/', [self.ids[0]], format='json').status_code, 400)
+
+                self.remove(self.ids[-20:-5])
+                self.assertFalse(BuyerOrder.objects.filter(user=self.buyer).exists())
+
+
+def prepare_checkout(buyer: User, client: APIClient, items: dict) -> int:
+    """
+    Puts {product_info_id: quantity} into the basket of the buyer, returns the id of the buyer's contact
+    """
+    response = client.post('/basket/', [{'product_info': product_info_id, 'quantity': quantity}
+                                        for product_info_id, quantity in items.items()], format='json')
+    assert response.status_code == 201, response.data
+    return Contact.objects.create(user=buyer, city='City', street='Street', phone='+79001234567').id
+
+
+class StockReservationTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, range(1, 4), quantity=5)
+        self.ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+
+    def get_quantities(self) -> list:
+        return list(ProductInfo.objects.order_by('id').values_list('quantity', flat=True))
+
+    def test_reserve_stock(self):
+        with transaction.atomic():
+            reserve_stock({self.ids[0]: 5, self.ids[2]: 1})
+        self.assertEqual(self.get_quantities(), [0, 5, 4])
+
+    def test_reserve_stock_shortage(self):
+        with self.assertRaises(StockShortage) as shortage, transaction.atomic():
+            reserve_stock({self.ids[0]: 1, self.ids[1]: 6, self.ids[2]: 9})
+        self.assertEqual(shortage.exception.short, {self.ids[1]: 5, self.ids[2]: 5})
+        self.assertEqual(self.get_quantities(), [5, 5, 5])
+
+    def test_checkout_shortage(self):
+        buyer, client = create_user('buyer@example.com')
+        contact_id = prepare_checkout(buyer, client, {self.ids[0]: 2, self.ids[1]: 3})
+        ProductInfo.objects.filter(id=self.ids[1]).update(quantity=1)
+
+        response = client.post('/order/', {'contact': contact_id}, format='json')
+        self.assertEqual(response.status_code, 206)
+        statuses = {item['product_info']['id']: item.get('status') for seller_order in response.data['seller_orders']
+                    for item in seller_order['ordered_items']}
+        self.assertEqual(statuses, {self.ids[0]: None,
+                                    self.ids[1]: 'too many ordered. You ordered 3, but only 1 in stock'})
+        self.assertEqual(self.get_quantities(), [5, 1, 5])
+        self.assertTrue(BuyerOrder.objects.filter(user=buyer, state=BuyerOrderState.basket).exists())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'row locks of concurrent checkouts need postgres')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Parallel checkouts of the same product from threads, each on its own database connection
+    """
+    buyers = 12
+    stock = 5
+
+    def setUp(self):
+        cache.clear()
+        throttles = patch('rest_framework.views.APIView.throttle_classes', [])
+        throttles.start()
+        self.addCleanup(throttles.stop)
+
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, [1], quantity=self.stock)
+        self.product_info = ProductInfo.objects.get()
+
+    def test_no_oversell(self):
+        checkouts = []
+        for index in range(self.buyers):
+            buyer, client = create_user(f'buyer{index}@example.com')
+            checkouts.append((client, prepare_checkout(buyer, client, {self.product_info.id: 1})))
+
+        barrier = Barrier(self.buyers)
+        responses = [None] * self.buyers
+
+        def checkout(index, client, contact_id):
+            try:
+                barrier.wait()
+                responses[index] = client.post('/order/', {'contact': contact_id}, format='json')
+            finally:
+                connection.close()
+
+        threads = [Thread(target=checkout, args=(index, *arguments)) for index, arguments in enumerate(checkouts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        statuses = [response.status_code for response in responses]
+        sold = SellerOrderItem.objects.filter(product_info=self.product_info,
+                                              order__buyer_order__state=BuyerOrderState.accepted) \
+            .aggregate(sold=Sum('quantity'))['sold'] or 0
+        left = ProductInfo.objects.get(id=self.product_info.id).quantity
+
+        self.assertEqual(statuses.count(201), self.stock)
+        self.assertEqual(statuses.count(206), self.buyers - self.stock)
+        self.assertEqual((sold, left), (self.stock, 0))
+        for response in responses:
+            if response.status_code == 206:
+                item = response.data['seller_orders'][0]['ordered_items'][0]
+                self.assertEqual(item['status'], 'too many ordered. You ordered 1, but only 0 in stock')
+
+
+@override_settings(STOCK_HOLDS=True)
+class StockHoldTests(ApiTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seller, _ = create_user('seller@example.com', UserType.seller)
+        import_goods(seller, range(1, 3), quantity=5)
+        self.ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        self.buyer, self.client = create_user('buyer@example.com')
+        self.other_buyer, self.other_client = create_user('other@example.com')
+
+    def add(self, client, items: dict):
+        return client.post('/basket/', [{'product_info': product_info_id, 'quantity': quantity}
+                                        for product_info_id, quantity in items.items()], format='json')
+
+    def get_quantities(self) -> dict:
+        return {product['id']: product['quantity'] for product in self.client.get('/products/').data['results']}
+
+    def test_short_hold(self):
+        self.assertEqual(self.add(self.client, {self.ids[0]: 4}).status_code, 201)
+
+        response = self.add(self.other_client, {self.ids[0]: 2, self.ids[1]: 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'error': 'not enough in stock', 'available': {self.ids[0]: 1}})
+        self.assertFalse(SellerOrderItem.objects.filter(order__buyer_order__user=self.other_buyer).exists())
+        self.assertFalse(StockHold.objects.filter(buyer_order__user=self.other_buyer).exists())
+
+        # the own hold is renewed with the new quantity
+        self.assertEqual(self.add(self.client, {self.ids[0]: 5}).status_code, 201)
+        self.assertEqual(StockHold.objects.get(buyer_order__user=self.buyer).quantity, 5)
+
+    def test_products_show_quantities_less_holds(self):
+        self.assertEqual(self.get_quantities(), {self.ids[0]: 5, self.ids[1]: 5})
+        self.add(self.client, {self.ids[0]: 2, self.ids[1]: 5})
+        self.assertEqual(self.get_quantities(), {self.ids[0]: 3})
+        self.client.delete('/basket/', [self.ids[1]], format='json')
+        self.assertEqual(self.get_quantities(), {self.ids[0]: 3, self.ids[1]: 5})
+
+        StockHold.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.get_quantities(), {self.ids[0]: 5, self.ids[1]: 5})
+        self.assertEqual(release_expired_holds(batch_size=1), 1)
+        self.assertFalse(StockHold.objects.exists())
+
+
+class StoredTotalsTests(ApiTestCase):
+    """
+    Stored totals of seller and buyer orders follow the items, the shipping price and cancellation
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.sellers = []
+        for index, shop in enumerate(('Shop', 'Other')):
+            seller, client = create_user(f'seller{index}@example.com', UserType.seller)
+            import_goods(seller, range(1, 4), shop=shop)
+            self.sellers.append(client)
+        self.ids = list(ProductInfo.objects.order_by('id').values_list('id', flat=True))
+        self.buyer, self.client = create_user('buyer@example.com')
+
+    def assert_totals(self, buyer_order: BuyerOrder):
+        """
+        Compares the stored totals with the ones summed from the items
+        """
+        buyer_order.refresh_from_db()
+        items_total = total = 0
+        for seller_order in buyer_order.seller_orders.all():
+            seller_items_total = sum(item.quantity * item.purchase_price for item in seller_order.ordered_items.all())
+            self.assertEqual((seller_order.items_total, seller_order.total),
+                             (seller_items_total, seller_items_total + seller_order.shipping_price))
+            if seller_order.state != SellerOrderState.canceled:
+                items_total += seller_order.items_total
+                total += seller_order.total
+        self.assertEqual((buyer_order.items_total, buyer_order.total), (items_total, total))
+
+    def add(self, items: dict):
+        response = self.client.post('/basket/', [{'product_info': product_info_id, 'quantity': quantity}
+                                                 for product_info_id, quantity in items.items()], format='json')
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def test_totals(self):
+        # prices are 101, 102, 103 in both shops, the shipping price is 300
+        response = self.add({self.ids[0]: 2, self.ids[3]: 1})
+        basket = BuyerOrder.objects.get(user=self.buyer)
+        self.assert_totals(basket)
+        self.assertEqual(response.data['total_sum'], 2 * 101 + 300 + 101 + 300)
+        self.assertEqual(basket.total, response.data['total_sum'])
+
+        self.add({self.ids[0]: 3, self.ids[1]: 1, self.ids[4]: 2})
+        self.assert_totals(basket)
+        self.client.delete('/basket/', [self.ids[1], self.ids[3]], format='json')
+        self.assert_totals(basket)
+
+        contact_id = Contact.objects.create(user=self.buyer, city='City', street='Street', phone='+79001234567').id
+        self.assertEqual(self.client.post('/order/', {'contact': contact_id}, format='json').status_code, 201)
+        self.assert_totals(basket)
+
+        seller_orders = {seller_order.shop.name: seller_order for seller_order in basket.seller_orders.all()}
+        response = self.sellers[0].patch(f'/partner/orders/{seller_orders["Shop"].id}/', {'shipping_price': 500},
+                                         format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['summary'], 3 * 101 + 500)
+        self.assert_totals(basket)
+
+        response = self.client.delete(f'/order/seller_order/{seller_orders["Other"].id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals(basket)
+        self.assertEqual(basket.total, 3 * 101 + 500)
+
+    def test_refresh_order_totals(self):
+        self.add({self.ids[0]: 2, self.ids[3]: 1})
+        call_command('refresh_order_totals', '--verify', stdout=StringIO())
+
+        SellerOrder.objects.update(items_total=0, total=0)
+        BuyerOrder.objects.update(total=1)
+        with self.assertRaises(CommandError):
+            call_command('refresh_order_totals', '--verify', stdout=StringIO())
+        self.assertEqual(BuyerOrder.objects.get().total, 1)
+
+        call_command('refresh_order_totals', '--batch-size', '1', stdout=StringIO())
+        call_command('refresh_order_totals', '--verify', stdout=StringIO())
+        self.assert_totals(BuyerOrder.objects.get())
@@ -1,30 +1,46 @@
+from functools import partial
 from django.contrib.auth import authenticate
-from django.db import IntegrityError
-from django.db.models import Prefetch
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, Count, Max, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django_rest_passwordreset.views import ResetPasswordConfirm
 from rest_framework import mixins, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from .filters import ProductFilter, PartnerProductFilter, SellerOrderFilter
+from .pagination import ProductPagination, OrderPagination
+from .streaming import StreamingListMixin
+from .facets import get_facets
+from .stock import StockShortage, reserve_stock, get_stock_shortages, hold_stock, release_stock_holds
+from .product_cards import ProductCardListMixin, refresh_product_cards, refresh_shop_product_cards
+from .fast_serializers import FastReadSerializerMixin, FastProductInfoSerializer, FastBasketSerializer, \
+    FastBuyerOrderSerializer
+from .caching import CatalogueCacheMixin, CatalogueConditionalGetMixin, ConditionalGetMixin, \
+    bump_catalogue_version, get_catalogue_version
 from .permissions import IsPartner, IsShopOwnerOrReadOnly
 from .serializers import UserSerializer, ShopSerializer, ProductInfoSerializer, PartnerProductInfoSerializer, \
     CategorySerializer, ContactSerializer, OrderItemBuyerSerializer, BuyerOrderSerializer, \
     PartnerOrderSerializer, PartnerStateSerializer, AuthenticateSerializer, PositiveIntegers, \
-    CustomPasswordTokenSerializer, SellerOrderForBuyerOrderSerializer
+    CustomPasswordTokenSerializer, SellerOrderForBuyerOrderSerializer, CatalogueImportJobSerializer
 from .models import User, ConfirmRegistrationToken, Shop, Category, ProductInfo, \
-    BuyerOrder, SellerOrder, SellerOrderItem
+    BuyerOrder, SellerOrder, SellerOrderItem, CatalogueImportJob
 from rest_framework.viewsets import GenericViewSet, ModelViewSet, ReadOnlyModelViewSet
 from .email_sender import send_confirmation_email
-import yaml
+from .catalogue import CatalogueImportError, import_catalogue
+from .catalogue_formats import get_catalogue_format
+from .catalogue_export import CATALOGUE_EXPORTERS, CATALOGUE_CONTENT_TYPES, export_catalogue
 from .app_choices import SellerOrderState, BuyerOrderState, PartnerState, UserConfirmation
 from .filters import BuyerOrderFilter
 from django.utils import timezone
 from .serializers import BasketSerializer
 
 
+TRUE_VALUES = {True, 'true', 'True', '1'}
+
+
 class UserFromRequestMixin:
     @property
     def user(self):
@@ -99,13 +115,16 @@ class ConfirmEmailView(APIView):
         return Response({'token': token_key}, status=status.HTTP_200_OK)
 
 
-class ShopView(mixins.CreateModelMixin,
+class ShopView(CatalogueConditionalGetMixin,
+               CatalogueCacheMixin,
+               mixins.CreateModelMixin,
                mixins.RetrieveModelMixin,
                mixins.UpdateModelMixin,
                mixins.ListModelMixin,
                GenericViewSet):
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
+    shop_lookup_kwarg = 'pk'
 
     def get_permissions(self):
         """
@@ -116,23 +135,63 @@ class ShopView(mixins.CreateModelMixin,
             permissions.append(IsAuthenticated())
         return permissions
 
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        bump_catalogue_version(serializer.instance.id)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        refresh_shop_product_cards(serializer.instance)
+        bump_catalogue_version(serializer.instance.id)
 
-class CategoryView(ReadOnlyModelViewSet):
+
+class CategoryView(CatalogueConditionalGetMixin, CatalogueCacheMixin, ReadOnlyModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
 
-class ProductView(ReadOnlyModelViewSet):
+class ProductView(CatalogueConditionalGetMixin, CatalogueCacheMixin, ProductCardListMixin, FastReadSerializerMixin,
+                  ReadOnlyModelViewSet):
     serializer_class = ProductInfoSerializer
+    fast_serializer_class = FastProductInfoSerializer
     filterset_class = ProductFilter
+    pagination_class = ProductPagination
 
     def get_queryset(self, *args, **kwargs):
-        return ProductInfo.objects.filter(shop__is_open=True, quantity__gt=0).all()
+        queryset = ProductInfo.objects.filter(shop__is_open=True)
+        if settings.STOCK_HOLDS:
+            queryset = queryset.with_available_quantity().filter(available_quantity__gt=0)
+        else:
+            queryset = queryset.filter(quantity__gt=0)
+        if self.action == 'facets':
+            return queryset
+        # the fast serializer reads the rows by ids itself, the page needs only the cursor fields
+        return queryset.only('id', 'price') if self.use_fast_serializer else queryset.with_details()
+
+    @action(detail=False, methods=['get'], url_path='facets', url_name='facets')
+    def facets(self, request, *args, **kwargs):
+        """
+        Numbers of the filtered products by category, shop, price range and parameter value
+        """
+        return self.get_conditional_response(partial(self.get_cached_response, self.get_facets_response), request)
+
+    def get_facets_response(self, request, *args, **kwargs):
+        return Response(get_facets(self.filter_queryset(self.get_queryset())))
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        # quantities less the stock holds change with every basket, they are neither cached nor versioned
+        if settings.STOCK_HOLDS:
+            return handler(request, *args, **kwargs)
+        return super().get_cached_response(handler, request, *args, **kwargs)
+
+    def get_fingerprint(self):
+        return None if settings.STOCK_HOLDS else super().get_fingerprint()
 
 
-class PartnerProductView(PartnerPaginationMixin, ModelViewSet, UserFromRequestMixin):
+class PartnerProductView(PartnerPaginationMixin, StreamingListMixin, ModelViewSet, UserFromRequestMixin):
     serializer_class = PartnerProductInfoSerializer
     filterset_class = PartnerProductFilter
+    pagination_class = ProductPagination
 
     def get_permissions(self):
         """
@@ -145,86 +204,79 @@ class PartnerProductView(PartnerPaginationMixin, ModelViewSet, UserFromRequestMi
 
     @action(detail=False, methods=['post'], url_path='upload', url_name='upload')
     def create_catalogue(self, request, *args, **kwargs):
-        user = self.user
+        uploaded_file = request.FILES.get('file')
+        parameters_file = request.FILES.get('parameters')
+        dry_run = request.data.get('dry_run') in TRUE_VALUES
+
+        options = {key: request.data[key] for key in ('shop', 'email', 'shipping_price') if key in request.data}
+        if 'shop' not in options and (shop := Shop.objects.filter(owner=self.user).first()):
+            options['shop'] = shop.name
+
+        if settings.CATALOGUE_IMPORT_IN_BACKGROUND or request.data.get('background') in TRUE_VALUES:
+            if uploaded_file is None:
+                return Response({'error': 'unable to load data from the file'}, status=status.HTTP_400_BAD_REQUEST)
+            job = CatalogueImportJob.objects.create(user=self.user,
+                                                    file=uploaded_file,
+                                                    parameters_file=parameters_file,
+                                                    catalogue_format=get_catalogue_format(uploaded_file),
+                                                    options=options,
+                                                    dry_run=dry_run)
+            return Response(CatalogueImportJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
 
         try:
-            uploaded_file = request.FILES['file']
-            yaml_data = uploaded_file.read().decode('utf-8')
-            json_data = yaml.safe_load(yaml_data)
-            shop_name = json_data['shop']
-            categories_source = json_data['categories']
-            categories = {category['id']: {'name': category['name'], 'external_id': category['id']}
-                          for category in categories_source}
-            products = json_data['goods']
-        except:
-            return Response({'error': 'unable to load data from the file'}, status=status.HTTP_400_BAD_REQUEST)
-
-        shop_email = json_data.get('email', user.email)
-        shop_base_shipping_price = int(json_data.get('shipping_price', 300))
-        try:
-            shop, shop_created = \
-                Shop.objects.get_or_create(owner=user, defaults={'name': shop_name,
-                                                                 'email': shop_email,
-                                                                 'base_shipping_price': shop_base_shipping_price})
-        except IntegrityError:
-            return Response({'error': f'{shop_name}: this shop_name is already occupied'},
-                            status=status.HTTP_403_FORBIDDEN)
-
-        validated_product_infos = []
-
-        for product_source in products:
-            __source_info = {'categories': categories_source, 'product': product_source}
-
-            try:
-                category_external_id = product_source['category']
-                category = categories[category_external_id]
-            except KeyError as error:
-                return Response({'category_error': 'parse or matching error', 'key': str(error)} | __source_info,
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            try:
-                product_parameters = [dict(zip(('parameter', 'value'), i))
-                                      for i in product_source['parameters'].items()]
-
-                product_data = {'external_id': product_source['id'],
-                                'category': category,
-                                'product': {'name': product_source['name']},
-                                'product_parameters': product_parameters,
-                                'price': product_source['price'],
-                                'price_rrc': product_source['price_rrc'],
-                                'quantity': product_source['quantity']}
-
-            except KeyError as error:
-                return Response({'product_error': 'parse', 'invalid_field': str(error)} | __source_info,
-                                status=status.HTTP_400_BAD_REQUEST)
-
-            product_info_serializer = self.get_serializer(data=product_data)
-
-            try:
-                product_info_serializer.is_valid(raise_exception=True)
-            except ValidationError as error:
-                return Response({'product': product_source} | error.detail, status=status.HTTP_400_BAD_REQUEST)
-
-            validated_product_infos.append(product_info_serializer.validated_data)
-
-        if shop_created or not shop.product_infos.exists():
-            for product_info in validated_product_infos:
-                self.get_serializer().create(product_info)
-        else:
-            shop.product_infos.exclude(external_id__in={product_info['external_id']
-                                                        for product_info in validated_product_infos}).update(quantity=0)
-
-            for product_info in validated_product_infos:
-                self.get_serializer().update_or_create(product_info)
+            result = import_catalogue(self.user, uploaded_file, dry_run=dry_run,
+                                      options=options, parameters_file=parameters_file)
+        except CatalogueImportError as error:
+            return Response(error.detail, status=error.status_code)
 
+        if dry_run:
+            return Response(result, status=status.HTTP_200_OK)
         return Response({'status': 'ok'}, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['get'], url_path='export', url_name='export')
+    def export_catalogue(self, request, *args, **kwargs):
+        """
+        Streams the whole catalogue of the shop in the format of the upload (?catalogue_format=yaml, jsonl or csv)
+        """
+        catalogue_format = request.query_params.get('catalogue_format', 'yaml')
+        if catalogue_format not in CATALOGUE_EXPORTERS:
+            return Response({'error': f'catalogue_format must be one of: {", ".join(CATALOGUE_EXPORTERS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        response = StreamingHttpResponse(export_catalogue(self.user.shop, catalogue_format, settings.STREAM_CHUNK_SIZE),
+                                         content_type=f'{CATALOGUE_CONTENT_TYPES[catalogue_format]}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="catalogue.{catalogue_format}"'
+        return response
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        refresh_product_cards([serializer.instance.id])
+        bump_catalogue_version(serializer.instance.shop_id)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        refresh_product_cards([serializer.instance.id])
+        bump_catalogue_version(serializer.instance.shop_id)
+
     def perform_destroy(self, instance):
         instance.quantity = 0
         instance.save()
+        refresh_product_cards([instance.id])
+        bump_catalogue_version(instance.shop_id)
 
     def get_queryset(self, *args, **kwargs):
-        return self.user.shop.product_infos.all()
+        return self.user.shop.product_infos.with_details()
+
+
+class PartnerCatalogueImportView(mixins.RetrieveModelMixin,
+                                 mixins.ListModelMixin,
+                                 GenericViewSet,
+                                 UserFromRequestMixin):
+    permission_classes = [IsAuthenticated]
+    serializer_class = CatalogueImportJobSerializer
+
+    def get_queryset(self):
+        return self.user.catalogue_imports.all()
 
 
 class PartnerStateView(APIView, UserFromRequestMixin):
@@ -248,6 +300,8 @@ class PartnerStateView(APIView, UserFromRequestMixin):
 
         self.users_shop.is_open = new_state
         self.users_shop.save()
+        refresh_shop_product_cards(self.users_shop, only_state=True)
+        bump_catalogue_version(self.users_shop.id)
         return Response({'Your shop is open': new_state}, status=status.HTTP_201_CREATED)
 
 
@@ -266,108 +320,150 @@ class ContactView(ModelViewSet, UserFromRequestMixin):
 class BasketView(APIView, UserFromRequestMixin):
     permission_classes = [IsAuthenticated]
 
+    @staticmethod
+    def get_basket_serializer(basket, many: bool = False):
+        if settings.FAST_SERIALIZERS:
+            return FastBasketSerializer(basket, many=many)
+        prefetch_related_objects(basket if many else [basket], *BuyerOrder.objects.get_details_lookups())
+        return BasketSerializer(basket, many=many)
+
     def get(self, request, *args, **kwargs):
         basket = []
         if _basket_object := self.user.basket_object:
             basket.append(_basket_object)
-        return Response(BasketSerializer(basket, many=True).data, status=status.HTTP_200_OK)
+        return Response(self.get_basket_serializer(basket, many=True).data, status=status.HTTP_200_OK)
 
     def post(self, request, *args, **kwargs):
-        basket = self.user.basket_object or BuyerOrder.objects.create(user=self.request.auth.user,
-                                                                      state=BuyerOrderState.basket)
-
-        ordered_items_serializer = OrderItemBuyerSerializer(data=request.data, many=True)
+        """
+        Adds items to the basket or changes their quantity by a fixed number of queries:
+        existing seller orders are read by one query, missing ones are created by one insert
+        and all items are upserted by one insert. With STOCK_HOLDS the stock of the items is held
+        for the basket, nothing is added if any of them is short.
+        """
+        product_info_ids = {item.get('product_info') for item in request.data if isinstance(item, dict)} \
+            if isinstance(request.data, list) else set()
+        preloaded = ProductInfo.objects.select_related('shop') \
+            .in_bulk([product_info_id for product_info_id in product_info_ids
+                      if isinstance(product_info_id, int) and not isinstance(product_info_id, bool)])
+
+        ordered_items_serializer = OrderItemBuyerSerializer(data=request.data, many=True,
+                                                            context={'preloaded': preloaded})
         ordered_items_serializer.is_valid(raise_exception=True)
 
-        validated_ordered_items = {ordered_item_dict['product_info'].id: ordered_item_dict['quantity']
+        validated_ordered_items = {ordered_item_dict['product_info']: ordered_item_dict['quantity']
                                    for ordered_item_dict in ordered_items_serializer.validated_data}
+        # items of closed shops are skipped
+        validated_ordered_items = {product_info: quantity for product_info, quantity in validated_ordered_items.items()
+                                   if product_info.shop.is_open}
+        shops = {product_info.shop_id: product_info.shop for product_info in validated_ordered_items}
 
-        shops_with_ordered_products = \
-            Shop.objects.filter(is_open=True,
-                                product_infos__id__in=validated_ordered_items.keys()) \
-                .prefetch_related(Prefetch('product_infos',
-                                           queryset=ProductInfo.objects.filter(id__in=validated_ordered_items.keys())),
-                                  'product_infos__product')
-
-        for shop in shops_with_ordered_products:
-            order, created = SellerOrder.objects.get_or_create(buyer_order=basket,
-                                                               shop=shop,
-                                                               state=SellerOrderState.basket,
-                                                               defaults={'shipping_price': shop.base_shipping_price})
-            for product_info in shop.product_infos.all():
-                SellerOrderItem.objects.update_or_create(order=order,
-                                                         product_info=product_info,
-                                                         defaults={'quantity': validated_ordered_items[product_info.id],
-                                                                   'purchase_price': product_info.price,
-                                                                   'purchase_price_rrc': product_info.price_rrc})
-
-        return Response(BasketSerializer(basket).data, status=status.HTTP_201_CREATED)
+        try:
+            with transaction.atomic():
+                basket = self.add_to_basket(validated_ordered_items, shops)
+        except StockShortage as error:
+            return Response({'error': 'not enough in stock',
+                             'available': {product_info.id: error.short[product_info.id]
+                                           for product_info in validated_ordered_items
+                                           if product_info.id in error.short}},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(self.get_basket_serializer(basket).data, status=status.HTTP_201_CREATED)
+
+    def add_to_basket(self, validated_ordered_items: dict, shops: dict):
+        basket = self.user.orders.filter(state=BuyerOrderState.basket).first() \
+            or BuyerOrder.objects.create(user=self.request.auth.user, state=BuyerOrderState.basket)
+
+        if settings.STOCK_HOLDS:
+            hold_stock(basket, {product_info.id: quantity
+                                for product_info, quantity in validated_ordered_items.items()})
+
+        seller_orders = {}
+        for seller_order in SellerOrder.objects.filter(buyer_order=basket, state=SellerOrderState.basket,
+                                                       shop_id__in=shops).order_by('-id'):
+            seller_orders[seller_order.shop_id] = seller_order
+        if missing_shops := shops.keys() - seller_orders.keys():
+            created = SellerOrder.objects.bulk_create([SellerOrder(buyer_order=basket,
+                                                                   shop_id=shop_id,
+                                                                   state=SellerOrderState.basket,
+                                                                   shipping_price=shops[shop_id].base_shipping_price)
+                                                       for shop_id in sorted(missing_shops)])
+            seller_orders.update((seller_order.shop_id, seller_order) for seller_order in created)
+
+        SellerOrderItem.objects.bulk_create([SellerOrderItem(order=seller_orders[product_info.shop_id],
+                                                             product_info=product_info,
+                                                             quantity=quantity,
+                                                             purchase_price=product_info.price,
+                                                             purchase_price_rrc=product_info.price_rrc)
+                                             for product_info, quantity in validated_ordered_items.items()],
+                                            update_conflicts=True,
+                                            unique_fields=['order', 'product_info'],
+                                            update_fields=['quantity', 'purchase_price', 'purchase_price_rrc'])
+        SellerOrder.objects.filter(id__in=[seller_order.id for seller_order in seller_orders.values()]).update_totals()
+        basket.refresh_from_db(fields=('items_total', 'total'))
+        return basket
 
     def delete(self, request, *args, **kwargs):
+        """
+        Removes items of the basket by product info ids with set-based deletes: items, then the seller orders
+        which became empty (or the whole basket). The response is the basket read before the deletion
+        without the removed rows.
+        """
         ids_to_del = request.data
 
         PositiveIntegers(data=ids_to_del).is_valid(raise_exception=True)
 
-        basket = self.user.basket_queryset.prefetch_related('seller_orders__shop',
-                                                            'seller_orders__ordered_items',
-                                                            'seller_orders__ordered_items__product_info').first()
+        basket = self.user.orders.filter(state=BuyerOrderState.basket).first()
 
         if not basket:
             return Response({'error': f'Your basket does not exists'}, status=status.HTTP_400_BAD_REQUEST)
 
         ids_to_del = set(ids_to_del)
-        seller_orders_baskets = basket.seller_orders.all()
+        data = self.get_basket_serializer(basket).data
 
-        all_ordered_ids = {ordered_item.product_info.id for seller_order in seller_orders_baskets
-                           for ordered_item in seller_order.ordered_items.all()}
+        all_ordered_ids = {ordered_item['product_info']['id'] for seller_order in data['seller_orders']
+                           for ordered_item in seller_order['ordered_items']}
         unknown_ids = ids_to_del - all_ordered_ids
 
         if unknown_ids:
             unknown_ids = ', '.join(map(str, unknown_ids))
             return Response({'error': f'Unknown ids {unknown_ids}'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if basket.state == BuyerOrderState.basket and ids_to_del == all_ordered_ids:
-            basket.delete()
+        if ids_to_del == all_ordered_ids:
+            with transaction.atomic():
+                release_stock_holds(basket)
+                basket.delete()
             return Response([], status=status.HTTP_204_NO_CONTENT)
 
-        seller_orders_to_del = {}
-        ordered_items_to_del = set()
-
-        for seller_order in seller_orders_baskets:
-            ordered_items = seller_order.ordered_items.all()
-            ordered_items = {ordered_item: ordered_item.product_info.id for ordered_item in ordered_items}
-            ordered_product_ids = set(ordered_items.values())
-            items_to_del_in_current_order = ordered_product_ids & ids_to_del
-            if not items_to_del_in_current_order:
+        seller_orders = []
+        seller_orders_to_del = []
+        for seller_order in data['seller_orders']:
+            ordered_items = [ordered_item for ordered_item in seller_order['ordered_items']
+                             if ordered_item['product_info']['id'] not in ids_to_del]
+            if not ordered_items:
+                seller_orders_to_del.append(seller_order['id'])
                 continue
-
-            if ordered_product_ids == items_to_del_in_current_order:
-                seller_orders_to_del[seller_order.id] = seller_order
-            else:
-                ordered_objects_to_del = (key for key, value in ordered_items.items() \
-                                          if value in items_to_del_in_current_order)
-
-                for ordered_object in ordered_objects_to_del:
-                    ordered_items_to_del.add(ordered_object.id)
-                    seller_order.ordered_items.remove(ordered_object)
-
-            ids_to_del -= items_to_del_in_current_order
-
-            if not ids_to_del:
-                break
-
-        if seller_orders_to_del:
-            basket.seller_orders.filter(id__in=seller_orders_to_del).delete()
-            for seller_object in seller_orders_to_del.values():
-                basket.seller_orders.remove(seller_object)
-
-        if ordered_items_to_del:
-            SellerOrderItem.objects.filter(id__in=ordered_items_to_del).delete()
-
-        return Response(BasketSerializer(basket).data, status=status.HTTP_204_NO_CONTENT)
+            if len(ordered_items) != len(seller_order['ordered_items']):
+                seller_order['ordered_items'] = ordered_items
+                seller_order['summary'] = seller_order['shipping_price'] + \
+                    sum(ordered_item['quantity'] * (ordered_item['product_info']['price'] or 0)
+                        for ordered_item in ordered_items)
+            seller_orders.append(seller_order)
+
+        with transaction.atomic():
+            SellerOrderItem.objects.filter(order__buyer_order=basket, product_info_id__in=ids_to_del).delete()
+            release_stock_holds(basket, ids_to_del)
+            if seller_orders_to_del:
+                SellerOrder.objects.filter(id__in=seller_orders_to_del).delete()
+            BuyerOrder.objects.filter(id=basket.id).update_totals()
+
+        # seller orders of the basket are not canceled, all of them are in the total sum
+        data['seller_orders'] = seller_orders
+        data['total_sum'] = sum(seller_order['summary'] for seller_order in seller_orders)
+        return Response(data, status=status.HTTP_204_NO_CONTENT)
 
 
 class PartnerOrderView(PartnerPaginationMixin,
+                       StreamingListMixin,
                        mixins.RetrieveModelMixin,
                        mixins.UpdateModelMixin,
                        mixins.ListModelMixin,
@@ -376,122 +472,152 @@ class PartnerOrderView(PartnerPaginationMixin,
     permission_classes = [IsAuthenticated, IsPartner]
     serializer_class = PartnerOrderSerializer
     filterset_class = SellerOrderFilter
+    pagination_class = OrderPagination
 
     def get_queryset(self):
-        return self.user.shop.orders.exclude(state=SellerOrderState.basket).all()
+        return self.user.shop.orders.exclude(state=SellerOrderState.basket) \
+            .select_related('contact') \
+            .prefetch_related(Prefetch('ordered_items__product_info', queryset=ProductInfo.objects.with_details()))
 
 
-class OrderViewSet(mixins.CreateModelMixin,
+class OrderViewSet(ConditionalGetMixin,
+                   FastReadSerializerMixin,
+                   mixins.CreateModelMixin,
                    mixins.ListModelMixin,
                    mixins.RetrieveModelMixin,
                    GenericViewSet,
                    UserFromRequestMixin):
     permission_classes = [IsAuthenticated]
     serializer_class = BuyerOrderSerializer
+    fast_serializer_class = FastBuyerOrderSerializer
     filterset_class = BuyerOrderFilter
+    pagination_class = OrderPagination
 
     def get_queryset(self, *args, **kwargs):
-        return self.user.orders.exclude(state=BuyerOrderState.basket).all()
+        queryset = self.user.orders.exclude(state=BuyerOrderState.basket)
+        # the fast serializer reads the rows by ids itself
+        return queryset if self.use_fast_serializer else queryset.with_details()
+
+    def get_fingerprint(self):
+        """
+        Orders of the user change with their seller orders (updated_at), items show the current catalogue.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            if self.action == 'retrieve':
+                queryset = queryset.filter(pk=self.kwargs['pk'])
+            state = queryset.aggregate(order_count=Count('id', distinct=True),
+                                       seller_order_count=Count('seller_orders', distinct=True),
+                                       modified=Max('seller_orders__updated_at'))
+        except (ValueError, TypeError):
+            return None
+
+        modified = state['modified'].timestamp() if state['modified'] else None
+        return f'{self.user.id}:{state["order_count"]}:{state["seller_order_count"]}:{modified}:' \
+               f'{get_catalogue_version()}', modified
+
+    def get_basket_for_checkout(self):
+        """
+        The basket locked till the end of the transaction (a second checkout of it waits) with its items.
+        """
+        return self.user.orders.filter(state=BuyerOrderState.basket).select_for_update(of=('self',)) \
+            .prefetch_related('seller_orders__shop',
+                              Prefetch('seller_orders__ordered_items__product_info',
+                                       queryset=ProductInfo.objects.with_details())) \
+            .first()
 
     def create(self, request, *args, **kwargs):
+        """
+        Checkout of the basket: the stock of all items is decremented in one transaction or, if any item is short,
+        nothing is changed and the items which are short get the status with the available quantity.
+        """
         user = self.user
-
-        order = user.basket_queryset.prefetch_related('seller_orders_shop',
-                                                      'seller_orders_ordered_items',
-                                                      'seller_orders_ordered_items_product_info',
-                                                      'seller_orders_ordered_items_product_info_product').first()
-        if not order:
-            return Response({'error': 'no order to confirm'}, status=status.HTTP_204_NO_CONTENT)
-
         contact_id = request.data.get('contact')
+        demanded = {}
 
-        if not isinstance(contact_id, int) or contact_id <= 0:
-            return Response({'error': 'bad contact'}, status=status.HTTP_400_BAD_REQUEST)
-
-        users_contact = user.contacts.filter(id=contact_id).first()
-
-        if not users_contact:
-            return Response({'error': 'contact not found'}, status=status.HTTP_400_BAD_REQUEST)
-
-        all_orders = order.seller_orders.all()
-
-        acceptable_order = True
-        quantity_to_update = {}
-        ordered_items_strs = {}
-
-        for seller_order in all_orders:
-
-            ordered_items = seller_order.ordered_items.all()
-
-            for ordered_item in ordered_items:
-                ordered_product_info = PartnerProductInfoSerializer(ordered_item.product_info).data
-                ordered_quantity = ordered_item.quantity
-                available_quantity = ordered_product_info['quantity']
-                result_quantity = available_quantity - ordered_quantity
-
-                if result_quantity < 0:
-                    acceptable_order = False
-                    message = f'too many ordered. You ordered {ordered_quantity}, ' \
-                              f'but only {available_quantity} in stock'
-                    ordered_item.status = message
-
-                elif acceptable_order:
-                    quantity_to_update[ordered_product_info['id']] = result_quantity
-                    current_order_ordered_items_strs = ordered_items_strs.setdefault(seller_order.id, [])
-                    current_order_ordered_items_strs.append(f'id: {ordered_product_info["id"]}, '
-                                                            f'external_id: {ordered_product_info["external_id"]}, '
-                                                            f'quantity: {ordered_item.quantity}')
-
-        if acceptable_order:
-            current_date = timezone.now()
-            for seller_order in all_orders:
-
-                for ordered_item in seller_order.ordered_items.all():
-                    ordered_product_info_id = ordered_item.product_info.id
-                    ProductInfo.objects.filter(id=ordered_product_info_id) \
-                        .update(quantity=quantity_to_update[ordered_product_info_id])
-
-                seller_order.contact = users_contact
-                seller_order.state = SellerOrderState.new
-                seller_order.created_at = current_date
-                seller_order.save()
-
-                subject = f'New order {seller_order.id}'
-                message = f'{subject}\nProducts:\n{"".join(ordered_items_strs[seller_order.id])}\n' \
-                          f'Deliver to:\n{str(users_contact)}\n' \
-                          f'Result: {seller_order.summary}'
-
-                send_confirmation_email(seller_order.shop.email, subject=subject, message=message)
-
-            order.state = BuyerOrderState.accepted
-            order.created_at = current_date
-            order.save()
-
-            ordered_items = []
-            summary_shipping_price = 0
-
+        try:
+            with transaction.atomic():
+                order = self.get_basket_for_checkout()
+                if not order:
+                    return Response({'error': 'no order to confirm'}, status=status.HTTP_204_NO_CONTENT)
+
+                if not isinstance(contact_id, int) or contact_id <= 0:
+                    return Response({'error': 'bad contact'}, status=status.HTTP_400_BAD_REQUEST)
+
+                users_contact = user.contacts.filter(id=contact_id).first()
+
+                if not users_contact:
+                    return Response({'error': 'contact not found'}, status=status.HTTP_400_BAD_REQUEST)
+
+                all_orders = order.seller_orders.all()
+                for seller_order in all_orders:
+                    for ordered_item in seller_order.ordered_items.all():
+                        demanded[ordered_item.product_info_id] = \
+                            demanded.get(ordered_item.product_info_id, 0) + ordered_item.quantity
+
+                reserve_stock(demanded, order)
+                release_stock_holds(order)
+
+                current_date = timezone.now()
+                for seller_order in all_orders:
+                    seller_order.contact = users_contact
+                    seller_order.state = SellerOrderState.new
+                    seller_order.created_at = current_date
+                    seller_order.updated_at = current_date
+                SellerOrder.objects.bulk_update(all_orders, ['contact', 'state', 'created_at', 'updated_at'])
+
+                order.state = BuyerOrderState.accepted
+                order.created_at = current_date
+                order.save()
+                refresh_product_cards(demanded.keys())
+                bump_catalogue_version(*{seller_order.shop_id for seller_order in all_orders})
+
+        except StockShortage as error:
+            short = error.short if error.short is not None else get_stock_shortages(demanded, order)
             for seller_order in order.seller_orders.all():
                 for ordered_item in seller_order.ordered_items.all():
-                    product_info = ordered_item.product_info
-                    info = f'Product: {product_info.product.name}, ' \
-                           f'quantity: {ordered_item.quantity}, ' \
-                           f'total: {ordered_item.quantity * product_info.price}'
-                    ordered_items.append(info)
-                summary_shipping_price += seller_order.shipping_price
-
-            ordered_items = '\n'.join(ordered_items)
-
-            subject = f'Order {order.id}'
-            message = f'Thanks for {subject.lower()}!\n\n' \
-                      f'Ordered products: \n{ordered_items}\n' \
-                      f'Delivery to: \n\n{str(users_contact)}\n' \
-                      f'Total delivery price: {summary_shipping_price}\n' \
-                      f'Total: {order.total_sum}'
-
-            send_confirmation_email(user.email, subject=subject, message=message)
-
-        return Response(self.get_serializer(order).data,
-                        status=status.HTTP_201_CREATED if acceptable_order else status.HTTP_206_PARTIAL_CONTENT)
+                    if ordered_item.product_info_id in short:
+                        ordered_item.status = f'too many ordered. You ordered {ordered_item.quantity}, ' \
+                                              f'but only {short[ordered_item.product_info_id]} in stock'
+            return Response(self.get_serializer(order).data, status=status.HTTP_206_PARTIAL_CONTENT)
+
+        self.send_order_emails(user, order, users_contact)
+        return Response(self.get_serializer(order).data, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def send_order_emails(user, order, users_contact):
+        ordered_items = []
+        summary_shipping_price = 0
+
+        for seller_order in order.seller_orders.all():
+            ordered_items_strs = []
+            for ordered_item in seller_order.ordered_items.all():
+                product_info = ordered_item.product_info
+                ordered_items_strs.append(f'id: {product_info.id}, '
+                                          f'external_id: {product_info.external_id}, '
+                                          f'quantity: {ordered_item.quantity}')
+                ordered_items.append(f'Product: {product_info.product.name}, '
+                                     f'quantity: {ordered_item.quantity}, '
+                                     f'total: {ordered_item.quantity * product_info.price}')
+            summary_shipping_price += seller_order.shipping_price
+
+            subject = f'New order {seller_order.id}'
+            message = f'{subject}\nProducts:\n{"".join(ordered_items_strs)}\n' \
+                      f'Deliver to:\n{str(users_contact)}\n' \
+                      f'Result: {seller_order.summary}'
+
+            send_confirmation_email(seller_order.shop.email, subject=subject, message=message)
+
+        ordered_items = '\n'.join(ordered_items)
+
+        subject = f'Order {order.id}'
+        message = f'Thanks for {subject.lower()}!\n\n' \
+                  f'Ordered products: \n{ordered_items}\n' \
+                  f'Delivery to: \n\n{str(users_contact)}\n' \
+                  f'Total delivery price: {summary_shipping_price}\n' \
+                  f'Total: {order.total_sum}'
+
+        send_confirmation_email(user.email, subject=subject, message=message)
 
 
 class BuyerSellerOrderView(mixins.DestroyModelMixin,
@@ -510,16 +636,22 @@ class BuyerSellerOrderView(mixins.DestroyModelMixin,
         buyer_order = seller_order_instance.buyer_order
 
         if seller_order_instance.state == SellerOrderState.basket:
-            seller_order_instance.delete()
-
-            if not buyer_order.seller_orders.exists():
-                buyer_order.delete()
-                return
+            with transaction.atomic():
+                release_stock_holds(buyer_order, [ordered_item.product_info_id
+                                                  for ordered_item in seller_order_instance.ordered_items.all()])
+                seller_order_instance.delete()
+
+                if not buyer_order.seller_orders.exists():
+                    buyer_order.delete()
+                    return
+                BuyerOrder.objects.filter(id=buyer_order.id).update_totals(seller_orders=False)
         else:
-            seller_order_instance.rollback_product_quantity(buyer_order)
+            with transaction.atomic():
+                seller_order_instance.rollback_product_quantity(buyer_order)
 
-            seller_order_instance.state = SellerOrderState.canceled
-            seller_order_instance.save()
+                seller_order_instance.state = SellerOrderState.canceled
+                seller_order_instance.save()
+                BuyerOrder.objects.filter(id=buyer_order.id).update_totals(seller_orders=False)
 
             seller_email = seller_order_instance.shop.email
             subject = f'Order {seller_order_instance.id} cancelled'